@@ -715,3 +715,8 @@ function! leaderf#highlightDevIcons() abort
     exec g:Lf_py 'from leaderf.devicons import highlightDevIcons'
     exec g:Lf_py 'highlightDevIcons()'
 endfunction
+
+function! leaderf#FuzzyEngineIdle(timer_id) abort
+    exec g:Lf_py 'from leaderf.manager import releaseFuzzyEngineWorkers'
+    exec g:Lf_py 'releaseFuzzyEngineWorkers()'
+endfunction
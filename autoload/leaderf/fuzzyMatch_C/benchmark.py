@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+measure how fuzzyEngine scales with the number of the worker threads, run it after install.sh:
+    python benchmark.py [directory of the built extension] [thread count ...]
+
+the lines vary a lot in length, like the results of rg with a long context, so that an even split of
+the lines into chunks would keep a few workers busy while the others are idle.
+"""
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+if len(sys.argv) > 1:
+    BUILD_DIR = os.path.abspath(sys.argv[1])
+else:
+    BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+sys.path.insert(0, BUILD_DIR)
+
+import fuzzyEngine
+
+LINE_COUNT = 300000
+RUNS = 3
+
+
+def createLines():
+    random.seed(7)
+    lines = []
+    for i in range(LINE_COUNT):
+        n = 8 + random.randint(0, 40)
+        # a band of long lines in one region of the list
+        if LINE_COUNT // 3 <= i < LINE_COUNT // 3 + LINE_COUNT // 10:
+            n = 400 + random.randint(0, 600)
+        lines.append(''.join(random.choice('abcdefghij/_.xyz') for _ in range(n)))
+    return lines
+
+
+def measure(corpus, pattern, threads):
+    """
+    return the best time of RUNS matches with `threads` worker threads.
+    """
+    engine = fuzzyEngine.createFuzzyEngine(threads, False)
+    try:
+        # start the worker threads
+        fuzzyEngine.fuzzyMatch(engine=engine, source=corpus, pattern=pattern, sort_results=False)
+        best = float("inf")
+        for _ in range(RUNS):
+            start = time.time()
+            fuzzyEngine.fuzzyMatch(engine=engine, source=corpus, pattern=pattern, sort_results=False)
+            best = min(best, time.time() - start)
+        return best
+    finally:
+        fuzzyEngine.closeFuzzyEngine(engine)
+
+
+def main():
+    thread_counts = [int(n) for n in sys.argv[2:]] or [4, 16, 64]
+    corpus = fuzzyEngine.createCorpus(createLines())
+    pattern = fuzzyEngine.initPattern("abxz")
+
+    print("%d lines, best of %d runs, %d CPUs" % (LINE_COUNT, RUNS, multiprocessing.cpu_count()))
+    base = measure(corpus, pattern, 1)
+    print("threads= 1  %.3fs" % base)
+    for threads in thread_counts:
+        elapsed = measure(corpus, pattern, threads)
+        print("threads=%2d  %.3fs  speedup %.2fx" % (threads, elapsed, base / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -22,11 +22,13 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <time.h>
 
 #if defined(_MSC_VER)
 #include <windows.h>
 #else
 #include <pthread.h>
+#include <regex.h>
 #endif
 
 #include "fuzzyEngine.h"
@@ -82,6 +84,155 @@ typedef struct PySetTaskItem
     PyObject* py_source;
 }PySetTaskItem;
 
+typedef struct FeCorpusItem
+{
+    uint64_t offset;            /* offset of the text in the arena */
+    uint32_t len;
+    uint32_t basename_offset;   /* offset of the basename, relative to the text */
+    uint32_t digest_offset;     /* offset of the digest, relative to the text */
+    uint32_t digest_len;
+    uint64_t signature;         /* see getTextSignature() */
+    uint64_t basename_signature;
+}FeCorpusItem;
+
+typedef struct FeDigestKey
+{
+    uint32_t category;
+    uint32_t values[3];
+    uint32_t separator_len;
+    char     separator[256];
+}FeDigestKey;
+
+/* the number of the corpus items in a block, the posting lists of FeIndex are lists of blocks */
+#define INDEX_BLOCK_SIZE 8
+/* the characters are mapped to 64 classes the same way as getTextSignature(), a key is a pair of classes */
+#define INDEX_KEY_COUNT 4096
+
+typedef struct FePosting
+{
+    uint8_t*  data;         /* the differences between the adjacent blocks, in varints, see addPosting() */
+    uint32_t  size;
+    uint32_t  capacity;
+    uint32_t  count;        /* number of the blocks */
+    uint32_t  last_block;
+}FePosting;
+
+/**
+ * An index of a corpus maps an ordered pair of characters (x, y) to the blocks that have a text in which
+ * x occurs before y, ignoring case. a text can not match a pattern unless every pair of the adjacent
+ * characters of the pattern occurs in it in order, so only the blocks in all the posting lists of these
+ * pairs are matched, see getCandidates().
+ */
+typedef struct FeIndex
+{
+    FePosting   postings[INDEX_KEY_COUNT];
+    /* items[0, indexed_count) have been indexed */
+    uint32_t    indexed_count;
+    /* whether the digests rather than the whole texts are indexed, the digests are those of `digest_key` */
+    uint32_t    use_digest;
+    FeDigestKey digest_key;
+}FeIndex;
+
+/**
+ * A corpus owns the UTF-8 bytes of all the items in one contiguous arena,
+ * so that the items need not be converted from python objects every time
+ * they are matched.
+ */
+typedef struct FeCorpus
+{
+    char*         arena;
+    uint64_t      arena_size;
+    uint64_t      arena_capacity;
+    FeCorpusItem* items;
+    uint32_t      size;
+    uint32_t      capacity;
+    /* the digests of items[0, digest_count) have been computed with `digest_key` */
+    uint32_t      digest_count;
+    FeDigestKey   digest_key;
+    /* a list that holds the original python objects of the items */
+    PyObject*     py_source;
+    /* number of the calls that are matching the corpus with the GIL released */
+    uint32_t      readers;
+    /* NULL unless indexCorpus() is called */
+    FeIndex*      index;
+}FeCorpus;
+
+#define CORPUS_CAPSULE_NAME "fuzzyEngine.Corpus"
+
+/* the results of one or more calls of fuzzyMatch(), sorted by the weights, see appendAccumulator() */
+typedef struct FeRun
+{
+    PyObject* weights;
+    PyObject* items;    /* a list of items, or an index array if `return_array` is True */
+    uint32_t  size;
+}FeRun;
+
+/**
+ * An accumulator keeps the results of matching the chunks of a content one after another,
+ * so that the results of a new chunk need not be merged with all the previous results.
+ */
+typedef struct FeAccumulator
+{
+    FeRun*    runs;
+    uint32_t  run_count;
+    uint32_t  run_capacity;
+    uint32_t  size;         /* number of the results of all the runs */
+    PyObject* source;       /* the list that the index arrays refer to */
+}FeAccumulator;
+
+#define ACCUMULATOR_CAPSULE_NAME "fuzzyEngine.Accumulator"
+
+/* the items to be matched, either a python list or a range of a corpus */
+typedef struct FeSource
+{
+    PyObject* py_source;    /* the list that holds the python objects of the items */
+    FeCorpus* corpus;       /* NULL if the items come from a python list */
+    uint32_t  begin;        /* index of the first item in `py_source` */
+    uint32_t  size;
+}FeSource;
+
+/* the memory of a python object that supports the buffer protocol, e.g., array('f'), see getArray() */
+typedef struct FeArray
+{
+#if PY_MAJOR_VERSION >= 3
+    Py_buffer view;
+#endif
+    void*     data;
+    uint32_t  size;     /* number of the items */
+}FeArray;
+
+/**
+ * a scratch buffer that is reused by the calls instead of being allocated and freed every time,
+ * it only grows, unless it is much larger than needed for ARENA_TRIM_INTERVAL calls, see trimArena().
+ */
+typedef struct FeArena
+{
+    void*   buffer;
+    size_t  capacity;
+    size_t  peak;       /* the largest size reserved since the last trim */
+}FeArena;
+
+enum
+{
+    ARENA_SOURCE = 0,
+    ARENA_RESULTS,      /* for pEngine->results or pEngine->highlights */
+    ARENA_TASKS,
+    ARENA_MERGE,
+    ARENA_MERGE_TASKS,
+    ARENA_PY_SET_TASKS,
+    ARENA_COUNT
+};
+
+/* the phases of a call, whose durations are reported by stats() */
+enum
+{
+    PHASE_PREPARE = 0,  /* converting the python list or digesting the corpus */
+    PHASE_MATCH,
+    PHASE_SORT,
+    PHASE_BUILD,        /* building the python objects of the results */
+    PHASE_COUNT
+};
+
 typedef struct FeCircularQueue
 {
     void**          buffer;
@@ -116,6 +267,12 @@ struct FuzzyEngine
         {
             PatternContext* pPattern_ctxt;
             uint8_t         is_name_only;
+            /**
+             * the patterns that must all be matched in AND mode, see fuzzyMatchAnd(),
+             * or the name pattern and the path pattern in refine mode, see fuzzyMatchRefine()
+             */
+            PatternContext** pattern_ctxts;
+            uint32_t        pattern_count;
         };
         struct
         {
@@ -123,14 +280,45 @@ struct FuzzyEngine
             const char* suffix;
             const char* dirname;
         };
+        struct
+        {
+            const char* regex;  /* a POSIX extended regular expression, see regexMatch() */
+            int         regex_flags;
+        };
     };
     FeString*       source;
+    FeCorpus*       corpus;     /* if not NULL, the texts are read from corpus instead of `source` */
+    uint32_t        begin;      /* index of the first item being matched */
+    uint32_t        use_digest; /* whether to match the digests of the corpus items */
+    uint32_t        use_basename; /* whether the digests of the corpus items are the basenames */
+    /* whether pEngine->results are the candidates found in the index of the corpus, see getCandidates() */
+    uint32_t        use_candidates;
+    uint32_t        skip_len;   /* number of leading bytes of each text to ignore */
+    const weight_t* bonus;      /* see getBonus(), NULL if there is no bonus */
+    uint32_t        bonus_size;
+    /* if fewer items than this match, the others are matched again with typos, see computeWeights() */
+    uint32_t        typo_threshold;
+    uint32_t        bound_top_k;    /* the number of the best results of GET_WEIGHT_BOUND, see scoreBestResults() */
+    uint32_t        busy;       /* whether a call is using the engine, see acquireEngine() */
+    /* increased by cancel(), possibly while the workers are running */
+    volatile uint32_t generation;
+    uint32_t        task_generation; /* the generation when the running tasks are put */
+    /**
+     * the items in [cursor, cursor_end) have not been claimed by any worker yet,
+     * see claimChunk(), it is advanced by the workers without holding a lock.
+     */
+    volatile uint32_t cursor;
+    uint32_t        cursor_end;
     union
     {
         FeResult*        results;
         HighlightGroup** highlights;
     };
     FeCircularQueue task_queue;
+    FeArena         arenas[ARENA_COUNT];
+    uint32_t        call_count;     /* number of the calls that have released the arenas */
+    double          phase_start;    /* when the current phase of the current call started */
+    double          phase_times[PHASE_COUNT];   /* durations of the phases of the last call in seconds */
 };
 
 #if defined(_MSC_VER)
@@ -319,13 +507,44 @@ struct FuzzyEngine
 
 #endif
 
+#if defined(_MSC_VER)
+
+/* return the initial value of *ptr */
+#define ATOMIC_CAS(ptr, old_val, new_val)                                           \
+    ((uint32_t)InterlockedCompareExchange((volatile LONG*)(ptr), (LONG)(new_val), (LONG)(old_val)))
+
+#else
+
+/* return the initial value of *ptr */
+#define ATOMIC_CAS(ptr, old_val, new_val) __sync_val_compare_and_swap((ptr), (old_val), (new_val))
+
+#endif
+
 #define MIN(a, b) ((a) < (b) ? (a) : (b))
+#define MAX(a, b) ((a) > (b) ? (a) : (b))
+
+/* the arenas that are more than twice as large as needed are shrunk every ARENA_TRIM_INTERVAL calls */
+#define ARENA_TRIM_INTERVAL 64
 
 #define MAX_TASK_COUNT(cpu_count) ((cpu_count) << 3)
 
+/**
+ * the items are matched in chunks claimed from pEngine->cursor, a chunk is 1/CHUNK_DIVISOR
+ * of the remaining items per worker, but no smaller than MIN_CHUNK_SIZE.
+ */
+#define CHUNK_DIVISOR   4
+#define MIN_CHUNK_SIZE  1024
+
+/* how many items are matched between two checks whether the tasks are cancelled */
+#define CANCEL_CHECK_INTERVAL 1024
+
+#define IS_CANCELLED(pEngine) ((pEngine)->generation != (pEngine)->task_generation)
+
 enum
 {
     GET_WEIGHT = 0,
+    GET_WEIGHT_AND,
+    GET_WEIGHT_REFINE,
     GET_HIGHLIGHTS,
     GET_PATH_WEIGHT,
     Q_SORT,
@@ -333,7 +552,19 @@ enum
     MERGE,
     MERGE_2,
     PY_SET_ITEM,
-    PY_SET_ITEM_2
+    PY_SET_ITEM_2,
+    REGEX_MATCH,
+    GET_TYPO_WEIGHT,
+    GET_WEIGHT_BOUND,
+    GET_BEST_WEIGHT
+};
+
+/* the result of REGEX_MATCH, which is kept in FeResult.path_weight */
+enum
+{
+    REGEX_NOT_MATCHED = 0,
+    REGEX_MATCHED,
+    REGEX_UNDECIDED     /* the text is left to the caller */
 };
 
 /* sort in descending order */
@@ -353,1046 +584,3831 @@ static int compare2(const void* a, const void* b)
     return (int)wb - (int)wa;
 }
 
-#if defined(_MSC_VER)
-static DWORD WINAPI _worker(LPVOID pParam)
-#else
-static void* _worker(void* pParam)
-#endif
+/**
+ * move the `k` results that come first in the order of `cmp` to the front of `results`,
+ * they are not sorted.
+ */
+static void selectTopK(FeResult* results, uint32_t size, uint32_t k, int (*cmp)(const void*, const void*))
 {
-    FuzzyEngine* pEngine = (FuzzyEngine*)pParam;
-
-    while ( 1 )
+    int64_t left = 0;
+    int64_t right = (int64_t)size - 1;
+    int64_t nth = (int64_t)k - 1;
+    while ( left < right )
     {
-        TaskItem* pTask = NULL;
-        QUEUE_GET(pEngine->task_queue, TaskItem*, pTask);
+        int64_t mid = left + ((right - left) >> 1);
+        FeResult tmp;
+        if ( cmp(results + mid, results + left) < 0 )
+        {
+            tmp = results[mid]; results[mid] = results[left]; results[left] = tmp;
+        }
+        if ( cmp(results + right, results + left) < 0 )
+        {
+            tmp = results[right]; results[right] = results[left]; results[left] = tmp;
+        }
+        if ( cmp(results + right, results + mid) < 0 )
+        {
+            tmp = results[right]; results[right] = results[mid]; results[mid] = tmp;
+        }
 
-        if ( pTask )
+        FeResult pivot = results[mid];
+        int64_t i = left;
+        int64_t j = right;
+        while ( i <= j )
         {
-            switch ( pTask->function )
+            while ( cmp(results + i, &pivot) < 0 )
+                ++i;
+            while ( cmp(results + j, &pivot) > 0 )
+                --j;
+            if ( i <= j )
             {
-            case GET_WEIGHT:
-                {
-                    FeString* tasks = pEngine->source + pTask->offset;
-                    FeResult* results = pEngine->results + pTask->offset;
-                    uint32_t length = pTask->length;
-                    uint32_t i = 0;
-                    for ( ; i < length; ++i )
-                    {
-                        results[i].weight = getWeight(tasks[i].str, tasks[i].len,
-                                                      pEngine->pPattern_ctxt, pEngine->is_name_only);
-                        results[i].index = pTask->offset + i;
-                    }
-                }
-                break;
-            case GET_HIGHLIGHTS:
-                {
-                    FeString* tasks = pEngine->source + pTask->offset;
-                    HighlightGroup** results = pEngine->highlights + pTask->offset;
-                    uint32_t length = pTask->length;
-                    uint32_t i = 0;
-                    for ( ; i < length; ++i )
-                    {
-                        results[i] = getHighlights(tasks[i].str, tasks[i].len,
-                                                   pEngine->pPattern_ctxt, pEngine->is_name_only);
-                    }
-                }
-                break;
-            case GET_PATH_WEIGHT:
-                {
-                    FeString* tasks = pEngine->source + pTask->offset;
-                    FeResult* results = pEngine->results + pTask->offset;
-                    uint32_t length = pTask->length;
-                    uint32_t i = 0;
-                    for ( ; i < length; ++i )
-                    {
-                        results[i].path_weight = getPathWeight(pEngine->filename, pEngine->suffix, pEngine->dirname, tasks[i].str, tasks[i].len);
-                        results[i].index = pTask->offset + i;
-                    }
-                }
-                break;
-            case Q_SORT:
-                {
-                    FeResult* tasks = pEngine->results + pTask->offset;
-                    qsort(tasks, pTask->length, sizeof(FeResult), compare);
-                }
-                break;
-            case Q_SORT_2:
-                {
-                    FeResult* tasks = pEngine->results + pTask->offset;
-                    qsort(tasks, pTask->length, sizeof(FeResult), compare2);
-                }
-                break;
-            case MERGE:
-                {
-                    MergeTaskItem* pMergeTask = (MergeTaskItem*)pTask;
-                    FeResult* list_1 = pEngine->results + pMergeTask->offset_1;
-                    FeResult* list_2 = list_1 + pMergeTask->length_1;
-                    FeResult* buffer = pMergeTask->buffer;
-                    memcpy(buffer, list_2, pMergeTask->length_2 * sizeof(FeResult));
-                    int32_t i = pMergeTask->length_1 - 1;
-                    int32_t j = pMergeTask->length_2 - 1;
-                    int32_t k = pMergeTask->length_1 + j;
-                    while ( i >= 0 && j >= 0 )
-                    {
-                        if ( list_1[i].weight < buffer[j].weight )
-                        {
-                            list_1[k--] = list_1[i--];
-                        }
-                        else
-                        {
-                            list_1[k--] = buffer[j--];
-                        }
-                    }
-                    while ( j >= 0 )
-                    {
-                        list_1[k--] = buffer[j--];
-                    }
-                }
-                break;
-            case MERGE_2:
-                {
-                    MergeTaskItem* pMergeTask = (MergeTaskItem*)pTask;
-                    FeResult* list_1 = pEngine->results + pMergeTask->offset_1;
-                    FeResult* list_2 = list_1 + pMergeTask->length_1;
-                    FeResult* buffer = pMergeTask->buffer;
-                    memcpy(buffer, list_2, pMergeTask->length_2 * sizeof(FeResult));
-                    int32_t i = pMergeTask->length_1 - 1;
-                    int32_t j = pMergeTask->length_2 - 1;
-                    int32_t k = pMergeTask->length_1 + j;
-                    while ( i >= 0 && j >= 0 )
-                    {
-                        if ( list_1[i].path_weight < buffer[j].path_weight )
-                        {
-                            list_1[k--] = list_1[i--];
-                        }
-                        else
-                        {
-                            list_1[k--] = buffer[j--];
-                        }
-                    }
-                    while ( j >= 0 )
-                    {
-                        list_1[k--] = buffer[j--];
-                    }
-                }
-                break;
-            case PY_SET_ITEM:
-                {
-                    PySetTaskItem* pPySetTask = (PySetTaskItem*)pTask;
-                    weight_t* weights = pPySetTask->weights + pPySetTask->offset;
-                    FeResult* results = pEngine->results + pPySetTask->offset;
-                    PyObject* text_list = pPySetTask->text_list;
-                    PyObject* py_source = pPySetTask->py_source;
-                    uint32_t i = 0;
-                    uint32_t length = pPySetTask->length;
-
-                    for ( i = 0; i < length; ++i )
-                    {
-                        weights[i] = results[i].weight;
-                        PyObject* item = PyList_GET_ITEM(py_source, results[i].index);
-                        Py_INCREF(item);
-                        /* PyList_SET_ITEM() steals a reference to item.     */
-                        PyList_SET_ITEM(text_list, pPySetTask->offset + i, item);
-                    }
-                }
-                break;
-            case PY_SET_ITEM_2:
-                {
-                    PySetTaskItem* pPySetTask = (PySetTaskItem*)pTask;
-                    uint32_t* path_weights = pPySetTask->path_weights + pPySetTask->offset;
-                    FeResult* results = pEngine->results + pPySetTask->offset;
-                    PyObject* text_list = pPySetTask->text_list;
-                    PyObject* py_source = pPySetTask->py_source;
-                    uint32_t i = 0;
-                    uint32_t length = pPySetTask->length;
-
-                    for ( i = 0; i < length; ++i )
-                    {
-                        path_weights[i] = results[i].path_weight;
-                        PyObject* item = PyList_GET_ITEM(py_source, results[i].index);
-                        Py_INCREF(item);
-                        /* PyList_SET_ITEM() steals a reference to item.     */
-                        PyList_SET_ITEM(text_list, pPySetTask->offset + i, item);
-                    }
-                }
-                break;
+                tmp = results[i]; results[i] = results[j]; results[j] = tmp;
+                ++i;
+                --j;
             }
-
-            QUEUE_TASK_DONE(pEngine->task_queue);
         }
+
+        if ( nth <= j )
+            right = j;
+        else if ( nth >= i )
+            left = i;
         else
-        {
             break;
-        }
     }
-
-#if defined(_MSC_VER)
-    return 0;
-#else
-    return NULL;
-#endif
 }
 
-FuzzyEngine* createFuzzyEngine(uint32_t cpu_count)
+/* return the offset of the basename of a path */
+/**
+ * return a buffer of at least `size` bytes, the content of the previous reservation is not kept.
+ */
+static void* reserveArena(FeArena* pArena, size_t size)
 {
-    FuzzyEngine* pEngine = (FuzzyEngine*)malloc(sizeof(FuzzyEngine));
-    if ( !pEngine )
-    {
-        return NULL;
-    }
-
-    pEngine->cpu_count = cpu_count;
-    pEngine->threads = NULL;
-    pEngine->pPattern_ctxt = NULL;
-    pEngine->source = NULL;
-
-    int32_t ret = 0;
-    QUEUE_INIT(pEngine->task_queue, MAX_TASK_COUNT(cpu_count) + cpu_count + 1, ret);
-    if ( ret != 0 )
+    size = MAX(size, 1);
+    pArena->peak = MAX(pArena->peak, size);
+    if ( size > pArena->capacity )
     {
-        free(pEngine);
-        return NULL;
+        /* grow by at least 1/2, so that a growing source does not reallocate every time */
+        size_t capacity = MAX(size, pArena->capacity + (pArena->capacity >> 1));
+        free(pArena->buffer);
+        pArena->buffer = malloc(capacity);
+        pArena->capacity = pArena->buffer ? capacity : 0;
     }
 
-    return pEngine;
+    return pArena->buffer;
 }
 
-void closeFuzzyEngine(FuzzyEngine* pEngine)
+static void freeArena(FeArena* pArena)
 {
-    if ( !pEngine )
-        return;
+    free(pArena->buffer);
+    pArena->buffer = NULL;
+    pArena->capacity = 0;
+    pArena->peak = 0;
+}
 
-    /**
-     * pEngine->threads is NULL if fuzzyMatch() is not called,
-     * or fuzzyMatch() returns before malloc for pEngine->threads.
-     */
-    if ( pEngine->threads )
+/* shrink the arena to the largest size reserved since the last trim if it is more than twice as large */
+static void trimArena(FeArena* pArena)
+{
+    if ( pArena->peak == 0 )
     {
-        uint32_t i = 0;
-        for ( ; i < pEngine->cpu_count; ++i )
+        freeArena(pArena);
+    }
+    else if ( pArena->capacity > (pArena->peak << 1) )
+    {
+        void* buffer = realloc(pArena->buffer, pArena->peak);
+        if ( buffer )
         {
-            QUEUE_PUT(pEngine->task_queue, NULL);
+            pArena->buffer = buffer;
+            pArena->capacity = pArena->peak;
         }
+    }
+    pArena->peak = 0;
+}
 
+/* return the time in seconds from an arbitrary point */
+static double getTime(void)
+{
 #if defined(_MSC_VER)
-        WaitForMultipleObjects(pEngine->cpu_count, pEngine->threads, TRUE, INFINITE);
-        for ( i = 0; i < pEngine->cpu_count; ++i )
-        {
-            CloseHandle(pEngine->threads[i]);
-        }
+    LARGE_INTEGER frequency;
+    LARGE_INTEGER counter;
+    QueryPerformanceFrequency(&frequency);
+    QueryPerformanceCounter(&counter);
+    return (double)counter.QuadPart / (double)frequency.QuadPart;
 #else
-        for ( i = 0; i < pEngine->cpu_count; ++i )
-        {
-            pthread_join(pEngine->threads[i], NULL);
-        }
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double)ts.tv_sec + (double)ts.tv_nsec * 1e-9;
 #endif
-        free(pEngine->threads);
-    }
+}
 
-    QUEUE_DESTROY(pEngine->task_queue);
-    free(pEngine);
+static void startPhases(FuzzyEngine* pEngine)
+{
+    memset(pEngine->phase_times, 0, sizeof(pEngine->phase_times));
+    pEngine->phase_start = getTime();
 }
 
-static int32_t pyObject_ToStringAndSize(PyObject* obj, char** buffer, uint32_t* size)
+/* the time since the end of the previous phase is counted as `phase` */
+static void endPhase(FuzzyEngine* pEngine, uint32_t phase)
 {
-    Py_ssize_t length = 0;
-#if PY_MAJOR_VERSION >= 3
-    *buffer = (char*)PyUnicode_AsUTF8AndSize(obj, &length);
-    *size = (uint32_t)length;
-    if ( buffer )
-        return 0;
-    else
-        return -1;
-#else
-    int ret = PyString_AsStringAndSize(obj, buffer, &length);
-    *size = (uint32_t)length;
-    if ( ret >= 0 )
-        return 0;
-    else
-        return -1;
-#endif
+    double now = getTime();
+    pEngine->phase_times[phase] += now - pEngine->phase_start;
+    pEngine->phase_start = now;
 }
 
-static void delFuzzyEngine(PyObject* obj)
+static uint32_t getBasenameOffset(const char* path, uint32_t len)
 {
-    closeFuzzyEngine((FuzzyEngine*)PyCapsule_GetPointer(obj, NULL));
+    const char* p = path + len - 1;
+    for ( ; p >= path; --p )
+    {
+        if ( *p == '/' || *p == '\\' )
+        {
+            return (uint32_t)(p + 1 - path);
+        }
+    }
+
+    return 0;
 }
 
 /**
- * createFuzzyEngine(cpu_count, auto_free=False)
- *
- * `auto_free` is optional that specifies whether auto free the fuzzyEngine object.
- *      It defaults to `False`, which means do not auto free the fuzzyEngine object,
- *      so that you should call closeFuzzyEngine() manually.
- *  return a fuzzyEngine object
+ * return 1 if all the bytes of the text are ASCII characters other than NUL,
+ * only such texts are matched by regexMatch(), the rest depend on the encoding.
  */
-static PyObject* fuzzyEngine_createFuzzyEngine(PyObject* self, PyObject* args, PyObject* kwargs)
+static int32_t isAsciiText(const char* text, uint32_t len)
 {
-    uint32_t cpu_count;
-    uint8_t  auto_free = 0;
-    static char* kwlist[] = {"cpu_count", "auto_free", NULL};
+    uint32_t i = 0;
+    for ( ; i < len; ++i )
+    {
+        if ( (uint8_t)(text[i] - 1) >= 0x7F )
+            return 0;
+    }
 
-    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "I|b:createFuzzyEngine", kwlist, &cpu_count, &auto_free) )
-        return NULL;
+    return 1;
+}
 
-    FuzzyEngine* pEngine = createFuzzyEngine(cpu_count);
+/* get the text of the i-th item being matched */
+static void getSourceText(FuzzyEngine* pEngine, uint32_t i, char** str, uint32_t* len)
+{
+    if ( pEngine->corpus )
+    {
+        FeCorpusItem* pItem = pEngine->corpus->items + pEngine->begin + i;
+        *str = pEngine->corpus->arena + pItem->offset;
+        if ( pEngine->use_digest )
+        {
+            *str += pItem->digest_offset;
+            *len = pItem->digest_len;
+        }
+        else
+        {
+            *len = pItem->len;
+        }
+    }
+    else
+    {
+        *str = pEngine->source[i].str;
+        *len = pEngine->source[i].len;
+    }
 
-    return PyCapsule_New(pEngine, NULL, auto_free ? delFuzzyEngine : NULL);
+    if ( pEngine->skip_len > 0 && *len >= pEngine->skip_len )
+    {
+        *str += pEngine->skip_len;
+        *len -= pEngine->skip_len;
+    }
 }
 
 /**
- * closeFuzzyEngine(engine)
+ * the items of GET_WEIGHT, GET_WEIGHT_AND, GET_WEIGHT_REFINE, GET_PATH_WEIGHT, REGEX_MATCH, GET_TYPO_WEIGHT,
+ * GET_WEIGHT_BOUND and GET_BEST_WEIGHT vary a lot in length, so they are not divided into chunks of the same
+ * size in advance, but claimed by the workers in chunks from pEngine->cursor, see claimChunk().
  */
-static PyObject* fuzzyEngine_closeFuzzyEngine(PyObject* self, PyObject* args)
+static int32_t isDynamicTask(uint32_t function)
 {
-    PyObject* engine = NULL;
-    if ( !PyArg_ParseTuple(args, "O:closeFuzzyEngine", &engine) )
-        return NULL;
-
-    closeFuzzyEngine((FuzzyEngine*)PyCapsule_GetPointer(engine, NULL));
-
-    Py_RETURN_NONE;
+    return function == GET_WEIGHT || function == GET_WEIGHT_AND || function == GET_WEIGHT_REFINE
+        || function == GET_PATH_WEIGHT || function == REGEX_MATCH || function == GET_TYPO_WEIGHT
+        || function == GET_WEIGHT_BOUND || function == GET_BEST_WEIGHT;
 }
 
-static void delPatternContext(PyObject* obj)
+/**
+ * claim the next chunk of the items in [pEngine->cursor, pEngine->cursor_end),
+ * the chunks shrink as the remaining items decrease, so that the workers finish at about the same time.
+ *
+ * return the length of the chunk, 0 if no item is left.
+ */
+static uint32_t claimChunk(FuzzyEngine* pEngine, uint32_t* pOffset)
+{
+    uint32_t offset = pEngine->cursor;
+    while ( offset < pEngine->cursor_end )
+    {
+        uint32_t remaining = pEngine->cursor_end - offset;
+        uint32_t length = remaining / (pEngine->cpu_count * CHUNK_DIVISOR);
+        if ( length < MIN_CHUNK_SIZE )
+        {
+            length = MIN(MIN_CHUNK_SIZE, remaining);
+        }
+
+        uint32_t old_offset = ATOMIC_CAS(&pEngine->cursor, offset, offset + length);
+        if ( old_offset == offset )
+        {
+            *pOffset = offset;
+            return length;
+        }
+        offset = old_offset;
+    }
+
+    return 0;
+}
+
+#if !defined(_MSC_VER)
+/**
+ * the task of REGEX_MATCH, pRegex is NULL if pEngine->regex failed to compile.
+ */
+static void runRegexTask(FuzzyEngine* pEngine, TaskItem* pTask, const regex_t* pRegex)
+{
+    FeResult* results = pEngine->results + pTask->offset;
+    uint32_t length = pTask->length;
+#if !defined(REG_STARTEND)
+    char* buffer = NULL;
+    uint32_t buffer_size = 0;
+#endif
+    uint32_t i = 0;
+    for ( ; i < length; ++i )
+    {
+        if ( i % CANCEL_CHECK_INTERVAL == 0 && IS_CANCELLED(pEngine) )
+            break;
+
+        char* str;
+        uint32_t len;
+        getSourceText(pEngine, pTask->offset + i, &str, &len);
+        results[i].index = pEngine->begin + pTask->offset + i;
+        if ( !pRegex || !isAsciiText(str, len) )
+        {
+            results[i].path_weight = REGEX_UNDECIDED;
+            continue;
+        }
+
+        /* the digest of a text may not be NUL-terminated */
+#if defined(REG_STARTEND)
+        regmatch_t pmatch[1];
+        pmatch[0].rm_so = 0;
+        pmatch[0].rm_eo = len;
+        results[i].path_weight = regexec(pRegex, str, 1, pmatch, REG_STARTEND) == 0
+                                 ? REGEX_MATCHED : REGEX_NOT_MATCHED;
+#else
+        if ( str[len] != '\0' )
+        {
+            if ( len >= buffer_size )
+            {
+                free(buffer);
+                buffer_size = len + 1;
+                buffer = (char*)malloc(buffer_size);
+                if ( !buffer )
+                {
+                    buffer_size = 0;
+                    results[i].path_weight = REGEX_UNDECIDED;
+                    continue;
+                }
+            }
+            memcpy(buffer, str, len);
+            buffer[len] = '\0';
+            str = buffer;
+        }
+        results[i].path_weight = regexec(pRegex, str, 0, NULL, 0) == 0
+                                 ? REGEX_MATCHED : REGEX_NOT_MATCHED;
+#endif
+    }
+#if !defined(REG_STARTEND)
+    free(buffer);
+#endif
+}
+#endif
+
+static void runTask(FuzzyEngine* pEngine, TaskItem* pTask)
+{
+    switch ( pTask->function )
+    {
+    case GET_WEIGHT:
+    case GET_WEIGHT_BOUND:
+        {
+            FeResult* results = pEngine->results + pTask->offset;
+            uint32_t length = pTask->length;
+            uint64_t pattern_signature = pEngine->pPattern_ctxt->signature;
+            FeCorpusItem* items = NULL;
+            if ( pEngine->corpus )
+            {
+                items = pEngine->corpus->items + pEngine->begin;
+            }
+            uint32_t i = 0;
+            for ( ; i < length; ++i )
+            {
+                if ( i % CANCEL_CHECK_INTERVAL == 0 && IS_CANCELLED(pEngine) )
+                    break;
+
+                /* the position of the item in the source */
+                uint32_t k = pTask->offset + i;
+                if ( pEngine->use_candidates )
+                    k = results[i].index - pEngine->begin;
+                else
+                    results[i].index = pEngine->begin + k;
+
+                if ( items )
+                {
+                    /* the digest has no more characters than the whole text */
+                    uint64_t signature = pEngine->use_basename ? items[k].basename_signature
+                                                               : items[k].signature;
+                    if ( (pattern_signature & ~signature) != 0 )
+                    {
+                        results[i].weight = MIN_WEIGHT;
+                        continue;
+                    }
+                }
+
+                char* str;
+                uint32_t len;
+                getSourceText(pEngine, k, &str, &len);
+                weight_t weight = pTask->function == GET_WEIGHT
+                                  ? getWeight(str, len, pEngine->pPattern_ctxt, pEngine->is_name_only)
+                                  : getWeightBound(str, len, pEngine->pPattern_ctxt, pEngine->is_name_only);
+                if ( weight > MIN_WEIGHT && results[i].index < pEngine->bonus_size )
+                    weight += pEngine->bonus[results[i].index];
+                results[i].weight = weight;
+            }
+        }
+        break;
+    case GET_BEST_WEIGHT:
+        {
+            /* the items are the results of GET_WEIGHT_BOUND, see scoreBestResults() */
+            FeResult* results = pEngine->results + pTask->offset;
+            uint32_t length = pTask->length;
+            uint32_t i = 0;
+            for ( ; i < length; ++i )
+            {
+                if ( i % CANCEL_CHECK_INTERVAL == 0 && IS_CANCELLED(pEngine) )
+                    break;
+
+                /* matched with typos, see GET_TYPO_WEIGHT */
+                if ( results[i].weight <= TYPO_WEIGHT )
+                    continue;
+
+                char* str;
+                uint32_t len;
+                getSourceText(pEngine, results[i].index - pEngine->begin, &str, &len);
+                weight_t weight = getWeight(str, len, pEngine->pPattern_ctxt, pEngine->is_name_only);
+                if ( weight > MIN_WEIGHT && results[i].index < pEngine->bonus_size )
+                    weight += pEngine->bonus[results[i].index];
+                results[i].weight = weight;
+            }
+        }
+        break;
+    case GET_TYPO_WEIGHT:
+        {
+            /* only the items that do not match in GET_WEIGHT are matched again */
+            FeResult* results = pEngine->results + pTask->offset;
+            uint32_t length = pTask->length;
+            uint32_t i = 0;
+            for ( ; i < length; ++i )
+            {
+                if ( i % CANCEL_CHECK_INTERVAL == 0 && IS_CANCELLED(pEngine) )
+                    break;
+
+                if ( results[i].weight > MIN_WEIGHT )
+                    continue;
+
+                char* str;
+                uint32_t len;
+                getSourceText(pEngine, pTask->offset + i, &str, &len);
+                results[i].weight = getTypoWeight(str, len, pEngine->pPattern_ctxt);
+            }
+        }
+        break;
+    case GET_WEIGHT_AND:
+        {
+            FeResult* results = pEngine->results + pTask->offset;
+            uint32_t length = pTask->length;
+            PatternContext** pattern_ctxts = pEngine->pattern_ctxts;
+            uint32_t pattern_count = pEngine->pattern_count;
+            uint64_t pattern_signature = 0;
+            uint32_t k = 0;
+            for ( ; k < pattern_count; ++k )
+            {
+                pattern_signature |= pattern_ctxts[k]->signature;
+            }
+
+            FeCorpusItem* items = NULL;
+            if ( pEngine->corpus )
+            {
+                items = pEngine->corpus->items + pEngine->begin + pTask->offset;
+            }
+            uint32_t i = 0;
+            for ( ; i < length; ++i )
+            {
+                if ( i % CANCEL_CHECK_INTERVAL == 0 && IS_CANCELLED(pEngine) )
+                    break;
+
+                results[i].index = pEngine->begin + pTask->offset + i;
+                if ( items && (pattern_signature & ~items[i].signature) != 0 )
+                {
+                    results[i].weight = MIN_WEIGHT;
+                    continue;
+                }
+
+                char* str;
+                uint32_t len;
+                getSourceText(pEngine, pTask->offset + i, &str, &len);
+                /* the weight is the sum of the weights of all the patterns */
+                weight_t weight = 0;
+                for ( k = 0; k < pattern_count; ++k )
+                {
+                    weight_t w = getWeight(str, len, pattern_ctxts[k], pEngine->is_name_only);
+                    if ( w <= MIN_WEIGHT )
+                    {
+                        weight = MIN_WEIGHT;
+                        break;
+                    }
+                    weight += w;
+                }
+                results[i].weight = weight;
+            }
+        }
+        break;
+    case GET_WEIGHT_REFINE:
+        {
+            FeResult* results = pEngine->results + pTask->offset;
+            uint32_t length = pTask->length;
+            PatternContext* pName_ctxt = pEngine->pattern_ctxts[0];
+            PatternContext* pPath_ctxt = pEngine->pattern_ctxts[1];
+            FeCorpusItem* items = NULL;
+            if ( pEngine->corpus )
+            {
+                items = pEngine->corpus->items + pEngine->begin + pTask->offset;
+            }
+            uint32_t i = 0;
+            for ( ; i < length; ++i )
+            {
+                if ( i % CANCEL_CHECK_INTERVAL == 0 && IS_CANCELLED(pEngine) )
+                    break;
+
+                results[i].index = pEngine->begin + pTask->offset + i;
+                /* the directory name has no more characters than the whole text */
+                if ( items && ((pName_ctxt->signature & ~items[i].basename_signature)
+                               | (pPath_ctxt->signature & ~items[i].signature)) != 0 )
+                {
+                    results[i].weight = MIN_WEIGHT;
+                    continue;
+                }
+
+                char* str;
+                uint32_t len;
+                getSourceText(pEngine, pTask->offset + i, &str, &len);
+                uint32_t basename_offset = items ? items[i].basename_offset : getBasenameOffset(str, len);
+                weight_t name_weight = getWeight(str + basename_offset, len - basename_offset, pName_ctxt, 1);
+                if ( name_weight <= MIN_WEIGHT )
+                {
+                    results[i].weight = MIN_WEIGHT;
+                    continue;
+                }
+
+                weight_t path_weight = getWeight(str, basename_offset, pPath_ctxt, 0);
+                results[i].weight = path_weight <= MIN_WEIGHT ? MIN_WEIGHT : name_weight + path_weight;
+            }
+        }
+        break;
+    case GET_HIGHLIGHTS:
+        {
+            FeString* tasks = pEngine->source + pTask->offset;
+            HighlightGroup** results = pEngine->highlights + pTask->offset;
+            uint32_t length = pTask->length;
+            uint32_t i = 0;
+            for ( ; i < length; ++i )
+            {
+                results[i] = getHighlights(tasks[i].str, tasks[i].len,
+                                           pEngine->pPattern_ctxt, pEngine->is_name_only);
+            }
+        }
+        break;
+    case GET_PATH_WEIGHT:
+        {
+            FeResult* results = pEngine->results + pTask->offset;
+            uint32_t length = pTask->length;
+            uint32_t i = 0;
+            for ( ; i < length; ++i )
+            {
+                if ( i % CANCEL_CHECK_INTERVAL == 0 && IS_CANCELLED(pEngine) )
+                    break;
+
+                char* str;
+                uint32_t len;
+                getSourceText(pEngine, pTask->offset + i, &str, &len);
+                results[i].path_weight = getPathWeight(pEngine->filename, pEngine->suffix, pEngine->dirname, str, len);
+                results[i].index = pEngine->begin + pTask->offset + i;
+            }
+        }
+        break;
+    case Q_SORT:
+        {
+            FeResult* tasks = pEngine->results + pTask->offset;
+            qsort(tasks, pTask->length, sizeof(FeResult), compare);
+        }
+        break;
+    case Q_SORT_2:
+        {
+            FeResult* tasks = pEngine->results + pTask->offset;
+            qsort(tasks, pTask->length, sizeof(FeResult), compare2);
+        }
+        break;
+    case MERGE:
+        {
+            MergeTaskItem* pMergeTask = (MergeTaskItem*)pTask;
+            FeResult* list_1 = pEngine->results + pMergeTask->offset_1;
+            FeResult* list_2 = list_1 + pMergeTask->length_1;
+            FeResult* buffer = pMergeTask->buffer;
+            memcpy(buffer, list_2, pMergeTask->length_2 * sizeof(FeResult));
+            int32_t i = pMergeTask->length_1 - 1;
+            int32_t j = pMergeTask->length_2 - 1;
+            int32_t k = pMergeTask->length_1 + j;
+            while ( i >= 0 && j >= 0 )
+            {
+                if ( list_1[i].weight < buffer[j].weight )
+                {
+                    list_1[k--] = list_1[i--];
+                }
+                else
+                {
+                    list_1[k--] = buffer[j--];
+                }
+            }
+            while ( j >= 0 )
+            {
+                list_1[k--] = buffer[j--];
+            }
+        }
+        break;
+    case MERGE_2:
+        {
+            MergeTaskItem* pMergeTask = (MergeTaskItem*)pTask;
+            FeResult* list_1 = pEngine->results + pMergeTask->offset_1;
+            FeResult* list_2 = list_1 + pMergeTask->length_1;
+            FeResult* buffer = pMergeTask->buffer;
+            memcpy(buffer, list_2, pMergeTask->length_2 * sizeof(FeResult));
+            int32_t i = pMergeTask->length_1 - 1;
+            int32_t j = pMergeTask->length_2 - 1;
+            int32_t k = pMergeTask->length_1 + j;
+            while ( i >= 0 && j >= 0 )
+            {
+                if ( list_1[i].path_weight < buffer[j].path_weight )
+                {
+                    list_1[k--] = list_1[i--];
+                }
+                else
+                {
+                    list_1[k--] = buffer[j--];
+                }
+            }
+            while ( j >= 0 )
+            {
+                list_1[k--] = buffer[j--];
+            }
+        }
+        break;
+    case PY_SET_ITEM:
+        {
+            PySetTaskItem* pPySetTask = (PySetTaskItem*)pTask;
+            weight_t* weights = pPySetTask->weights + pPySetTask->offset;
+            FeResult* results = pEngine->results + pPySetTask->offset;
+            PyObject* text_list = pPySetTask->text_list;
+            PyObject* py_source = pPySetTask->py_source;
+            uint32_t i = 0;
+            uint32_t length = pPySetTask->length;
+
+            for ( i = 0; i < length; ++i )
+            {
+                weights[i] = results[i].weight;
+                PyObject* item = PyList_GET_ITEM(py_source, results[i].index);
+                Py_INCREF(item);
+                /* PyList_SET_ITEM() steals a reference to item.     */
+                PyList_SET_ITEM(text_list, pPySetTask->offset + i, item);
+            }
+        }
+        break;
+    case PY_SET_ITEM_2:
+        {
+            PySetTaskItem* pPySetTask = (PySetTaskItem*)pTask;
+            uint32_t* path_weights = pPySetTask->path_weights + pPySetTask->offset;
+            FeResult* results = pEngine->results + pPySetTask->offset;
+            PyObject* text_list = pPySetTask->text_list;
+            PyObject* py_source = pPySetTask->py_source;
+            uint32_t i = 0;
+            uint32_t length = pPySetTask->length;
+
+            for ( i = 0; i < length; ++i )
+            {
+                path_weights[i] = results[i].path_weight;
+                PyObject* item = PyList_GET_ITEM(py_source, results[i].index);
+                Py_INCREF(item);
+                /* PyList_SET_ITEM() steals a reference to item.     */
+                PyList_SET_ITEM(text_list, pPySetTask->offset + i, item);
+            }
+        }
+        break;
+    }
+}
+
+#if defined(_MSC_VER)
+static DWORD WINAPI _worker(LPVOID pParam)
+#else
+static void* _worker(void* pParam)
+#endif
+{
+    FuzzyEngine* pEngine = (FuzzyEngine*)pParam;
+
+    while ( 1 )
+    {
+        TaskItem* pTask = NULL;
+        QUEUE_GET(pEngine->task_queue, TaskItem*, pTask);
+
+        if ( pTask )
+        {
+#if !defined(_MSC_VER)
+            if ( pTask->function == REGEX_MATCH )
+            {
+                /* regexec() locks the compiled regex in glibc, so each worker compiles its own once per call */
+                regex_t regex;
+                int compiled = regcomp(&regex, pEngine->regex, pEngine->regex_flags) == 0;
+                TaskItem chunk = *pTask;
+                while ( !IS_CANCELLED(pEngine) && (chunk.length = claimChunk(pEngine, &chunk.offset)) > 0 )
+                {
+                    runRegexTask(pEngine, &chunk, compiled ? &regex : NULL);
+                }
+
+                if ( compiled )
+                {
+                    regfree(&regex);
+                }
+            }
+            else
+#endif
+            if ( isDynamicTask(pTask->function) )
+            {
+                TaskItem chunk = *pTask;
+                while ( !IS_CANCELLED(pEngine) && (chunk.length = claimChunk(pEngine, &chunk.offset)) > 0 )
+                {
+                    runTask(pEngine, &chunk);
+                }
+            }
+            else
+            {
+                runTask(pEngine, pTask);
+            }
+
+            QUEUE_TASK_DONE(pEngine->task_queue);
+        }
+        else
+        {
+            break;
+        }
+    }
+
+#if defined(_MSC_VER)
+    return 0;
+#else
+    return NULL;
+#endif
+}
+
+FuzzyEngine* createFuzzyEngine(uint32_t cpu_count)
+{
+    FuzzyEngine* pEngine = (FuzzyEngine*)malloc(sizeof(FuzzyEngine));
+    if ( !pEngine )
+    {
+        return NULL;
+    }
+
+    pEngine->cpu_count = cpu_count;
+    pEngine->threads = NULL;
+    pEngine->pPattern_ctxt = NULL;
+    pEngine->pattern_ctxts = NULL;
+    pEngine->pattern_count = 0;
+    pEngine->source = NULL;
+    pEngine->corpus = NULL;
+    pEngine->begin = 0;
+    pEngine->use_digest = 0;
+    pEngine->use_basename = 0;
+    pEngine->use_candidates = 0;
+    pEngine->skip_len = 0;
+    pEngine->typo_threshold = 0;
+    pEngine->bound_top_k = 0;
+    pEngine->busy = 0;
+    pEngine->generation = 0;
+    pEngine->task_generation = 0;
+    pEngine->cursor = 0;
+    pEngine->cursor_end = 0;
+    pEngine->results = NULL;
+    memset(pEngine->arenas, 0, sizeof(pEngine->arenas));
+    pEngine->call_count = 0;
+    pEngine->phase_start = 0;
+    memset(pEngine->phase_times, 0, sizeof(pEngine->phase_times));
+
+    int32_t ret = 0;
+    QUEUE_INIT(pEngine->task_queue, MAX_TASK_COUNT(cpu_count) + cpu_count + 1, ret);
+    if ( ret != 0 )
+    {
+        free(pEngine);
+        return NULL;
+    }
+
+    return pEngine;
+}
+
+/**
+ * stop the worker threads, they are started again by startWorkers() when they are needed.
+ * no task must be running.
+ */
+static void stopWorkers(FuzzyEngine* pEngine)
+{
+    /**
+     * pEngine->threads is NULL if fuzzyMatch() is not called,
+     * or fuzzyMatch() returns before malloc for pEngine->threads.
+     */
+    if ( pEngine->threads )
+    {
+        uint32_t i = 0;
+        for ( ; i < pEngine->cpu_count; ++i )
+        {
+            QUEUE_PUT(pEngine->task_queue, NULL);
+        }
+
+#if defined(_MSC_VER)
+        WaitForMultipleObjects(pEngine->cpu_count, pEngine->threads, TRUE, INFINITE);
+        for ( i = 0; i < pEngine->cpu_count; ++i )
+        {
+            CloseHandle(pEngine->threads[i]);
+        }
+#else
+        for ( i = 0; i < pEngine->cpu_count; ++i )
+        {
+            pthread_join(pEngine->threads[i], NULL);
+        }
+        /* the NULL tasks are never marked as done */
+        pEngine->task_queue.unfinished_tasks = 0;
+#endif
+        free(pEngine->threads);
+        pEngine->threads = NULL;
+    }
+}
+
+void closeFuzzyEngine(FuzzyEngine* pEngine)
+{
+    if ( !pEngine )
+        return;
+
+    stopWorkers(pEngine);
+    QUEUE_DESTROY(pEngine->task_queue);
+    uint32_t i = 0;
+    for ( ; i < ARENA_COUNT; ++i )
+    {
+        freeArena(pEngine->arenas + i);
+    }
+    free(pEngine);
+}
+
+static int32_t pyObject_ToStringAndSize(PyObject* obj, char** buffer, uint32_t* size)
+{
+    Py_ssize_t length = 0;
+#if PY_MAJOR_VERSION >= 3
+    *buffer = (char*)PyUnicode_AsUTF8AndSize(obj, &length);
+    *size = (uint32_t)length;
+    if ( *buffer )
+        return 0;
+    else
+        return -1;
+#else
+    int ret = PyString_AsStringAndSize(obj, buffer, &length);
+    *size = (uint32_t)length;
+    if ( ret >= 0 )
+        return 0;
+    else
+        return -1;
+#endif
+}
+
+static void delFuzzyEngine(PyObject* obj)
+{
+    closeFuzzyEngine((FuzzyEngine*)PyCapsule_GetPointer(obj, NULL));
+}
+
+/**
+ * createFuzzyEngine(cpu_count, auto_free=False)
+ *
+ * `auto_free` is optional that specifies whether auto free the fuzzyEngine object.
+ *      It defaults to `False`, which means do not auto free the fuzzyEngine object,
+ *      so that you should call closeFuzzyEngine() manually.
+ *  return a fuzzyEngine object
+ */
+static PyObject* fuzzyEngine_createFuzzyEngine(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    uint32_t cpu_count;
+    uint8_t  auto_free = 0;
+    static char* kwlist[] = {"cpu_count", "auto_free", NULL};
+
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "I|b:createFuzzyEngine", kwlist, &cpu_count, &auto_free) )
+        return NULL;
+
+    FuzzyEngine* pEngine = createFuzzyEngine(cpu_count);
+
+    return PyCapsule_New(pEngine, NULL, auto_free ? delFuzzyEngine : NULL);
+}
+
+/**
+ * the engine keeps the state of the call using it, e.g., the pattern, the results and the scratch buffers,
+ * and the GIL is released while the call is running, so a call from another thread, e.g., by another manager
+ * sharing the engine, raises RuntimeError instead of corrupting the state.
+ * it is called with the GIL held, so there is no race on pEngine->busy.
+ */
+static int32_t acquireEngine(FuzzyEngine* pEngine)
+{
+    if ( pEngine->busy )
+    {
+        PyErr_SetString(PyExc_RuntimeError, "fuzzyEngine is being used by another call");
+        return -1;
+    }
+
+    pEngine->busy = 1;
+
+    return 0;
+}
+
+static void releaseEngine(FuzzyEngine* pEngine)
+{
+    pEngine->busy = 0;
+}
+
+/**
+ * call `func`, whose first argument is the engine, while holding the engine, see acquireEngine().
+ */
+static PyObject* callWithEngine(PyCFunctionWithKeywords func, PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    PyObject* py_engine = NULL;
+    if ( PyTuple_GET_SIZE(args) > 0 )
+        py_engine = PyTuple_GET_ITEM(args, 0);
+    else if ( kwargs )
+        py_engine = PyDict_GetItemString(kwargs, "engine");
+
+    /* `func` reports the invalid arguments */
+    if ( !py_engine || !PyCapsule_IsValid(py_engine, NULL) )
+        return func(self, args, kwargs);
+
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
+    if ( acquireEngine(pEngine) < 0 )
+        return NULL;
+
+    PyObject* ret = func(self, args, kwargs);
+    releaseEngine(pEngine);
+
+    return ret;
+}
+
+/* define the method `name`, which calls `name##_` while holding the engine */
+#define ENGINE_METHOD(name)                                                             \
+    static PyObject* name(PyObject* self, PyObject* args, PyObject* kwargs)           \
+    {                                                                                   \
+        return callWithEngine(name##_, self, args, kwargs);                             \
+    }
+
+/**
+ * closeFuzzyEngine(engine)
+ */
+static PyObject* fuzzyEngine_closeFuzzyEngine(PyObject* self, PyObject* args)
+{
+    PyObject* engine = NULL;
+    if ( !PyArg_ParseTuple(args, "O:closeFuzzyEngine", &engine) )
+        return NULL;
+
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(engine, NULL);
+    if ( pEngine && acquireEngine(pEngine) < 0 )
+        return NULL;
+
+    closeFuzzyEngine(pEngine);
+
+    Py_RETURN_NONE;
+}
+
+/**
+ * releaseWorkers(engine)
+ *
+ * stop the worker threads of `engine` and free its scratch buffers to release their resources while it is idle,
+ * they are created again by the next call that needs them.
+ * it raises RuntimeError if another call with `engine` is running.
+ */
+static PyObject* fuzzyEngine_releaseWorkers(PyObject* self, PyObject* args)
+{
+    PyObject* engine = NULL;
+    if ( !PyArg_ParseTuple(args, "O:releaseWorkers", &engine) )
+        return NULL;
+
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(engine, NULL);
+    if ( !pEngine || acquireEngine(pEngine) < 0 )
+        return NULL;
+
+    Py_BEGIN_ALLOW_THREADS
+    stopWorkers(pEngine);
+    Py_END_ALLOW_THREADS
+
+    uint32_t i = 0;
+    for ( ; i < ARENA_COUNT; ++i )
+    {
+        freeArena(pEngine->arenas + i);
+    }
+    releaseEngine(pEngine);
+
+    Py_RETURN_NONE;
+}
+
+/**
+ * stats(engine)
+ *
+ * return a dict about the resources and the last call of `engine`:
+ *  "threads": the number of the worker threads that are running,
+ *  "reserved_bytes": the number of bytes reserved by the scratch buffers,
+ *  "prepare_time", "match_time", "sort_time", "build_time": the durations of the phases of the last call
+ *      in seconds, i.e., converting or digesting the items, matching, sorting and building the results.
+ */
+static PyObject* fuzzyEngine_stats(PyObject* self, PyObject* args)
+{
+    PyObject* engine = NULL;
+    if ( !PyArg_ParseTuple(args, "O:stats", &engine) )
+        return NULL;
+
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(engine, NULL);
+    if ( !pEngine )
+        return NULL;
+
+    size_t reserved_bytes = 0;
+    uint32_t i = 0;
+    for ( ; i < ARENA_COUNT; ++i )
+    {
+        reserved_bytes += pEngine->arenas[i].capacity;
+    }
+
+    return Py_BuildValue("{s:I,s:n,s:d,s:d,s:d,s:d}",
+                         "threads", pEngine->threads ? pEngine->cpu_count : 0,
+                         "reserved_bytes", (Py_ssize_t)reserved_bytes,
+                         "prepare_time", pEngine->phase_times[PHASE_PREPARE],
+                         "match_time", pEngine->phase_times[PHASE_MATCH],
+                         "sort_time", pEngine->phase_times[PHASE_SORT],
+                         "build_time", pEngine->phase_times[PHASE_BUILD]);
+}
+
+/**
+ * cancel(engine)
+ *
+ * make the call of fuzzyMatch(), fuzzyMatchEx(), fuzzyMatchPart(), fuzzyMatchAnd(), fuzzyMatchRefine(),
+ * guessMatch() or regexMatch() that is running in another thread stop as soon as possible and return None, because its result is obsolete.
+ * it does nothing if no such call is running.
+ */
+static PyObject* fuzzyEngine_cancel(PyObject* self, PyObject* args)
+{
+    PyObject* engine = NULL;
+    if ( !PyArg_ParseTuple(args, "O:cancel", &engine) )
+        return NULL;
+
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(engine, NULL);
+    if ( !pEngine )
+        return NULL;
+
+    /* cancel() is always called with the GIL held, so there is only one writer */
+    pEngine->generation = pEngine->generation + 1;
+
+    Py_RETURN_NONE;
+}
+
+static void delPatternContext(PyObject* obj)
+{
+    free(PyCapsule_GetPointer(obj, NULL));
+}
+
+/**
+ * initPattern(pattern, is_exact=False)
+ *
+ * `is_exact` is optional, if it is True, the pattern only matches the texts that contain it,
+ *      a lowercase ASCII character of the pattern also matches its uppercase.
+ */
+static PyObject* fuzzyEngine_initPattern(PyObject* self, PyObject* args)
+{
+    const char* pattern;
+    Py_ssize_t pattern_len;
+    uint8_t is_exact = 0;
+
+    if ( !PyArg_ParseTuple(args, "s#|b:initPattern", &pattern, &pattern_len, &is_exact) )
+        return NULL;
+
+    PatternContext* pCtxt = initPattern(pattern, (uint32_t)pattern_len, is_exact);
+
+    return PyCapsule_New(pCtxt, NULL, delPatternContext);
+}
+
+static void delWeights(PyObject* obj)
+{
+    free(PyCapsule_GetPointer(obj, NULL));
+}
+
+static PyObject* createWeights(void* weights)
+{
+    return PyCapsule_New(weights, NULL, delWeights);
+}
+
+/**
+ * if the weights are only partially sorted, the number of the sorted ones is kept as the context of the capsule,
+ * NULL context means all the weights are sorted.
+ */
+static void setSortedCount(PyObject* weights, uint32_t sorted_count, uint32_t size)
+{
+    if ( weights )
+    {
+        PyCapsule_SetContext(weights, sorted_count < size ? (void*)(Py_uintptr_t)sorted_count : NULL);
+    }
+}
+
+static uint32_t getSortedCount(PyObject* weights, uint32_t size)
+{
+    /* the weights of no result are an empty list */
+    if ( !PyCapsule_CheckExact(weights) )
+        return size;
+
+    void* context = PyCapsule_GetContext(weights);
+    return context ? (uint32_t)(Py_uintptr_t)context : size;
+}
+
+/* the class of each character in an index, see FeIndex */
+static uint8_t index_classes[256];
+static uint8_t index_classes_ready = 0;
+
+static void initIndexClasses(void)
+{
+    uint32_t c = 0;
+    for ( ; c < 256; ++c )
+    {
+        char ch = (char)c;
+        uint64_t signature = getTextSignature(&ch, 1);
+        uint8_t k = 0;
+        while ( (signature >> k) != 1 )
+        {
+            ++k;
+        }
+        index_classes[c] = k;
+    }
+    index_classes_ready = 1;
+}
+
+/* return the index of the lowest bit that is set in `x`, which is not 0 */
+static uint32_t getLowestBit(uint64_t x)
+{
+    static const uint8_t table[64] = {
+        0, 1, 48, 2, 57, 49, 28, 3, 61, 58, 50, 42, 38, 29, 17, 4, 62, 55, 59, 36, 53, 51, 43, 22, 45, 39, 33, 30,
+        24, 18, 12, 5, 63, 47, 56, 27, 60, 41, 37, 16, 54, 35, 52, 21, 44, 32, 23, 11, 46, 26, 40, 15, 34, 20, 31,
+        10, 25, 14, 19, 9, 13, 8, 7, 6
+    };
+    return table[((x & (~x + 1)) * 0x03F79D71B4CB0A89ULL) >> 58];
+}
+
+static void clearIndex(FeIndex* pIndex)
+{
+    uint32_t i = 0;
+    for ( ; i < INDEX_KEY_COUNT; ++i )
+    {
+        pIndex->postings[i].size = 0;
+        pIndex->postings[i].count = 0;
+        pIndex->postings[i].last_block = 0;
+    }
+    pIndex->indexed_count = 0;
+}
+
+static int32_t createIndex(FeCorpus* pCorpus)
+{
+    if ( pCorpus->index )
+        return 0;
+
+    if ( !index_classes_ready )
+    {
+        initIndexClasses();
+    }
+
+    pCorpus->index = (FeIndex*)calloc(1, sizeof(FeIndex));
+    if ( !pCorpus->index )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return -1;
+    }
+
+    return 0;
+}
+
+static void freeIndex(FeIndex* pIndex)
+{
+    if ( !pIndex )
+        return;
+
+    uint32_t i = 0;
+    for ( ; i < INDEX_KEY_COUNT; ++i )
+    {
+        free(pIndex->postings[i].data);
+    }
+    free(pIndex);
+}
+
+/**
+ * append `block` to the posting list if it is not the last one, the first block is kept as it is,
+ * each of the others is kept as the difference from the previous one, in a varint of 7 bits per byte.
+ */
+static int32_t addPosting(FePosting* pPosting, uint32_t block)
+{
+    if ( pPosting->count > 0 && pPosting->last_block == block )
+        return 0;
+
+    /* a varint of uint32_t takes at most 5 bytes */
+    if ( pPosting->size + 5 > pPosting->capacity )
+    {
+        uint32_t capacity = pPosting->capacity > 0 ? pPosting->capacity << 1 : 64;
+        uint8_t* data = (uint8_t*)realloc(pPosting->data, capacity);
+        if ( !data )
+        {
+            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+            return -1;
+        }
+        pPosting->data = data;
+        pPosting->capacity = capacity;
+    }
+
+    uint32_t delta = pPosting->count > 0 ? block - pPosting->last_block : block;
+    while ( delta >= 0x80 )
+    {
+        pPosting->data[pPosting->size++] = (uint8_t)(delta | 0x80);
+        delta >>= 7;
+    }
+    pPosting->data[pPosting->size++] = (uint8_t)delta;
+    pPosting->last_block = block;
+    ++pPosting->count;
+
+    return 0;
+}
+
+/**
+ * read a varint written by addPosting() from [*p, p_end) into *pValue.
+ * return -1 if it is truncated or does not fit in uint32_t.
+ */
+static int32_t readVarint(const uint8_t** p, const uint8_t* p_end, uint32_t* pValue)
+{
+    uint32_t value = 0;
+    uint32_t shift = 0;
+    uint8_t byte;
+    do
+    {
+        if ( *p >= p_end || (shift == 28 && **p > 0x0F) )
+            return -1;
+
+        byte = *(*p)++;
+        value |= (uint32_t)(byte & 0x7F) << shift;
+        shift += 7;
+    } while ( byte & 0x80 );
+
+    *pValue = value;
+
+    return 0;
+}
+
+/**
+ * check a posting list that is loaded from a file, the blocks must be strictly increasing and less than
+ * `block_count`, and agree with pPosting->count and pPosting->last_block.
+ * return -1 if it is corrupted.
+ */
+static int32_t checkPosting(const FePosting* pPosting, uint32_t block_count)
+{
+    uint32_t count = 0;
+    uint32_t block = 0;
+    const uint8_t* p = pPosting->data;
+    const uint8_t* p_end = p + pPosting->size;
+    while ( p < p_end )
+    {
+        uint32_t delta;
+        if ( readVarint(&p, p_end, &delta) < 0 )
+            return -1;
+
+        /* the first block is kept as it is, the others as the differences */
+        if ( (count > 0 && delta == 0) || delta >= block_count - block )
+            return -1;
+
+        block += delta;
+        ++count;
+    }
+
+    if ( count != pPosting->count || (count > 0 && block != pPosting->last_block) )
+        return -1;
+
+    return 0;
+}
+
+/**
+ * index the items of the corpus that have not been indexed, the digests are indexed if `use_digest` is not 0,
+ * otherwise the whole texts. the index is rebuilt if it has been built for other texts.
+ * return -1 if the index can not be used, e.g., out of memory.
+ */
+static int32_t updateIndex(FeCorpus* pCorpus, uint32_t use_digest)
+{
+    FeIndex* pIndex = pCorpus->index;
+    FeDigestKey* pKey = &pCorpus->digest_key;
+    /* a separator that is too long to be kept in the key can not tell the digests apart */
+    if ( use_digest && pKey->separator_len > sizeof(pKey->separator) )
+        return -1;
+
+    if ( pIndex->use_digest != use_digest
+         || (use_digest && memcmp(&pIndex->digest_key, pKey, sizeof(FeDigestKey)) != 0) )
+    {
+        clearIndex(pIndex);
+        pIndex->use_digest = use_digest;
+        memset(&pIndex->digest_key, 0, sizeof(FeDigestKey));
+        if ( use_digest )
+        {
+            pIndex->digest_key = *pKey;
+        }
+    }
+
+    uint32_t i = pIndex->indexed_count;
+    for ( ; i < pCorpus->size; ++i )
+    {
+        FeCorpusItem* pItem = pCorpus->items + i;
+        const char* text = pCorpus->arena + pItem->offset;
+        uint32_t len = pItem->len;
+        if ( use_digest )
+        {
+            text += pItem->digest_offset;
+            len = pItem->digest_len;
+        }
+
+        /* before[y] is the classes that occur before the last occurrence of class y */
+        uint64_t before[64];
+        uint64_t seen = 0;
+        uint32_t j = 0;
+        for ( ; j < len; ++j )
+        {
+            uint8_t y = index_classes[(uint8_t)text[j]];
+            before[y] = seen;
+            seen |= 1ULL << y;
+        }
+
+        uint32_t block = i / INDEX_BLOCK_SIZE;
+        while ( seen != 0 )
+        {
+            uint32_t y = getLowestBit(seen);
+            seen &= seen - 1;
+            uint64_t classes = before[y];
+            while ( classes != 0 )
+            {
+                uint32_t x = getLowestBit(classes);
+                classes &= classes - 1;
+                if ( addPosting(pIndex->postings + (x << 6 | y), block) < 0 )
+                {
+                    clearIndex(pIndex);
+                    return -1;
+                }
+            }
+        }
+    }
+
+    pIndex->indexed_count = pCorpus->size;
+
+    return 0;
+}
+
+/* the most pairs of the adjacent characters of a pattern that are looked up in an index */
+#define MAX_INDEX_PAIRS 64
+
+/**
+ * whether the candidates of the pattern can be found in an index, the non-ASCII characters of the pattern
+ * have been replaced with symbols, see initPattern(), and a pattern of two characters is hardly selective.
+ */
+static int32_t isIndexable(PatternContext* pPattern_ctxt)
+{
+    return !pPattern_ctxt->is_utf8 && pPattern_ctxt->pattern_len >= 3;
+}
+
+/**
+ * put the indices of the items in [begin, begin + size) that may match the pattern into `results`, i.e., the items
+ * of the blocks that are in the posting lists of all the pairs of the adjacent characters of the pattern.
+ * the pattern must be indexable, see isIndexable().
+ * return the number of the candidates, or -1 if out of memory.
+ */
+static int64_t getCandidates(FeIndex* pIndex, PatternContext* pPattern_ctxt, uint32_t begin, uint32_t size,
+                             FeResult* results)
+{
+    const char* pattern = pPattern_ctxt->pattern;
+    uint32_t pattern_len = pPattern_ctxt->pattern_len;
+    if ( size == 0 )
+        return 0;
+
+    /* the posting lists of the pairs, from the shortest to the longest */
+    FePosting* lists[MAX_INDEX_PAIRS];
+    uint32_t list_count = 0;
+    uint32_t i = 1;
+    for ( ; i < pattern_len && list_count < MAX_INDEX_PAIRS; ++i )
+    {
+        uint32_t key = (uint32_t)index_classes[(uint8_t)pattern[i-1]] << 6 | index_classes[(uint8_t)pattern[i]];
+        FePosting* pPosting = pIndex->postings + key;
+        uint32_t j = 0;
+        while ( j < list_count && lists[j] != pPosting )
+        {
+            ++j;
+        }
+        if ( j < list_count )
+            continue;
+
+        while ( j > 0 && lists[j-1]->count > pPosting->count )
+        {
+            lists[j] = lists[j-1];
+            --j;
+        }
+        lists[j] = pPosting;
+        ++list_count;
+    }
+
+    uint32_t* blocks = (uint32_t*)malloc(MAX(lists[0]->count, 1) * sizeof(uint32_t));
+    if ( !blocks )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return -1;
+    }
+
+    uint32_t end = begin + size;
+    uint32_t first_block = begin / INDEX_BLOCK_SIZE;
+    uint32_t last_block = (end - 1) / INDEX_BLOCK_SIZE;
+    uint32_t block_count = 0;
+    uint32_t block = 0;
+    const uint8_t* p = lists[0]->data;
+    const uint8_t* p_end = p + lists[0]->size;
+    while ( p < p_end )
+    {
+        uint32_t delta;
+        if ( readVarint(&p, p_end, &delta) < 0 )
+            break;
+        block += delta;
+        if ( block > last_block )
+            break;
+        if ( block >= first_block )
+            blocks[block_count++] = block;
+    }
+
+    for ( i = 1; i < list_count && block_count > 0; ++i )
+    {
+        uint32_t kept = 0;
+        uint32_t j = 0;
+        block = 0;
+        p = lists[i]->data;
+        p_end = p + lists[i]->size;
+        while ( j < block_count && p < p_end )
+        {
+            uint32_t delta;
+            if ( readVarint(&p, p_end, &delta) < 0 )
+                break;
+            block += delta;
+            while ( j < block_count && blocks[j] < block )
+            {
+                ++j;
+            }
+            if ( j < block_count && blocks[j] == block )
+            {
+                blocks[kept++] = blocks[j++];
+            }
+        }
+        block_count = kept;
+    }
+
+    uint32_t count = 0;
+    for ( i = 0; i < block_count; ++i )
+    {
+        uint32_t k = MAX(blocks[i] * INDEX_BLOCK_SIZE, begin);
+        uint32_t k_end = MIN(blocks[i] * INDEX_BLOCK_SIZE + INDEX_BLOCK_SIZE, end);
+        for ( ; k < k_end; ++k )
+        {
+            results[count++].index = k;
+        }
+    }
+    free(blocks);
+
+    return count;
+}
+
+/**
+ * the results of getCandidates() are spread to the positions of the items in the source,
+ * the weights of the other items are MIN_WEIGHT.
+ */
+static void expandCandidates(FeResult* results, uint32_t candidate_count, uint32_t begin, uint32_t size)
+{
+    int64_t j = (int64_t)candidate_count - 1;
+    uint32_t i = size;
+    while ( i-- > 0 )
+    {
+        if ( j >= 0 && results[j].index == begin + i )
+        {
+            results[i] = results[j--];
+        }
+        else
+        {
+            results[i].weight = MIN_WEIGHT;
+            results[i].index = begin + i;
+        }
+    }
+}
+
+static void delCorpus(PyObject* obj)
+{
+    FeCorpus* pCorpus = (FeCorpus*)PyCapsule_GetPointer(obj, CORPUS_CAPSULE_NAME);
+    if ( !pCorpus )
+        return;
+
+    free(pCorpus->arena);
+    free(pCorpus->items);
+    Py_XDECREF(pCorpus->py_source);
+    freeIndex(pCorpus->index);
+    free(pCorpus);
+}
+
+static int32_t appendCorpus(FeCorpus* pCorpus, PyObject* py_source)
+{
+    uint32_t source_size = (uint32_t)PyList_Size(py_source);
+    if ( source_size == 0 )
+        return 0;
+
+    if ( pCorpus->size + source_size > pCorpus->capacity )
+    {
+        uint32_t capacity = pCorpus->capacity > 0 ? pCorpus->capacity : 1024;
+        while ( capacity < pCorpus->size + source_size )
+        {
+            capacity <<= 1;
+        }
+        FeCorpusItem* items = (FeCorpusItem*)realloc(pCorpus->items, capacity * sizeof(FeCorpusItem));
+        if ( !items )
+        {
+            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+            return -1;
+        }
+        pCorpus->items = items;
+        pCorpus->capacity = capacity;
+    }
+
+    uint64_t arena_size = pCorpus->arena_size;
+    uint32_t i = 0;
+    for ( ; i < source_size; ++i )
+    {
+        char* str = NULL;
+        uint32_t len = 0;
+        if ( pyObject_ToStringAndSize(PyList_GET_ITEM(py_source, i), &str, &len) < 0 )
+        {
+            pCorpus->arena_size = arena_size;
+            fprintf(stderr, "pyObject_ToStringAndSize error!\n");
+            return -1;
+        }
+
+        /* the text is followed by a '\0' */
+        if ( pCorpus->arena_size + len + 1 > pCorpus->arena_capacity )
+        {
+            uint64_t capacity = pCorpus->arena_capacity > 0 ? pCorpus->arena_capacity : 65536;
+            while ( capacity < pCorpus->arena_size + len + 1 )
+            {
+                capacity <<= 1;
+            }
+            char* arena = (char*)realloc(pCorpus->arena, (size_t)capacity);
+            if ( !arena )
+            {
+                pCorpus->arena_size = arena_size;
+                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+                return -1;
+            }
+            pCorpus->arena = arena;
+            pCorpus->arena_capacity = capacity;
+        }
+
+        FeCorpusItem* pItem = pCorpus->items + pCorpus->size + i;
+        pItem->offset = pCorpus->arena_size;
+        pItem->len = len;
+        pItem->basename_offset = getBasenameOffset(str, len);
+        pItem->digest_offset = 0;
+        pItem->digest_len = len;
+
+        pItem->basename_signature = getTextSignature(str + pItem->basename_offset, len - pItem->basename_offset);
+        pItem->signature = pItem->basename_signature | getTextSignature(str, pItem->basename_offset);
+
+        memcpy(pCorpus->arena + pCorpus->arena_size, str, len);
+        pCorpus->arena[pCorpus->arena_size + len] = '\0';
+        pCorpus->arena_size += len + 1;
+    }
+
+    if ( PyList_SetSlice(pCorpus->py_source, pCorpus->size, pCorpus->size, py_source) < 0 )
+    {
+        pCorpus->arena_size = arena_size;
+        return -1;
+    }
+
+    pCorpus->size += source_size;
+
+    return 0;
+}
+
+/**
+ * createCorpus(source)
+ *
+ * `source` is a list of texts.
+ * return a corpus object that keeps a copy of the UTF-8 bytes of all the texts, it can be passed to
+ * fuzzyMatch(), fuzzyMatchEx(), fuzzyMatchPart() and guessMatch() as `source` instead of a list,
+ * so that the texts need not be converted again on every call.
+ */
+static PyObject* fuzzyEngine_createCorpus(PyObject* self, PyObject* args)
+{
+    PyObject* py_source = NULL;
+    if ( !PyArg_ParseTuple(args, "O:createCorpus", &py_source) )
+        return NULL;
+
+    if ( !PyList_Check(py_source) )
+    {
+        PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list.");
+        return NULL;
+    }
+
+    FeCorpus* pCorpus = (FeCorpus*)calloc(1, sizeof(FeCorpus));
+    if ( !pCorpus )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return PyErr_NoMemory();
+    }
+
+    pCorpus->py_source = PyList_New(0);
+    if ( !pCorpus->py_source || appendCorpus(pCorpus, py_source) < 0 )
+    {
+        free(pCorpus->arena);
+        free(pCorpus->items);
+        Py_XDECREF(pCorpus->py_source);
+        free(pCorpus);
+        if ( !PyErr_Occurred() )
+            PyErr_NoMemory();
+        return NULL;
+    }
+
+    return PyCapsule_New(pCorpus, CORPUS_CAPSULE_NAME, delCorpus);
+}
+
+/**
+ * appendCorpus(corpus, source)
+ *
+ * append the texts in list `source` to the end of `corpus`.
+ */
+static PyObject* fuzzyEngine_appendCorpus(PyObject* self, PyObject* args)
+{
+    PyObject* py_corpus = NULL;
+    PyObject* py_source = NULL;
+    if ( !PyArg_ParseTuple(args, "OO:appendCorpus", &py_corpus, &py_source) )
+        return NULL;
+
+    FeCorpus* pCorpus = (FeCorpus*)PyCapsule_GetPointer(py_corpus, CORPUS_CAPSULE_NAME);
+    if ( !pCorpus )
+        return NULL;
+
+    if ( !PyList_Check(py_source) )
+    {
+        PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list.");
+        return NULL;
+    }
+
+    /* the arena may be reallocated */
+    if ( pCorpus->readers > 0 )
+    {
+        PyErr_SetString(PyExc_RuntimeError, "the corpus is being matched.");
+        return NULL;
+    }
+
+    if ( appendCorpus(pCorpus, py_source) < 0 )
+    {
+        if ( !PyErr_Occurred() )
+            PyErr_NoMemory();
+        return NULL;
+    }
+
+    Py_RETURN_NONE;
+}
+
+/**
+ * indexCorpus(corpus)
+ *
+ * keep an index of the texts of `corpus`, so that fuzzyMatch(), fuzzyMatchEx() and fuzzyMatchPart() only match
+ * the items that may match a pattern of three or more ASCII characters, which is much faster for a huge corpus.
+ * the index takes about 10 bytes per item if the texts are short, it is built the first time it is used, and is
+ * updated when texts are appended to `corpus` or the digests being matched change.
+ */
+static PyObject* fuzzyEngine_indexCorpus(PyObject* self, PyObject* args)
+{
+    PyObject* py_corpus = NULL;
+    if ( !PyArg_ParseTuple(args, "O:indexCorpus", &py_corpus) )
+        return NULL;
+
+    FeCorpus* pCorpus = (FeCorpus*)PyCapsule_GetPointer(py_corpus, CORPUS_CAPSULE_NAME);
+    if ( !pCorpus )
+        return NULL;
+
+    if ( createIndex(pCorpus) < 0 )
+        return PyErr_NoMemory();
+
+    Py_RETURN_NONE;
+}
+
+#define INDEX_MAGIC "LfIndex1"
+
+typedef struct FeIndexHeader
+{
+    char        magic[8];
+    uint32_t    block_size;
+    uint32_t    key_count;
+    uint32_t    indexed_count;
+    uint32_t    use_digest;
+    FeDigestKey digest_key;
+    uint32_t    key_len;    /* the length of the key that follows the header */
+}FeIndexHeader;
+
+/**
+ * saveCorpusIndex(corpus, filename, key)
+ *
+ * save the index of `corpus` to file `filename`, `key` is a string that identifies the texts of `corpus`,
+ * e.g., the names and the modification times of the files they are read from, see loadCorpusIndex().
+ * return True if the index is saved, False if it has not been built for all the texts or can not be written.
+ */
+static PyObject* fuzzyEngine_saveCorpusIndex(PyObject* self, PyObject* args)
+{
+    PyObject* py_corpus = NULL;
+    const char* filename = NULL;
+    const char* key = NULL;
+    Py_ssize_t key_len = 0;
+    if ( !PyArg_ParseTuple(args, "Oss#:saveCorpusIndex", &py_corpus, &filename, &key, &key_len) )
+        return NULL;
+
+    FeCorpus* pCorpus = (FeCorpus*)PyCapsule_GetPointer(py_corpus, CORPUS_CAPSULE_NAME);
+    if ( !pCorpus )
+        return NULL;
+
+    /* the index may be being updated */
+    if ( pCorpus->readers > 0 )
+    {
+        PyErr_SetString(PyExc_RuntimeError, "the corpus is being matched.");
+        return NULL;
+    }
+
+    FeIndex* pIndex = pCorpus->index;
+    if ( !pIndex || pIndex->indexed_count == 0 || pIndex->indexed_count != pCorpus->size )
+        Py_RETURN_FALSE;
+
+    FILE* fp = fopen(filename, "wb");
+    if ( !fp )
+        Py_RETURN_FALSE;
+
+    FeIndexHeader header;
+    memset(&header, 0, sizeof(header));
+    memcpy(header.magic, INDEX_MAGIC, sizeof(header.magic));
+    header.block_size = INDEX_BLOCK_SIZE;
+    header.key_count = INDEX_KEY_COUNT;
+    header.indexed_count = pIndex->indexed_count;
+    header.use_digest = pIndex->use_digest;
+    header.digest_key = pIndex->digest_key;
+    header.key_len = (uint32_t)key_len;
+
+    int32_t ok = fwrite(&header, sizeof(header), 1, fp) == 1 && fwrite(key, 1, key_len, fp) == (size_t)key_len;
+    uint32_t i = 0;
+    for ( ; ok && i < INDEX_KEY_COUNT; ++i )
+    {
+        FePosting* pPosting = pIndex->postings + i;
+        uint32_t values[3] = { pPosting->size, pPosting->count, pPosting->last_block };
+        ok = fwrite(values, sizeof(values), 1, fp) == 1
+             && fwrite(pPosting->data, 1, pPosting->size, fp) == pPosting->size;
+    }
+
+    if ( fclose(fp) != 0 || !ok )
+    {
+        remove(filename);
+        Py_RETURN_FALSE;
+    }
+
+    Py_RETURN_TRUE;
+}
+
+/**
+ * loadCorpusIndex(corpus, filename, key)
+ *
+ * load the index of `corpus` from file `filename`, which is saved by saveCorpusIndex() with the same `key`,
+ * indexCorpus() is called if it has not been called.
+ * return True if the index is loaded, False if the file does not exist or is not saved for the same texts.
+ */
+static PyObject* fuzzyEngine_loadCorpusIndex(PyObject* self, PyObject* args)
+{
+    PyObject* py_corpus = NULL;
+    const char* filename = NULL;
+    const char* key = NULL;
+    Py_ssize_t key_len = 0;
+    if ( !PyArg_ParseTuple(args, "Oss#:loadCorpusIndex", &py_corpus, &filename, &key, &key_len) )
+        return NULL;
+
+    FeCorpus* pCorpus = (FeCorpus*)PyCapsule_GetPointer(py_corpus, CORPUS_CAPSULE_NAME);
+    if ( !pCorpus )
+        return NULL;
+
+    /* the index may be being updated */
+    if ( pCorpus->readers > 0 )
+    {
+        PyErr_SetString(PyExc_RuntimeError, "the corpus is being matched.");
+        return NULL;
+    }
+
+    if ( createIndex(pCorpus) < 0 )
+        return PyErr_NoMemory();
+
+    FILE* fp = fopen(filename, "rb");
+    if ( !fp )
+        Py_RETURN_FALSE;
+
+    FeIndex* pIndex = pCorpus->index;
+    FeIndexHeader header;
+    int32_t ok = fread(&header, sizeof(header), 1, fp) == 1
+                 && memcmp(header.magic, INDEX_MAGIC, sizeof(header.magic)) == 0
+                 && header.block_size == INDEX_BLOCK_SIZE
+                 && header.key_count == INDEX_KEY_COUNT
+                 && header.indexed_count <= pCorpus->size
+                 && header.use_digest <= 1
+                 && header.key_len == (uint32_t)key_len;
+    if ( ok )
+    {
+        char* saved_key = (char*)malloc(key_len + 1);
+        ok = saved_key && fread(saved_key, 1, key_len, fp) == (size_t)key_len
+             && memcmp(saved_key, key, key_len) == 0;
+        free(saved_key);
+    }
+
+    if ( ok )
+    {
+        clearIndex(pIndex);
+        uint32_t block_count = (header.indexed_count + INDEX_BLOCK_SIZE - 1) / INDEX_BLOCK_SIZE;
+        uint32_t i = 0;
+        for ( ; ok && i < INDEX_KEY_COUNT; ++i )
+        {
+            FePosting* pPosting = pIndex->postings + i;
+            uint32_t values[3];
+            /* a block takes at most 5 bytes, see addPosting() */
+            ok = fread(values, sizeof(values), 1, fp) == 1
+                 && values[1] <= block_count && (uint64_t)values[0] <= (uint64_t)values[1] * 5;
+            if ( ok && values[0] > pPosting->capacity )
+            {
+                uint8_t* data = (uint8_t*)realloc(pPosting->data, values[0]);
+                if ( !data )
+                {
+                    fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+                    ok = 0;
+                    break;
+                }
+                pPosting->data = data;
+                pPosting->capacity = values[0];
+            }
+            ok = ok && fread(pPosting->data, 1, values[0], fp) == values[0];
+            if ( ok )
+            {
+                pPosting->size = values[0];
+                pPosting->count = values[1];
+                pPosting->last_block = values[1] > 0 ? values[2] : 0;
+                ok = checkPosting(pPosting, block_count) == 0;
+            }
+        }
+
+        if ( ok )
+        {
+            pIndex->indexed_count = header.indexed_count;
+            pIndex->use_digest = header.use_digest;
+            pIndex->digest_key = header.digest_key;
+        }
+        else
+        {
+            clearIndex(pIndex);
+        }
+    }
+    fclose(fp);
+
+    if ( ok )
+        Py_RETURN_TRUE;
+    else
+        Py_RETURN_FALSE;
+}
+
+/**
+ * `py_source` is either a list or a corpus, only the items in range [begin, end) are matched.
+ */
+static int32_t parseSource(PyObject* py_source, uint32_t begin, uint32_t end, FeSource* pSource)
+{
+    uint32_t size = 0;
+    if ( PyList_Check(py_source) )
+    {
+        pSource->py_source = py_source;
+        pSource->corpus = NULL;
+        size = (uint32_t)PyList_Size(py_source);
+    }
+    else if ( PyCapsule_IsValid(py_source, CORPUS_CAPSULE_NAME) )
+    {
+        pSource->corpus = (FeCorpus*)PyCapsule_GetPointer(py_source, CORPUS_CAPSULE_NAME);
+        pSource->py_source = pSource->corpus->py_source;
+        size = pSource->corpus->size;
+    }
+    else
+    {
+        PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list or a corpus.");
+        return -1;
+    }
+
+    end = MIN(end, size);
+    pSource->begin = MIN(begin, end);
+    pSource->size = end - pSource->begin;
+
+    return 0;
+}
+
+/**
+ * get the memory of `obj`, which must be an array whose items are `type` of `itemsize` bytes,
+ * e.g., array('f') if `type` is 'f', `name` is the parameter reported if `obj` is not such an array.
+ * releaseArray() must be called if it succeeds.
+ */
+static int32_t getArray(PyObject* obj, char type, uint32_t itemsize, int32_t writable, const char* name,
+                        FeArray* pArray)
+{
+    pArray->data = NULL;
+    pArray->size = 0;
+#if PY_MAJOR_VERSION >= 3
+    pArray->view.obj = NULL;
+    int flags = PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | (writable ? PyBUF_WRITABLE : 0);
+    if ( PyObject_GetBuffer(obj, &pArray->view, flags) < 0 )
+        return -1;
+
+    const char* format = pArray->view.format;
+    if ( format && (format[0] == '@' || format[0] == '=') )
+        ++format;
+
+    if ( pArray->view.itemsize != (Py_ssize_t)itemsize || (format && (format[0] != type || format[1] != '\0')) )
+    {
+        PyBuffer_Release(&pArray->view);
+        PyErr_Format(PyExc_TypeError, "parameter `%s` must be an array('%c').", name, type);
+        return -1;
+    }
+
+    pArray->data = pArray->view.buf;
+    pArray->size = (uint32_t)(pArray->view.len / itemsize);
+#else
+    Py_ssize_t length = 0;
+    int ret = 0;
+    if ( writable )
+        ret = PyObject_AsWriteBuffer(obj, &pArray->data, &length);
+    else
+        ret = PyObject_AsReadBuffer(obj, (const void**)&pArray->data, &length);
+    if ( ret < 0 )
+        return -1;
+
+    pArray->size = (uint32_t)(length / itemsize);
+#endif
+
+    return 0;
+}
+
+static void releaseArray(FeArray* pArray)
+{
+#if PY_MAJOR_VERSION >= 3
+    PyBuffer_Release(&pArray->view);
+#endif
+}
+
+/**
+ * `py_bonus` is None or an array('f'), the i-th float of it is added to the weight of the i-th item
+ * of the source if the item matches, so that, e.g., the recently used files are ranked higher than
+ * the others that match as well. the items beyond the end of `py_bonus` get no bonus.
+ */
+static int32_t getBonus(FuzzyEngine* pEngine, PyObject* py_bonus, FeArray* pBonus)
+{
+    pBonus->data = NULL;
+    pBonus->size = 0;
+#if PY_MAJOR_VERSION >= 3
+    pBonus->view.obj = NULL;
+#endif
+    if ( py_bonus && py_bonus != Py_None
+         && getArray(py_bonus, 'f', sizeof(weight_t), 0, "bonus", pBonus) < 0 )
+        return -1;
+
+    pEngine->bonus = (const weight_t*)pBonus->data;
+    pEngine->bonus_size = pBonus->size;
+
+    return 0;
+}
+
+static void releaseBonus(FuzzyEngine* pEngine, FeArray* pBonus)
+{
+    pEngine->bonus = NULL;
+    pEngine->bonus_size = 0;
+    releaseArray(pBonus);
+}
+
+/**
+ * return a new bytes object that can hold `count` indices, `*pIndices` is set to its buffer,
+ * it is turned into an array('I') by createIndexArray() after the indices are filled in.
+ */
+static PyObject* newIndexBytes(uint32_t count, uint32_t** pIndices)
+{
+    PyObject* bytes = PyBytes_FromStringAndSize(NULL, (Py_ssize_t)count * sizeof(uint32_t));
+    if ( bytes )
+    {
+        *pIndices = (uint32_t*)PyBytes_AS_STRING(bytes);
+    }
+
+    return bytes;
+}
+
+/**
+ * return array('I', bytes), `bytes` is returned by newIndexBytes() and the reference to it is stolen.
+ */
+static PyObject* createIndexArray(PyObject* bytes)
+{
+    PyObject* array_module = PyImport_ImportModule("array");
+    if ( !array_module )
+    {
+        Py_DECREF(bytes);
+        return NULL;
+    }
+
+    PyObject* index_array = PyObject_CallMethod(array_module, "array", "sN", "I", bytes);
+    Py_DECREF(array_module);
+
+    return index_array;
+}
+
+static void getDigest(char** str, uint32_t* length, uint32_t category, void* param);
+static void prepareDigests(FeCorpus* pCorpus, uint32_t category, void* param);
+
+enum
+{
+    Category_Rg = 0,
+    Category_Tag,
+    Category_File,
+    Category_Gtags,
+    Category_Line,
+    Category_GitDiff,
+    Category_Generic,   /* the digest is described by createDigestParameter() */
+};
+
+#define NO_CATEGORY ((uint32_t)-1)
+
+/* returned by computeWeights() if cancel() is called before all the weights are computed */
+#define CANCELLED (-2)
+
+static int32_t startWorkers(FuzzyEngine* pEngine)
+{
+    if ( pEngine->threads )
+        return 0;
+
+#if defined(_MSC_VER)
+    pEngine->threads = (HANDLE*)malloc(pEngine->cpu_count * sizeof(HANDLE));
+#else
+    pEngine->threads = (pthread_t*)malloc(pEngine->cpu_count * sizeof(pthread_t));
+#endif
+    if ( !pEngine->threads )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return -1;
+    }
+
+    uint32_t i = 0;
+    for ( ; i < pEngine->cpu_count; ++i)
+    {
+#if defined(_MSC_VER)
+        pEngine->threads[i] = CreateThread(NULL, 0, _worker, pEngine, 0, NULL);
+        if ( !pEngine->threads[i] )
+#else
+        int ret = pthread_create(&pEngine->threads[i], NULL, _worker, pEngine);
+        if ( ret != 0 )
+#endif
+        {
+            free(pEngine->threads);
+            pEngine->threads = NULL;
+            fprintf(stderr, "pthread_create error!\n");
+            return -1;
+        }
+    }
+
+    return 0;
+}
+
+/**
+ * give the buffers of the current call back to the arenas, it is called at the end of every call.
+ */
+static void releaseBuffers(FuzzyEngine* pEngine)
+{
+    pEngine->source = NULL;
+    pEngine->results = NULL;
+    pEngine->corpus = NULL;
+    endPhase(pEngine, PHASE_BUILD);
+
+    if ( ++pEngine->call_count % ARENA_TRIM_INTERVAL == 0 )
+    {
+        uint32_t i = 0;
+        for ( ; i < ARENA_COUNT; ++i )
+        {
+            trimArena(pEngine->arenas + i);
+        }
+    }
+}
+
+/* return the number of the results that match, counting stops at `limit` */
+static uint32_t countMatches(const FeResult* results, uint32_t size, uint32_t limit)
+{
+    uint32_t count = 0;
+    uint32_t i = 0;
+    for ( ; i < size && count < limit; ++i )
+    {
+        if ( results[i].weight > MIN_WEIGHT )
+            ++count;
+    }
+
+    return count;
+}
+
+/* the number of the results with the highest bounds that are scored first by scoreBestResults() */
+#define MIN_BEST_COUNT 4096
+
+/**
+ * pEngine->results are the items that match with the upper bounds of their weights, see getWeightBound().
+ * the items with the highest bounds are scored by the workers first, then the other items whose bounds are
+ * higher than the pEngine->bound_top_k-th best weight, so that the best pEngine->bound_top_k results are
+ * the same as those of GET_WEIGHT except for the order of equal weights.
+ * the best results are sorted, the others are not, and the weights of those not scored are still their bounds.
+ *
+ * it is called while the GIL is released, by the thread that puts the tasks.
+ */
+static void scoreBestResults(FuzzyEngine* pEngine, TaskItem* tasks, uint32_t worker_count, uint32_t results_count)
+{
+    FeResult* results = pEngine->results;
+    uint32_t top_k = MIN(pEngine->bound_top_k, results_count);
+    uint32_t scored_count = 0;
+    uint32_t count = MIN(MAX(top_k, MIN_BEST_COUNT), results_count);
+    uint32_t i;
+    if ( count < results_count )
+    {
+        selectTopK(results, results_count, count, compare);
+    }
+
+    for ( i = 0; i < worker_count; ++i )
+    {
+        tasks[i].function = GET_BEST_WEIGHT;
+    }
+
+    while ( count > scored_count )
+    {
+        pEngine->cursor = scored_count;
+        pEngine->cursor_end = count;
+#if defined(_MSC_VER)
+        QUEUE_SET_TASK_COUNT(pEngine->task_queue, worker_count);
+#endif
+        for ( i = 0; i < worker_count; ++i )
+        {
+            QUEUE_PUT(pEngine->task_queue, tasks + i);
+        }
+
+        QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+        if ( IS_CANCELLED(pEngine) )
+            break;
+
+        scored_count = count;
+        selectTopK(results, scored_count, top_k, compare);
+        qsort(results, top_k, sizeof(FeResult), compare);
+
+        /* the results that may be better than the top_k-th best are moved to the front of the rest */
+        weight_t kth_weight = results[top_k - 1].weight;
+        for ( i = scored_count; i < results_count; ++i )
+        {
+            if ( results[i].weight > kth_weight )
+            {
+                FeResult tmp = results[i];
+                results[i] = results[count];
+                results[count] = tmp;
+                ++count;
+            }
+        }
+    }
+
+    for ( i = 0; i < worker_count; ++i )
+    {
+        tasks[i].function = GET_WEIGHT_BOUND;
+    }
+}
+
+/**
+ * return GET_WEIGHT_BOUND if the weights are computed in two phases, i.e., `two_phase` is not 0, `top_k`
+ * is not 0 and getWeightBound() applies to the pattern, see scoreBestResults(), otherwise GET_WEIGHT.
+ */
+static uint32_t getWeightFunction(FuzzyEngine* pEngine, uint8_t two_phase, uint32_t top_k)
+{
+    if ( two_phase && top_k > 0 && isWeightBounded(pEngine->pPattern_ctxt) )
+    {
+        pEngine->bound_top_k = top_k;
+        return GET_WEIGHT_BOUND;
+    }
+
+    pEngine->bound_top_k = 0;
+    return GET_WEIGHT;
+}
+
+/**
+ * compute the weights of all the items in `pSource` in parallel, the items that are converted from the
+ * python list are digested before being matched if `category` is not NO_CATEGORY.
+ * if `function` is one of GET_WEIGHT, GET_WEIGHT_AND, GET_WEIGHT_REFINE and GET_WEIGHT_BOUND,
+ * the results that do not match are removed from pEngine->results.
+ * if `function` is GET_WEIGHT or GET_WEIGHT_BOUND and fewer than pEngine->typo_threshold items match,
+ * the others are matched again with typos in the same workers, see getTypoWeight().
+ * if `function` is GET_WEIGHT_BOUND, the best pEngine->bound_top_k results are scored and sorted,
+ * see scoreBestResults().
+ * if `function` is GET_WEIGHT or GET_WEIGHT_BOUND and the corpus has an index, only the candidates found in
+ * the index are matched, see getCandidates().
+ *
+ * return the number of results, -1 if error occurs, CANCELLED if cancel() is called meanwhile.
+ */
+static int64_t computeWeights(FuzzyEngine* pEngine, FeSource* pSource, uint32_t function,
+                              uint32_t category, void* param, TaskItem** pTasks, uint32_t* pTask_count)
+{
+    uint32_t source_size = pSource->size;
+    uint32_t max_task_count  = MAX_TASK_COUNT(pEngine->cpu_count);
+    uint32_t chunk_size = (source_size + max_task_count - 1) / max_task_count;
+    uint32_t task_count = (source_size + chunk_size - 1) / chunk_size;
+    if ( chunk_size == 1 || pEngine->cpu_count == 1 )
+    {
+        chunk_size = source_size;
+        task_count = 1;
+    }
+
+    pEngine->source = NULL;
+    pEngine->corpus = pSource->corpus;
+    pEngine->begin = pSource->begin;
+    pEngine->use_digest = category != NO_CATEGORY;
+    pEngine->use_basename = category == Category_File;
+    pEngine->task_generation = pEngine->generation;
+    startPhases(pEngine);
+    if ( !pSource->corpus )
+    {
+        pEngine->source = (FeString*)reserveArena(pEngine->arenas + ARENA_SOURCE, source_size * sizeof(FeString));
+        if ( !pEngine->source )
+        {
+            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+            return -1;
+        }
+    }
+
+    TaskItem* tasks = (TaskItem*)reserveArena(pEngine->arenas + ARENA_TASKS, task_count * sizeof(TaskItem));
+    *pTasks = tasks;
+    *pTask_count = task_count;
+    if ( !tasks )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return -1;
+    }
+
+    pEngine->results = (FeResult*)reserveArena(pEngine->arenas + ARENA_RESULTS, source_size * sizeof(FeResult));
+    if ( !pEngine->results )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return -1;
+    }
+
+    if ( startWorkers(pEngine) < 0 )
+        return -1;
+
+    /**
+     * the GIL is released while the workers are running, so that other python threads are not blocked.
+     * the items of a python list are converted while the GIL is held, a corpus is not touched by python.
+     */
+    PyThreadState* thread_state = NULL;
+    int32_t error = 0;
+    uint32_t i = 0;
+    if ( pSource->corpus )
+    {
+        ++pSource->corpus->readers;
+        thread_state = PyEval_SaveThread();
+        if ( category != NO_CATEGORY )
+        {
+            prepareDigests(pSource->corpus, category, param);
+        }
+    }
+    else
+    {
+        for ( ; i < source_size; ++i )
+        {
+            FeString *s = pEngine->source + i;
+            PyObject* item = PyList_GET_ITEM(pSource->py_source, pSource->begin + i);
+            if ( pyObject_ToStringAndSize(item, &s->str, &s->len) < 0 )
+            {
+                fprintf(stderr, "pyObject_ToStringAndSize error!\n");
+                error = -1;
+                break;
+            }
+            else if ( category != NO_CATEGORY )
+            {
+                getDigest(&s->str, &s->len, category, param);
+            }
+        }
+        thread_state = PyEval_SaveThread();
+    }
+
+    /* only the candidates found in the index of the corpus are matched */
+    uint32_t item_count = source_size;
+    pEngine->use_candidates = 0;
+    if ( error == 0 && pSource->corpus && pSource->corpus->index
+         && (function == GET_WEIGHT || function == GET_WEIGHT_BOUND) && isIndexable(pEngine->pPattern_ctxt)
+         && updateIndex(pSource->corpus, category != NO_CATEGORY) == 0 )
+    {
+        int64_t candidate_count = getCandidates(pSource->corpus->index, pEngine->pPattern_ctxt,
+                                                pSource->begin, source_size, pEngine->results);
+        if ( candidate_count >= 0 )
+        {
+            item_count = (uint32_t)candidate_count;
+            pEngine->use_candidates = 1;
+        }
+    }
+    endPhase(pEngine, PHASE_PREPARE);
+
+    /**
+     * `tasks` are used to sort the results later, the items are matched by
+     * no more than cpu_count tasks, each of which claims the items chunk by chunk.
+     */
+    for ( i = 0; i < task_count; ++i )
+    {
+        tasks[i].function = function;
+        tasks[i].offset = i * chunk_size;
+        tasks[i].length = MIN(chunk_size, source_size - tasks[i].offset);
+    }
+
+    if ( error == 0 )
+    {
+        uint32_t worker_count = MIN(task_count, pEngine->cpu_count);
+        pEngine->cursor = 0;
+        pEngine->cursor_end = item_count;
+#if defined(_MSC_VER)
+        QUEUE_SET_TASK_COUNT(pEngine->task_queue, worker_count);
+#endif
+        for ( i = 0; i < worker_count; ++i )
+        {
+            QUEUE_PUT(pEngine->task_queue, tasks + i);
+        }
+
+        QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+
+        if ( (function == GET_WEIGHT || function == GET_WEIGHT_BOUND)
+             && pEngine->typo_threshold > 0 && !IS_CANCELLED(pEngine)
+             && countMatches(pEngine->results, item_count, pEngine->typo_threshold) < pEngine->typo_threshold )
+        {
+            for ( i = 0; i < task_count; ++i )
+            {
+                tasks[i].function = GET_TYPO_WEIGHT;
+            }
+
+            /* the items that are not candidates may match with typos */
+            if ( pEngine->use_candidates )
+            {
+                expandCandidates(pEngine->results, item_count, pSource->begin, source_size);
+                item_count = source_size;
+                pEngine->use_candidates = 0;
+            }
+
+            pEngine->cursor = 0;
+            pEngine->cursor_end = item_count;
+#if defined(_MSC_VER)
+            QUEUE_SET_TASK_COUNT(pEngine->task_queue, worker_count);
+#endif
+            for ( i = 0; i < worker_count; ++i )
+            {
+                QUEUE_PUT(pEngine->task_queue, tasks + i);
+            }
+
+            QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+
+            for ( i = 0; i < task_count; ++i )
+            {
+                tasks[i].function = function;
+            }
+        }
+    }
+
+    int32_t cancelled = IS_CANCELLED(pEngine);
+    uint32_t results_count = item_count;
+    if ( error == 0 && !cancelled
+         && (function == GET_WEIGHT || function == GET_WEIGHT_AND || function == GET_WEIGHT_REFINE
+             || function == GET_WEIGHT_BOUND) )
+    {
+        FeResult* results = pEngine->results;
+        results_count = 0;
+        for ( i = 0; i < item_count; ++i )
+        {
+            if ( results[i].weight > MIN_WEIGHT )
+            {
+                if ( i > results_count )
+                {
+                    results[results_count] = results[i];
+                }
+                ++results_count;
+            }
+        }
+
+        if ( function == GET_WEIGHT_BOUND && results_count > 0 )
+        {
+            scoreBestResults(pEngine, tasks, MIN(task_count, pEngine->cpu_count), results_count);
+            cancelled = IS_CANCELLED(pEngine);
+        }
+    }
+
+    PyEval_RestoreThread(thread_state);
+    if ( pSource->corpus )
+    {
+        --pSource->corpus->readers;
+    }
+    endPhase(pEngine, PHASE_MATCH);
+
+    if ( error != 0 )
+        return -1;
+
+    if ( cancelled )
+        return CANCELLED;
+
+    return results_count;
+}
+
+static int32_t _sortResults(FuzzyEngine* pEngine, TaskItem* tasks, uint32_t task_count,
+                            uint32_t results_count, uint32_t function)
 {
-    free(PyCapsule_GetPointer(obj, NULL));
+    FeResult* results = pEngine->results;
+
+    if ( task_count == 1 || results_count < 60000 )
+    {
+        qsort(results, results_count, sizeof(FeResult), function == Q_SORT ? compare : compare2);
+        return 0;
+    }
+
+    uint32_t merge_function = function == Q_SORT ? MERGE : MERGE_2;
+    uint32_t chunk_size = (results_count + task_count - 1) / task_count;
+    if ( chunk_size < 2000 )
+    {
+        chunk_size = (results_count + (task_count >> 1) - 1) / (task_count >> 1);
+    }
+    task_count = (results_count + chunk_size - 1) / chunk_size;
+    FeResult* buffer = (FeResult*)reserveArena(pEngine->arenas + ARENA_MERGE,
+                                               chunk_size * (task_count >> 1) * sizeof(FeResult));
+    if ( !buffer )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return -1;
+    }
+
+    MergeTaskItem* merge_tasks = NULL;
+    merge_tasks = (MergeTaskItem*)reserveArena(pEngine->arenas + ARENA_MERGE_TASKS,
+                                               task_count * sizeof(MergeTaskItem));
+    if ( !merge_tasks )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return -1;
+    }
+
+#if defined(_MSC_VER)
+    QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
+#endif
+    uint32_t i = 0;
+    for ( ; i < task_count; ++i )
+    {
+        uint32_t offset = i * chunk_size;
+        uint32_t length = MIN(chunk_size, results_count - offset);
+
+        tasks[i].function = function;
+        tasks[i].offset = offset;
+        tasks[i].length = length;
+        QUEUE_PUT(pEngine->task_queue, tasks + i);
+    }
+
+    QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+
+    while ( chunk_size < results_count )
+    {
+        uint32_t q = results_count / (chunk_size << 1);
+        uint32_t r = results_count % (chunk_size << 1);
+#if defined(_MSC_VER)
+        QUEUE_SET_TASK_COUNT(pEngine->task_queue, q + r/chunk_size);
+#endif
+        for ( i = 0; i < q; ++i )
+        {
+            merge_tasks[i].function = merge_function;
+            merge_tasks[i].offset_1 = i * (chunk_size << 1);
+            merge_tasks[i].length_1 = chunk_size;
+            merge_tasks[i].length_2 = chunk_size;
+            merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
+            QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
+        }
+
+        if ( r > chunk_size )
+        {
+            merge_tasks[i].function = merge_function;
+            merge_tasks[i].offset_1 = i * (chunk_size << 1);
+            merge_tasks[i].length_1 = chunk_size;
+            merge_tasks[i].length_2 = r - chunk_size;
+            merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
+            QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
+        }
+
+        QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+
+        chunk_size <<= 1;
+    }
+
+    return 0;
+}
+
+/**
+ * sort pEngine->results in parallel,
+ * `function` is Q_SORT to sort by weight, or Q_SORT_2 to sort by path_weight.
+ * if `top_k` is not 0, only the first `top_k` results are selected and sorted, the rest are left unsorted.
+ *
+ * return the number of the sorted results, -1 if error occurs.
+ */
+static int64_t sortResults(FuzzyEngine* pEngine, TaskItem* tasks, uint32_t task_count,
+                           uint32_t results_count, uint32_t function, uint32_t top_k)
+{
+    int64_t ret = results_count;
+
+    /* python objects are not touched while sorting */
+    Py_BEGIN_ALLOW_THREADS
+    if ( top_k > 0 && top_k < results_count )
+    {
+        int (*cmp)(const void*, const void*) = function == Q_SORT ? compare : compare2;
+        selectTopK(pEngine->results, results_count, top_k, cmp);
+        qsort(pEngine->results, top_k, sizeof(FeResult), cmp);
+        ret = top_k;
+    }
+    else if ( _sortResults(pEngine, tasks, task_count, results_count, function) < 0 )
+    {
+        ret = -1;
+    }
+    endPhase(pEngine, PHASE_SORT);
+    Py_END_ALLOW_THREADS
+
+    return ret;
+}
+
+/**
+ * copy the weights of pEngine->results to `weights` and return a list of the corresponding items of `py_source`,
+ * `function` is PY_SET_ITEM if `weights` is an array of weight_t, or PY_SET_ITEM_2 if it is an array of uint32_t.
+ */
+static PyObject* buildTextList(FuzzyEngine* pEngine, PyObject* py_source, uint32_t task_count,
+                               uint32_t results_count, void* weights, uint32_t function)
+{
+    FeResult* results = pEngine->results;
+    PyObject* text_list = PyList_New(results_count);
+    if ( !text_list )
+        return NULL;
+
+    uint32_t i = 0;
+    if ( task_count == 1 || results_count < 40000 )
+    {
+        for ( i = 0; i < results_count; ++i )
+        {
+            if ( function == PY_SET_ITEM )
+                ((weight_t*)weights)[i] = results[i].weight;
+            else
+                ((uint32_t*)weights)[i] = results[i].path_weight;
+            /* PyList_SET_ITEM() steals a reference to item.     */
+            /* PySequence_ITEM() return value: New reference. */
+            PyList_SET_ITEM(text_list, i, PySequence_ITEM(py_source, results[i].index));
+        }
+    }
+    else
+    {
+        uint32_t chunk_size = (results_count + task_count - 1) / task_count;
+        if ( chunk_size < 8000 )
+        {
+            chunk_size = (results_count + (task_count >> 1) - 1) / (task_count >> 1);
+        }
+        task_count = (results_count + chunk_size - 1) / chunk_size;
+
+        PySetTaskItem* py_set_tasks = NULL;
+        py_set_tasks = (PySetTaskItem*)reserveArena(pEngine->arenas + ARENA_PY_SET_TASKS,
+                                                    task_count * sizeof(PySetTaskItem));
+        if ( !py_set_tasks )
+        {
+            Py_DECREF(text_list);
+            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+            return NULL;
+        }
+
+#if defined(_MSC_VER)
+        QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
+#endif
+        for ( i = 0; i < task_count; ++i )
+        {
+            uint32_t offset = i * chunk_size;
+            uint32_t length = MIN(chunk_size, results_count - offset);
+
+            py_set_tasks[i].function = function;
+            py_set_tasks[i].offset = offset;
+            py_set_tasks[i].length = length;
+            py_set_tasks[i].weights = (weight_t*)weights;
+            py_set_tasks[i].text_list = text_list;
+            py_set_tasks[i].py_source = py_source;
+            QUEUE_PUT(pEngine->task_queue, py_set_tasks + i);
+        }
+
+        QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+    }
+
+    return text_list;
+}
+
+/**
+ * the same as buildTextList(), except that it returns an array('I') of the indices of the items in the source,
+ * so that no python object is created for each item.
+ */
+static PyObject* buildIndexArray(FuzzyEngine* pEngine, uint32_t results_count, void* weights, uint32_t function)
+{
+    uint32_t* indices = NULL;
+    PyObject* bytes = newIndexBytes(results_count, &indices);
+    if ( !bytes )
+        return NULL;
+
+    FeResult* results = pEngine->results;
+    uint32_t i = 0;
+    for ( ; i < results_count; ++i )
+    {
+        if ( function == PY_SET_ITEM )
+            ((weight_t*)weights)[i] = results[i].weight;
+        else
+            ((uint32_t*)weights)[i] = results[i].path_weight;
+        indices[i] = results[i].index;
+    }
+
+    return createIndexArray(bytes);
+}
+
+/**
+ * put the highlights of the first `count` results into the dict `py_highlights`, keyed by the indices of
+ * the items in `py_source`, so that the best results need not be matched again by getHighlights().
+ * the columns are those of the items, even if the digests of the items are matched.
+ *
+ * return 0 on success, -1 if error occurs.
+ */
+static int32_t putHighlights(FuzzyEngine* pEngine, PyObject* py_source, uint32_t count, PyObject* py_highlights)
+{
+    FeResult* results = pEngine->results;
+    uint32_t i = 0;
+    for ( ; i < count; ++i )
+    {
+        uint32_t index = results[i].index;
+        char* str;
+        uint32_t len;
+        getSourceText(pEngine, index - pEngine->begin, &str, &len);
+
+        /* the text being matched may be a digest of the item */
+        char* item_str = str;
+        uint32_t item_len;
+        if ( pEngine->corpus )
+        {
+            item_str = pEngine->corpus->arena + pEngine->corpus->items[index].offset;
+        }
+        else if ( pyObject_ToStringAndSize(PyList_GET_ITEM(py_source, index), &item_str, &item_len) < 0 )
+        {
+            fprintf(stderr, "pyObject_ToStringAndSize error!\n");
+            return -1;
+        }
+
+        /* the item is left to getHighlights() if its highlights can not be got */
+        HighlightGroup* pGroup = getHighlights(str, len, pEngine->pPattern_ctxt, pEngine->is_name_only);
+        if ( !pGroup )
+            continue;
+
+        uint32_t offset = (uint32_t)(str - item_str);
+        PyObject* list = PyList_New(pGroup->end_index);
+        uint32_t j;
+        for ( j = 0; list && j < pGroup->end_index; ++j )
+        {
+            PyList_SetItem(list, j, Py_BuildValue("[I,I]", pGroup->positions[j].col + offset,
+                                                  pGroup->positions[j].len));
+        }
+        free(pGroup);
+
+        PyObject* key = Py_BuildValue("I", index);
+        int ret = list && key ? PyDict_SetItem(py_highlights, key, list) : -1;
+        Py_XDECREF(key);
+        Py_XDECREF(list);
+        if ( ret < 0 )
+            return -1;
+    }
+
+    return 0;
+}
+
+/**
+ * `*pHighlights` is the `highlights` argument of the match functions, it is set to NULL if it is None.
+ *
+ * return 0 on success, -1 if it is neither None nor a dict.
+ */
+static int32_t checkHighlights(PyObject** pHighlights)
+{
+    if ( *pHighlights == Py_None )
+    {
+        *pHighlights = NULL;
+    }
+    else if ( *pHighlights && !PyDict_Check(*pHighlights) )
+    {
+        PyErr_SetString(PyExc_TypeError, "parameter `highlights` must be a dict.");
+        return -1;
+    }
+
+    return 0;
+}
+
+/**
+ * fuzzyMatch(engine, source, pattern, is_name_only=False, sort_results=True, begin=0, end=0xFFFFFFFF, top_k=0, bonus=None, return_array=False, highlight_count=0, highlights=None, min_results=0, two_phase=False)
+ *
+ * `source` is a list or a corpus created by createCorpus().
+ * `is_name_only` is optional, it defaults to `False`, which indicates using the full path matching algorithm.
+ * `sort_results` is optional, it defaults to `True`, which indicates whether to sort the results.
+ * `begin` and `end` are optional, only the items of `source` in range [begin, end) are matched.
+ * `top_k` is optional, if it is not 0, only the best `top_k` results are sorted and put at the front,
+ *      the rest can be sorted later by sortRemainder().
+ * `bonus` is optional, an array('f') whose i-th float is added to the weight of the i-th item of `source`
+ *      if the item matches, e.g., to rank the recently used files higher.
+ * `return_array` is optional, if it is True, an array('I') of the indices of the items in `source` is returned
+ *      instead of the list of items, so that the items need not be got until they are used.
+ * `highlight_count` and `highlights` are optional, if `highlights` is a dict, the highlights of the first
+ *      `highlight_count` results are put into it, keyed by the indices of the items in `source`.
+ *      the value is the same as an item of the list returned by getHighlights() with the same `is_name_only`.
+ * `min_results` is optional, if it is not 0 and fewer than `min_results` items match `pattern`, the items
+ *      that match `pattern` with a few typos are returned as well, e.g., "leaderf" for "lenaerf",
+ *      their weights are lower than those of the items that match, and `bonus` is not added to them.
+ * `two_phase` is optional, if it is True and `top_k` is not 0, a cheap upper bound of the weight is computed for
+ *      every item first, then only the items with the highest bounds are scored, until the best `top_k` results
+ *      are guaranteed to be the same as those of a full match, which is much faster for a huge `source`.
+ *      the weights of the other items may be their bounds, so the rest are sorted by sortRemainder() roughly.
+ *
+ * return a tuple, (a list of corresponding weight, a sorted list of items from `source` that match `pattern`),
+ * or None if cancel() is called before the weights are computed.
+ */
+static PyObject* fuzzyEngine_fuzzyMatch_(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    PyObject* py_engine = NULL;
+    PyObject* py_source = NULL;
+    PyObject* py_patternCtxt = NULL;
+    uint8_t is_name_only = 0;
+    uint8_t sort_results = 1;
+    uint32_t begin = 0;
+    uint32_t end = 0xFFFFFFFF;
+    uint32_t top_k = 0;
+    PyObject* py_bonus = NULL;
+    uint8_t return_array = 0;
+    uint32_t highlight_count = 0;
+    PyObject* py_highlights = NULL;
+    uint32_t min_results = 0;
+    uint8_t two_phase = 0;
+    static char* kwlist[] = {"engine", "source", "pattern", "is_name_only", "sort_results", "begin", "end",
+                             "top_k", "bonus", "return_array", "highlight_count", "highlights",
+                             "min_results", "two_phase", NULL};
+
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOO|bbIIIObIOIb:fuzzyMatch", kwlist, &py_engine, &py_source,
+                                      &py_patternCtxt, &is_name_only, &sort_results, &begin, &end, &top_k,
+                                      &py_bonus, &return_array, &highlight_count, &py_highlights,
+                                      &min_results, &two_phase) )
+        return NULL;
+
+    if ( checkHighlights(&py_highlights) < 0 )
+        return NULL;
+
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
+    if ( !pEngine )
+        return NULL;
+
+    FeSource source;
+    if ( parseSource(py_source, begin, end, &source) < 0 )
+        return NULL;
+
+    if ( source.size == 0 )
+    {
+        return Py_BuildValue("([],[])");
+    }
+
+    pEngine->pPattern_ctxt = (PatternContext*)PyCapsule_GetPointer(py_patternCtxt, NULL);
+    if ( !pEngine->pPattern_ctxt )
+        return NULL;
+
+    pEngine->is_name_only = is_name_only;
+    pEngine->skip_len = 0;
+    pEngine->typo_threshold = min_results;
+
+    FeArray bonus;
+    if ( getBonus(pEngine, py_bonus, &bonus) < 0 )
+        return NULL;
+
+    TaskItem* tasks = NULL;
+    uint32_t task_count = 0;
+    uint32_t function = getWeightFunction(pEngine, two_phase && sort_results, top_k);
+    int64_t results_count = computeWeights(pEngine, &source, function, NO_CATEGORY, NULL, &tasks, &task_count);
+    pEngine->typo_threshold = 0;
+    releaseBonus(pEngine, &bonus);
+    if ( results_count <= 0 )
+    {
+        releaseBuffers(pEngine);
+        if ( results_count == CANCELLED )
+            Py_RETURN_NONE;
+
+        return results_count == 0 ? Py_BuildValue("([],[])") : NULL;
+    }
+
+    int64_t sorted_count = results_count;
+    if ( function == GET_WEIGHT_BOUND )
+    {
+        /* the best results have been sorted by scoreBestResults() */
+        sorted_count = MIN(top_k, results_count);
+    }
+    else if ( sort_results )
+    {
+        sorted_count = sortResults(pEngine, tasks, task_count, (uint32_t)results_count, Q_SORT, top_k);
+        if ( sorted_count < 0 )
+        {
+            releaseBuffers(pEngine);
+            return NULL;
+        }
+    }
+
+    if ( py_highlights && putHighlights(pEngine, source.py_source, (uint32_t)MIN(highlight_count, sorted_count),
+                                        py_highlights) < 0 )
+    {
+        releaseBuffers(pEngine);
+        return NULL;
+    }
+
+    weight_t* weights = (weight_t*)malloc((size_t)results_count * sizeof(weight_t));
+    if ( !weights )
+    {
+        releaseBuffers(pEngine);
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return NULL;
+    }
+
+    PyObject* text_list = NULL;
+    if ( return_array )
+        text_list = buildIndexArray(pEngine, (uint32_t)results_count, weights, PY_SET_ITEM);
+    else
+        text_list = buildTextList(pEngine, source.py_source, task_count, (uint32_t)results_count,
+                                  weights, PY_SET_ITEM);
+    releaseBuffers(pEngine);
+    if ( !text_list )
+    {
+        free(weights);
+        return NULL;
+    }
+
+    PyObject* py_weights = createWeights(weights);
+    setSortedCount(py_weights, (uint32_t)sorted_count, (uint32_t)results_count);
+
+    return Py_BuildValue("(NN)", py_weights, text_list);
+}
+
+/**
+ * fuzzyMatchEx(engine, source, pattern, is_name_only=False, sort_results=True, is_and_mode=False, begin=0, end=0xFFFFFFFF, top_k=0, bonus=None, return_array=False, highlight_count=0, highlights=None, min_results=0, two_phase=False)
+ *
+ * same as fuzzyMatch(), the only difference is the return value, `top_k`, `return_array`, `highlights`,
+ * `min_results` and `two_phase` are ignored if `is_and_mode` is True.
+ * return a tuple, (a list of corresponding weight, a sorted list of index to items from `source` that match `pattern`),
+ * or None if it is cancelled.
+ */
+static PyObject* fuzzyEngine_fuzzyMatchEx_(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    PyObject* py_engine = NULL;
+    PyObject* py_source = NULL;
+    PyObject* py_patternCtxt = NULL;
+    uint8_t is_name_only = 0;
+    uint8_t sort_results = 1;
+    uint8_t is_and_mode = 0;
+    uint32_t begin = 0;
+    uint32_t end = 0xFFFFFFFF;
+    uint32_t top_k = 0;
+    PyObject* py_bonus = NULL;
+    uint8_t return_array = 0;
+    uint32_t highlight_count = 0;
+    PyObject* py_highlights = NULL;
+    uint32_t min_results = 0;
+    uint8_t two_phase = 0;
+    static char* kwlist[] = {"engine", "source", "pattern", "is_name_only", "sort_results", "is_and_mode",
+                             "begin", "end", "top_k", "bonus", "return_array", "highlight_count", "highlights",
+                             "min_results", "two_phase", NULL};
+
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOO|bbbIIIObIOIb:fuzzyMatch", kwlist, &py_engine, &py_source,
+                                      &py_patternCtxt, &is_name_only, &sort_results, &is_and_mode, &begin, &end,
+                                      &top_k, &py_bonus, &return_array, &highlight_count, &py_highlights,
+                                      &min_results, &two_phase) )
+        return NULL;
+
+    if ( checkHighlights(&py_highlights) < 0 )
+        return NULL;
+
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
+    if ( !pEngine )
+        return NULL;
+
+    FeSource source;
+    if ( parseSource(py_source, begin, end, &source) < 0 )
+        return NULL;
+
+    if ( source.size == 0 )
+    {
+        return Py_BuildValue("([],[])");
+    }
+
+    pEngine->pPattern_ctxt = (PatternContext*)PyCapsule_GetPointer(py_patternCtxt, NULL);
+    if ( !pEngine->pPattern_ctxt )
+        return NULL;
+
+    pEngine->is_name_only = is_name_only;
+    pEngine->skip_len = 0;
+    pEngine->typo_threshold = min_results;
+
+    FeArray bonus;
+    if ( getBonus(pEngine, py_bonus, &bonus) < 0 )
+        return NULL;
+
+    TaskItem* tasks = NULL;
+    uint32_t task_count = 0;
+    uint32_t function = getWeightFunction(pEngine, two_phase && sort_results && !is_and_mode, top_k);
+    int64_t results_count = computeWeights(pEngine, &source, function, NO_CATEGORY, NULL, &tasks, &task_count);
+    pEngine->typo_threshold = 0;
+    releaseBonus(pEngine, &bonus);
+    if ( results_count <= 0 )
+    {
+        releaseBuffers(pEngine);
+        if ( results_count == CANCELLED )
+            Py_RETURN_NONE;
+
+        return results_count == 0 ? Py_BuildValue("([],[])") : NULL;
+    }
+
+    int64_t sorted_count = results_count;
+    if ( function == GET_WEIGHT_BOUND )
+    {
+        /* the best results have been sorted by scoreBestResults() */
+        sorted_count = MIN(top_k, results_count);
+    }
+    else if ( sort_results )
+    {
+        sorted_count = sortResults(pEngine, tasks, task_count, (uint32_t)results_count, Q_SORT,
+                                   is_and_mode ? 0 : top_k);
+        if ( sorted_count < 0 )
+        {
+            releaseBuffers(pEngine);
+            return NULL;
+        }
+    }
+
+    if ( !is_and_mode && py_highlights
+         && putHighlights(pEngine, source.py_source, (uint32_t)MIN(highlight_count, sorted_count), py_highlights) < 0 )
+    {
+        releaseBuffers(pEngine);
+        return NULL;
+    }
+
+    FeResult* results = pEngine->results;
+    uint32_t i = 0;
+    if ( is_and_mode )
+    {
+        PyObject* weight_list = PyList_New((Py_ssize_t)results_count);
+        PyObject* index_list = PyList_New((Py_ssize_t)results_count);
+        for ( i = 0; i < results_count; ++i )
+        {
+            /* PyList_SET_ITEM() steals a reference to item.     */
+            PyList_SET_ITEM(weight_list, i, Py_BuildValue("f", results[i].weight));
+            PyList_SET_ITEM(index_list, i, Py_BuildValue("I", results[i].index));
+        }
+
+        releaseBuffers(pEngine);
+
+        return Py_BuildValue("(NN)", weight_list, index_list);
+    }
+    else
+    {
+        weight_t* weights = (weight_t*)malloc((size_t)results_count * sizeof(weight_t));
+        if ( !weights )
+        {
+            releaseBuffers(pEngine);
+            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+            return NULL;
+        }
+
+        PyObject* index_list = NULL;
+        if ( return_array )
+        {
+            index_list = buildIndexArray(pEngine, (uint32_t)results_count, weights, PY_SET_ITEM);
+        }
+        else
+        {
+            index_list = PyList_New((Py_ssize_t)results_count);
+            for ( i = 0; index_list && i < results_count; ++i )
+            {
+                weights[i] = results[i].weight;
+                /* PyList_SET_ITEM() steals a reference to item.     */
+                PyList_SET_ITEM(index_list, i, Py_BuildValue("I", results[i].index));
+            }
+        }
+
+        releaseBuffers(pEngine);
+        if ( !index_list )
+        {
+            free(weights);
+            return NULL;
+        }
+
+        PyObject* py_weights = createWeights(weights);
+        setSortedCount(py_weights, (uint32_t)sorted_count, (uint32_t)results_count);
+
+        return Py_BuildValue("(NN)", py_weights, index_list);
+    }
 }
 
 /**
- * initPattern(pattern)
+ * fuzzyMatchAnd(engine, source, patterns, is_name_only=False, sort_results=True, begin=0, end=0xFFFFFFFF)
+ *
+ * `patterns` is a list of patterns returned by initPattern(), an item matches only if it matches all of them,
+ * the highlights of each pattern can be got by calling getHighlights() with the same pattern.
+ * the other arguments are the same as fuzzyMatch().
+ *
+ * return a tuple, (a list of the sum of the weights of all the patterns, a list of index to items from `source`
+ * that match all the patterns), or None if it is cancelled.
  */
-static PyObject* fuzzyEngine_initPattern(PyObject* self, PyObject* args)
+static PyObject* fuzzyEngine_fuzzyMatchAnd_(PyObject* self, PyObject* args, PyObject* kwargs)
 {
-    const char* pattern;
-    Py_ssize_t pattern_len;
+    PyObject* py_engine = NULL;
+    PyObject* py_source = NULL;
+    PyObject* py_patterns = NULL;
+    uint8_t is_name_only = 0;
+    uint8_t sort_results = 1;
+    uint32_t begin = 0;
+    uint32_t end = 0xFFFFFFFF;
+    static char* kwlist[] = {"engine", "source", "patterns", "is_name_only", "sort_results", "begin", "end", NULL};
 
-    if ( !PyArg_ParseTuple(args, "s#:initPattern", &pattern, &pattern_len) )
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOO|bbII:fuzzyMatchAnd", kwlist, &py_engine, &py_source,
+                                      &py_patterns, &is_name_only, &sort_results, &begin, &end) )
         return NULL;
 
-    PatternContext* pCtxt = initPattern(pattern, (uint16_t)pattern_len);
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
+    if ( !pEngine )
+        return NULL;
 
-    return PyCapsule_New(pCtxt, NULL, delPatternContext);
-}
+    if ( !PyList_Check(py_patterns) || PyList_Size(py_patterns) == 0 )
+    {
+        PyErr_SetString(PyExc_TypeError, "`patterns` must be a non-empty list.");
+        return NULL;
+    }
 
-static void delWeights(PyObject* obj)
-{
-    free(PyCapsule_GetPointer(obj, NULL));
-}
+    FeSource source;
+    if ( parseSource(py_source, begin, end, &source) < 0 )
+        return NULL;
 
-static PyObject* createWeights(void* weights)
-{
-    return PyCapsule_New(weights, NULL, delWeights);
+    if ( source.size == 0 )
+    {
+        return Py_BuildValue("([],[])");
+    }
+
+    uint32_t pattern_count = (uint32_t)PyList_Size(py_patterns);
+    PatternContext** pattern_ctxts = (PatternContext**)malloc(pattern_count * sizeof(PatternContext*));
+    if ( !pattern_ctxts )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return NULL;
+    }
+
+    uint32_t i = 0;
+    for ( ; i < pattern_count; ++i )
+    {
+        pattern_ctxts[i] = (PatternContext*)PyCapsule_GetPointer(PyList_GET_ITEM(py_patterns, i), NULL);
+        if ( !pattern_ctxts[i] )
+        {
+            free(pattern_ctxts);
+            return NULL;
+        }
+    }
+
+    pEngine->pattern_ctxts = pattern_ctxts;
+    pEngine->pattern_count = pattern_count;
+    pEngine->is_name_only = is_name_only;
+    pEngine->skip_len = 0;
+
+    TaskItem* tasks = NULL;
+    uint32_t task_count = 0;
+    int64_t results_count = computeWeights(pEngine, &source, GET_WEIGHT_AND, NO_CATEGORY, NULL, &tasks, &task_count);
+    free(pattern_ctxts);
+    pEngine->pattern_ctxts = NULL;
+    pEngine->pattern_count = 0;
+    if ( results_count <= 0 )
+    {
+        releaseBuffers(pEngine);
+        if ( results_count == CANCELLED )
+            Py_RETURN_NONE;
+
+        return results_count == 0 ? Py_BuildValue("([],[])") : NULL;
+    }
+
+    if ( sort_results && sortResults(pEngine, tasks, task_count, (uint32_t)results_count, Q_SORT, 0) < 0 )
+    {
+        releaseBuffers(pEngine);
+        return NULL;
+    }
+
+    FeResult* results = pEngine->results;
+    PyObject* weight_list = PyList_New((Py_ssize_t)results_count);
+    PyObject* index_list = PyList_New((Py_ssize_t)results_count);
+    for ( i = 0; i < results_count; ++i )
+    {
+        /* PyList_SET_ITEM() steals a reference to item.     */
+        PyList_SET_ITEM(weight_list, i, Py_BuildValue("f", results[i].weight));
+        PyList_SET_ITEM(index_list, i, Py_BuildValue("I", results[i].index));
+    }
+
+    releaseBuffers(pEngine);
+
+    return Py_BuildValue("(NN)", weight_list, index_list);
 }
 
 /**
- * fuzzyMatch(engine, source, pattern, is_name_only=False, sort_results=True)
+ * fuzzyMatchRefine(engine, source, name_pattern, path_pattern, sort_results=True, begin=0, end=0xFFFFFFFF, top_k=0, return_array=False)
  *
- * `is_name_only` is optional, it defaults to `False`, which indicates using the full path matching algorithm.
- * `sort_results` is optional, it defaults to `True`, which indicates whether to sort the results.
+ * the items of `source` are file paths, e.g., "abc;def" matches the paths whose basename matches "abc"
+ * and whose directory name matches "def", `name_pattern` and `path_pattern` are returned by initPattern().
+ * the weight of an item is the sum of the weights of the two parts.
+ * the other arguments are the same as fuzzyMatch().
  *
- * return a tuple, (a list of corresponding weight, a sorted list of items from `source` that match `pattern`).
+ * return a tuple, (a list of corresponding weight, a sorted list of items from `source` that match both patterns),
+ * or None if it is cancelled.
  */
-static PyObject* fuzzyEngine_fuzzyMatch(PyObject* self, PyObject* args, PyObject* kwargs)
+static PyObject* fuzzyEngine_fuzzyMatchRefine_(PyObject* self, PyObject* args, PyObject* kwargs)
 {
     PyObject* py_engine = NULL;
     PyObject* py_source = NULL;
-    PyObject* py_patternCtxt = NULL;
-    uint8_t is_name_only = 0;
+    PyObject* py_name_pattern = NULL;
+    PyObject* py_path_pattern = NULL;
     uint8_t sort_results = 1;
-    static char* kwlist[] = {"engine", "source", "pattern", "is_name_only", "sort_results", NULL};
-
-    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOO|bb:fuzzyMatch", kwlist, &py_engine,
-                                      &py_source, &py_patternCtxt, &is_name_only, &sort_results) )
+    uint32_t begin = 0;
+    uint32_t end = 0xFFFFFFFF;
+    uint32_t top_k = 0;
+    uint8_t return_array = 0;
+    static char* kwlist[] = {"engine", "source", "name_pattern", "path_pattern", "sort_results", "begin", "end",
+                             "top_k", "return_array", NULL};
+
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOOO|bIIIb:fuzzyMatchRefine", kwlist, &py_engine, &py_source,
+                                      &py_name_pattern, &py_path_pattern, &sort_results, &begin, &end, &top_k,
+                                      &return_array) )
         return NULL;
 
     FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
     if ( !pEngine )
         return NULL;
 
-    if ( !PyList_Check(py_source) )
+    PatternContext* pattern_ctxts[2];
+    pattern_ctxts[0] = (PatternContext*)PyCapsule_GetPointer(py_name_pattern, NULL);
+    if ( !pattern_ctxts[0] )
+        return NULL;
+
+    pattern_ctxts[1] = (PatternContext*)PyCapsule_GetPointer(py_path_pattern, NULL);
+    if ( !pattern_ctxts[1] )
+        return NULL;
+
+    FeSource source;
+    if ( parseSource(py_source, begin, end, &source) < 0 )
+        return NULL;
+
+    if ( source.size == 0 )
+    {
+        return Py_BuildValue("([],[])");
+    }
+
+    pEngine->pattern_ctxts = pattern_ctxts;
+    pEngine->pattern_count = 2;
+    pEngine->skip_len = 0;
+
+    TaskItem* tasks = NULL;
+    uint32_t task_count = 0;
+    int64_t results_count = computeWeights(pEngine, &source, GET_WEIGHT_REFINE, NO_CATEGORY, NULL,
+                                           &tasks, &task_count);
+    pEngine->pattern_ctxts = NULL;
+    pEngine->pattern_count = 0;
+    if ( results_count <= 0 )
+    {
+        releaseBuffers(pEngine);
+        if ( results_count == CANCELLED )
+            Py_RETURN_NONE;
+
+        return results_count == 0 ? Py_BuildValue("([],[])") : NULL;
+    }
+
+    int64_t sorted_count = results_count;
+    if ( sort_results )
+    {
+        sorted_count = sortResults(pEngine, tasks, task_count, (uint32_t)results_count, Q_SORT, top_k);
+        if ( sorted_count < 0 )
+        {
+            releaseBuffers(pEngine);
+            return NULL;
+        }
+    }
+
+    weight_t* weights = (weight_t*)malloc((size_t)results_count * sizeof(weight_t));
+    if ( !weights )
+    {
+        releaseBuffers(pEngine);
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return NULL;
+    }
+
+    PyObject* text_list = NULL;
+    if ( return_array )
+        text_list = buildIndexArray(pEngine, (uint32_t)results_count, weights, PY_SET_ITEM);
+    else
+        text_list = buildTextList(pEngine, source.py_source, task_count, (uint32_t)results_count,
+                                  weights, PY_SET_ITEM);
+    releaseBuffers(pEngine);
+    if ( !text_list )
+    {
+        free(weights);
+        return NULL;
+    }
+
+    PyObject* py_weights = createWeights(weights);
+    setSortedCount(py_weights, (uint32_t)sorted_count, (uint32_t)results_count);
+
+    return Py_BuildValue("(NN)", py_weights, text_list);
+}
+
+/**
+ * copy the k-th item of `src_list` to the n-th of `dst_list`, or the k-th index of `src_indices`
+ * to the n-th of `dst_indices` if the items are index arrays.
+ */
+static void copyItem(PyObject* dst_list, uint32_t* dst_indices, uint32_t n,
+                     PyObject* src_list, const uint32_t* src_indices, uint32_t k)
+{
+    if ( dst_indices )
+    {
+        dst_indices[n] = src_indices[k];
+    }
+    else
+    {
+        /* PyList_SET_ITEM() steals a reference to item.     */
+        /* PySequence_ITEM() return value: New reference. */
+        PyList_SET_ITEM(dst_list, n, PySequence_ITEM(src_list, k));
+    }
+}
+
+/**
+ * merge(tuple_a, tuple_b)
+ * tuple_a, tuple_b are the return value of fuzzyEngine_fuzzyMatch,
+ * the items of both are lists, or both are index arrays if they are returned with `return_array`.
+ */
+static PyObject* fuzzyEngine_merge(PyObject* self, PyObject* args)
+{
+    PyObject* weight_list_a = NULL;
+    PyObject* text_list_a = NULL;
+    PyObject* weight_list_b = NULL;
+    PyObject* text_list_b = NULL;
+    if ( !PyArg_ParseTuple(args, "(OO)(OO):merge", &weight_list_a, &text_list_a,  &weight_list_b, &text_list_b) )
+        return NULL;
+
+    Py_ssize_t length_a = PyObject_Length(text_list_a);
+    Py_ssize_t length_b = PyObject_Length(text_list_b);
+    if ( length_a < 0 || length_b < 0 )
+        return NULL;
+
+    uint32_t size_a = (uint32_t)length_a;
+    if ( size_a == 0 )
+    {
+        return Py_BuildValue("(OO)", weight_list_b, text_list_b);
+    }
+    uint32_t size_b = (uint32_t)length_b;
+    if ( size_b == 0 )
+    {
+        return Py_BuildValue("(OO)", weight_list_a, text_list_a);
+    }
+
+    uint32_t is_list = PyList_Check(text_list_a) ? 1 : 0;
+    if ( is_list != (PyList_Check(text_list_b) ? 1u : 0u) )
+    {
+        PyErr_SetString(PyExc_TypeError, "the items to merge must be both lists or both index arrays.");
+        return NULL;
+    }
+
+    FeArray array_a;
+    FeArray array_b;
+    const uint32_t* indices_a = NULL;
+    const uint32_t* indices_b = NULL;
+    if ( !is_list )
+    {
+        if ( getArray(text_list_a, 'I', sizeof(uint32_t), 0, "tuple_a", &array_a) < 0 )
+            return NULL;
+
+        if ( getArray(text_list_b, 'I', sizeof(uint32_t), 0, "tuple_b", &array_b) < 0 )
+        {
+            releaseArray(&array_a);
+            return NULL;
+        }
+        indices_a = (const uint32_t*)array_a.data;
+        indices_b = (const uint32_t*)array_b.data;
+    }
+
+    weight_t* weights = (weight_t*)malloc((size_a + size_b) * sizeof(weight_t));
+    uint32_t* indices = NULL;
+    PyObject* text_list = NULL;
+    if ( weights )
+    {
+        text_list = is_list ? PyList_New(size_a + size_b) : newIndexBytes(size_a + size_b, &indices);
+    }
+
+    if ( !text_list )
+    {
+        if ( !is_list )
+        {
+            releaseArray(&array_a);
+            releaseArray(&array_b);
+        }
+        free(weights);
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return PyErr_Occurred() ? NULL : PyErr_NoMemory();
+    }
+
+    uint32_t i = 0;
+    uint32_t j = 0;
+
+    /**
+     * if a list is only partially sorted, the merged list is sorted as long as the sorted part of it
+     * is not used up, the rest of both lists is appended unsorted.
+     */
+    uint32_t sorted_a = getSortedCount(weight_list_a, size_a);
+    uint32_t sorted_b = getSortedCount(weight_list_b, size_b);
+
+    weight_t* weights_a = (weight_t*)PyCapsule_GetPointer(weight_list_a, NULL);
+    weight_t w_a = weights_a[i];
+    weight_t* weights_b = (weight_t*)PyCapsule_GetPointer(weight_list_b, NULL);
+    weight_t w_b = weights_b[j];
+    while ( i < sorted_a && j < sorted_b )
+    {
+        if ( w_a > w_b )
+        {
+            weights[i + j] = weights_a[i];
+            copyItem(text_list, indices, i + j, text_list_a, indices_a, i);
+            ++i;
+            if ( i < size_a )
+            {
+                w_a = weights_a[i];
+            }
+        }
+        else
+        {
+            weights[i + j] = weights_b[j];
+            copyItem(text_list, indices, i + j, text_list_b, indices_b, j);
+            ++j;
+            if ( j < size_b )
+            {
+                w_b = weights_b[j];
+            }
+        }
+    }
+
+    uint32_t sorted_count = i + j;
+    if ( i == size_a )
+    {
+        sorted_count += sorted_b - j;
+    }
+    else if ( j == size_b )
+    {
+        sorted_count += sorted_a - i;
+    }
+
+    while ( i < size_a )
+    {
+        weights[i + j] = weights_a[i];
+        copyItem(text_list, indices, i + j, text_list_a, indices_a, i);
+        ++i;
+    }
+    while ( j < size_b )
     {
-        PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list.");
-        return NULL;
+        weights[i + j] = weights_b[j];
+        copyItem(text_list, indices, i + j, text_list_b, indices_b, j);
+        ++j;
     }
 
-    uint32_t source_size = (uint32_t)PyList_Size(py_source);
-    if ( source_size == 0 )
+    if ( !is_list )
     {
-        return Py_BuildValue("([],[])");
+        releaseArray(&array_a);
+        releaseArray(&array_b);
+        text_list = createIndexArray(text_list);
+        if ( !text_list )
+        {
+            free(weights);
+            return NULL;
+        }
     }
 
-    pEngine->pPattern_ctxt = (PatternContext*)PyCapsule_GetPointer(py_patternCtxt, NULL);
-    if ( !pEngine->pPattern_ctxt )
-        return NULL;
+    PyObject* py_weights = createWeights(weights);
+    setSortedCount(py_weights, sorted_count, size_a + size_b);
 
-    pEngine->is_name_only = is_name_only;
+    return Py_BuildValue("(NN)", py_weights, text_list);
+}
 
-    uint32_t max_task_count  = MAX_TASK_COUNT(pEngine->cpu_count);
-    uint32_t chunk_size = (source_size + max_task_count - 1) / max_task_count;
-    uint32_t task_count = (source_size + chunk_size - 1) / chunk_size;
-    if ( chunk_size == 1 || pEngine->cpu_count == 1 )
+/**
+ * sortRemainder(tuple)
+ * `tuple` is the return value of fuzzyMatch() called with `top_k`, or of merge(),
+ * sort the part of the results that is not sorted yet, the lists (or the index array) in `tuple`
+ * are sorted in place. if fuzzyMatch() is called with `two_phase`, the weights of the rest may be
+ * their upper bounds, so they are not in the exact order.
+ */
+static PyObject* fuzzyEngine_sortRemainder(PyObject* self, PyObject* args)
+{
+    PyObject* py_weights = NULL;
+    PyObject* text_list = NULL;
+    if ( !PyArg_ParseTuple(args, "(OO):sortRemainder", &py_weights, &text_list) )
+        return NULL;
+
+    uint32_t is_list = PyList_Check(text_list) ? 1 : 0;
+    FeArray index_array;
+    uint32_t size = 0;
+    if ( is_list )
     {
-        chunk_size = source_size;
-        task_count = 1;
+        size = (uint32_t)PyList_Size(text_list);
     }
-
-    pEngine->source = (FeString*)malloc(source_size * sizeof(FeString));
-    if ( !pEngine->source )
+    else if ( getArray(text_list, 'I', sizeof(uint32_t), 1, "tuple", &index_array) == 0 )
     {
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-        return NULL;
+        size = index_array.size;
     }
-
-    TaskItem* tasks = (TaskItem*)malloc(task_count * sizeof(TaskItem));
-    if ( !tasks )
+    else
     {
-        free(pEngine->source);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        PyErr_Clear();
+        PyErr_SetString(PyExc_TypeError, "parameter `tuple` must be a tuple of weights and list.");
         return NULL;
     }
 
-    pEngine->results = (FeResult*)malloc(source_size * sizeof(FeResult));
-    if ( !pEngine->results )
+    uint32_t sorted_count = getSortedCount(py_weights, size);
+    weight_t* weights = NULL;
+    if ( sorted_count < size )
     {
-        free(pEngine->source);
-        free(tasks);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-        return NULL;
+        weights = (weight_t*)PyCapsule_GetPointer(py_weights, NULL);
     }
 
-    FeResult* results = pEngine->results;
-
-    if ( !pEngine->threads )
+    if ( !weights )
     {
-#if defined(_MSC_VER)
-        pEngine->threads = (HANDLE*)malloc(pEngine->cpu_count * sizeof(HANDLE));
-#else
-        pEngine->threads = (pthread_t*)malloc(pEngine->cpu_count * sizeof(pthread_t));
-#endif
-        if ( !pEngine->threads )
+        if ( !is_list )
         {
-            free(pEngine->source);
-            free(tasks);
-            free(results);
-            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-            return NULL;
+            releaseArray(&index_array);
         }
+        if ( PyErr_Occurred() )
+            return NULL;
 
-        uint32_t i = 0;
-        for ( ; i < pEngine->cpu_count; ++i)
-        {
-#if defined(_MSC_VER)
-            pEngine->threads[i] = CreateThread(NULL, 0, _worker, pEngine, 0, NULL);
-            if ( !pEngine->threads[i] )
-#else
-            int ret = pthread_create(&pEngine->threads[i], NULL, _worker, pEngine);
-            if ( ret != 0 )
-#endif
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                free(pEngine->threads);
-                fprintf(stderr, "pthread_create error!\n");
-                return NULL;
-            }
-        }
+        Py_RETURN_NONE;
     }
 
-#if defined(_MSC_VER)
-    QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-
-    uint32_t i = 0;
-    for ( ; i < task_count; ++i )
+    uint32_t count = size - sorted_count;
+    FeResult* results = (FeResult*)malloc(count * sizeof(FeResult));
+    /* the items, or the indices if text_list is an index array */
+    void* items = malloc(count * (is_list ? sizeof(PyObject*) : sizeof(uint32_t)));
+    if ( !results || !items )
     {
-        uint32_t offset = i * chunk_size;
-        uint32_t length = MIN(chunk_size, source_size - offset);
-
-        tasks[i].function = GET_WEIGHT;
-        tasks[i].offset = offset;
-        tasks[i].length = length;
-
-        uint32_t j = 0;
-        for ( ; j < length; ++j )
+        if ( !is_list )
         {
-            FeString *s = pEngine->source + offset + j;
-            PyObject* item = PyList_GET_ITEM(py_source, offset + j);
-            if ( pyObject_ToStringAndSize(item, &s->str, &s->len) < 0 )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                fprintf(stderr, "pyObject_ToStringAndSize error!\n");
-                return NULL;
-            }
+            releaseArray(&index_array);
         }
-
-        QUEUE_PUT(pEngine->task_queue, tasks + i);
+        free(results);
+        free(items);
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return PyErr_NoMemory();
     }
 
-    QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-    uint32_t results_count = 0;
-    for ( i = 0; i < source_size; ++i )
+    uint32_t* indices = is_list ? NULL : (uint32_t*)index_array.data + sorted_count;
+    uint32_t i = 0;
+    for ( ; i < count; ++i )
     {
-        if ( results[i].weight > MIN_WEIGHT )
+        results[i].weight = weights[sorted_count + i];
+        results[i].index = i;
+        if ( is_list )
         {
-            if ( i > results_count )
-            {
-                results[results_count] = results[i];
-            }
-            ++results_count;
+            /* borrowed reference, the items are only permuted */
+            ((PyObject**)items)[i] = PyList_GET_ITEM(text_list, sorted_count + i);
+        }
+        else
+        {
+            ((uint32_t*)items)[i] = indices[i];
         }
     }
 
-    if ( results_count == 0 )
-    {
-        free(pEngine->source);
-        free(tasks);
-        free(results);
-        return Py_BuildValue("([],[])");
-    }
+    Py_BEGIN_ALLOW_THREADS
+    qsort(results, count, sizeof(FeResult), compare);
+    Py_END_ALLOW_THREADS
 
-    if ( sort_results )
+    for ( i = 0; i < count; ++i )
     {
-        if ( task_count == 1 || results_count < 60000 )
+        weights[sorted_count + i] = results[i].weight;
+        if ( is_list )
         {
-            qsort(results, results_count, sizeof(FeResult), compare);
+            PyList_SET_ITEM(text_list, sorted_count + i, ((PyObject**)items)[results[i].index]);
         }
         else
         {
-            chunk_size = (results_count + task_count - 1) / task_count;
-            if ( chunk_size < 2000 )
-            {
-                chunk_size = (results_count + (task_count >> 1) - 1) / (task_count >> 1);
-            }
-            task_count = (results_count + chunk_size - 1) / chunk_size;
-            FeResult* buffer = (FeResult*)malloc(chunk_size * (task_count >> 1) * sizeof(FeResult));
-            if ( !buffer )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-                return NULL;
-            }
-#if defined(_MSC_VER)
-            QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-            for ( i = 0; i < task_count; ++i )
-            {
-                uint32_t offset = i * chunk_size;
-                uint32_t length = MIN(chunk_size, results_count - offset);
-
-                tasks[i].function = Q_SORT;
-                tasks[i].offset = offset;
-                tasks[i].length = length;
-                QUEUE_PUT(pEngine->task_queue, tasks + i);
-            }
-
-            QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-            MergeTaskItem* merge_tasks = NULL;
-            merge_tasks = (MergeTaskItem*)malloc(task_count * sizeof(MergeTaskItem));
-            if ( !merge_tasks )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                free(buffer);
-                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-                return NULL;
-            }
+            indices[i] = ((uint32_t*)items)[results[i].index];
+        }
+    }
 
-            while ( chunk_size < results_count )
-            {
-                uint32_t q = results_count / (chunk_size << 1);
-                uint32_t r = results_count % (chunk_size << 1);
-#if defined(_MSC_VER)
-                QUEUE_SET_TASK_COUNT(pEngine->task_queue, q + r/chunk_size);
-#endif
-                for ( i = 0; i < q; ++i )
-                {
-                    merge_tasks[i].function = MERGE;
-                    merge_tasks[i].offset_1 = i * (chunk_size << 1);
-                    merge_tasks[i].length_1 = chunk_size;
-                    merge_tasks[i].length_2 = chunk_size;
-                    merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
-                    QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
-                }
+    if ( !is_list )
+    {
+        releaseArray(&index_array);
+    }
+    free(results);
+    free(items);
 
-                if ( r > chunk_size )
-                {
-                    merge_tasks[i].function = MERGE;
-                    merge_tasks[i].offset_1 = i * (chunk_size << 1);
-                    merge_tasks[i].length_1 = chunk_size;
-                    merge_tasks[i].length_2 = r - chunk_size;
-                    merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
-                    QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
-                }
+    setSortedCount(py_weights, size, size);
 
-                QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+    Py_RETURN_NONE;
+}
 
-                chunk_size <<= 1;
-            }
+static void delAccumulator(PyObject* obj)
+{
+    FeAccumulator* pAccumulator = (FeAccumulator*)PyCapsule_GetPointer(obj, ACCUMULATOR_CAPSULE_NAME);
+    if ( !pAccumulator )
+        return;
 
-            free(buffer);
-            free(merge_tasks);
-        }
+    uint32_t i = 0;
+    for ( ; i < pAccumulator->run_count; ++i )
+    {
+        Py_DECREF(pAccumulator->runs[i].weights);
+        Py_DECREF(pAccumulator->runs[i].items);
     }
+    free(pAccumulator->runs);
+    Py_XDECREF(pAccumulator->source);
+    free(pAccumulator);
+}
 
-    weight_t* weights = (weight_t*)malloc(results_count * sizeof(weight_t));
-    if ( !weights )
+/**
+ * createAccumulator()
+ *
+ * return an accumulator, the results of fuzzyMatch() can be appended to it by appendAccumulator().
+ */
+static PyObject* fuzzyEngine_createAccumulator(PyObject* self, PyObject* args)
+{
+    FeAccumulator* pAccumulator = (FeAccumulator*)calloc(1, sizeof(FeAccumulator));
+    if ( !pAccumulator )
     {
-        free(pEngine->source);
-        free(tasks);
-        free(results);
         fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-        return NULL;
+        return PyErr_NoMemory();
     }
 
-    PyObject* text_list = PyList_New(results_count);
-    if ( task_count == 1 || results_count < 40000 )
+    return PyCapsule_New(pAccumulator, ACCUMULATOR_CAPSULE_NAME, delAccumulator);
+}
+
+/**
+ * replace the index array of `pRun` with a list of the corresponding items of pAccumulator->source.
+ */
+static int32_t getRunItems(FeAccumulator* pAccumulator, FeRun* pRun)
+{
+    if ( PyList_Check(pRun->items) )
+        return 0;
+
+    PyObject* source = pAccumulator->source;
+    if ( !source || !PyList_Check(source) )
     {
-        for ( i = 0; i < results_count; ++i )
-        {
-            weights[i] = results[i].weight;
-            /* PyList_SET_ITEM() steals a reference to item.     */
-            /* PySequence_ITEM() return value: New reference. */
-            PyList_SET_ITEM(text_list, i, PySequence_ITEM(py_source, results[i].index));
-        }
+        PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list.");
+        return -1;
     }
-    else
-    {
-        chunk_size = (results_count + task_count - 1) / task_count;
-        if ( chunk_size < 8000 )
-        {
-            chunk_size = (results_count + (task_count >> 1) - 1) / (task_count >> 1);
-        }
-        task_count = (results_count + chunk_size - 1) / chunk_size;
 
-        PySetTaskItem* py_set_tasks = NULL;
-        py_set_tasks = (PySetTaskItem*)malloc(task_count * sizeof(PySetTaskItem));
-        if ( !py_set_tasks )
-        {
-            free(pEngine->source);
-            free(tasks);
-            free(results);
-            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-            return NULL;
-        }
+    FeArray index_array;
+    if ( getArray(pRun->items, 'I', sizeof(uint32_t), 0, "result", &index_array) < 0 )
+        return -1;
 
-#if defined(_MSC_VER)
-        QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-        for ( i = 0; i < task_count; ++i )
+    const uint32_t* indices = (const uint32_t*)index_array.data;
+    uint32_t source_size = (uint32_t)PyList_GET_SIZE(source);
+    PyObject* items = PyList_New(index_array.size);
+    uint32_t i = 0;
+    for ( ; items && i < index_array.size; ++i )
+    {
+        if ( indices[i] >= source_size )
         {
-            uint32_t offset = i * chunk_size;
-            uint32_t length = MIN(chunk_size, results_count - offset);
-
-            py_set_tasks[i].function = PY_SET_ITEM;
-            py_set_tasks[i].offset = offset;
-            py_set_tasks[i].length = length;
-            py_set_tasks[i].weights = weights;
-            py_set_tasks[i].text_list = text_list;
-            py_set_tasks[i].py_source = py_source;
-            QUEUE_PUT(pEngine->task_queue, py_set_tasks + i);
+            Py_DECREF(items);
+            items = NULL;
+            PyErr_SetString(PyExc_IndexError, "the index is out of the range of `source`.");
+            break;
         }
-
-        QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-        free(py_set_tasks);
+        PyObject* item = PyList_GET_ITEM(source, indices[i]);
+        Py_INCREF(item);
+        /* PyList_SET_ITEM() steals a reference to item.     */
+        PyList_SET_ITEM(items, i, item);
     }
+    releaseArray(&index_array);
 
-    free(pEngine->source);
-    free(tasks);
-    free(results);
+    if ( !items )
+        return -1;
 
-    return Py_BuildValue("(NN)", createWeights(weights), text_list);
+    Py_DECREF(pRun->items);
+    pRun->items = items;
+
+    return 0;
 }
 
 /**
- * fuzzyMatchEx(engine, source, pattern, is_name_only=False, sort_results=True, is_and_mode=False)
- *
- * same as fuzzyMatch(), the only difference is the return value.
- * return a tuple, (a list of corresponding weight, a sorted list of index to items from `source` that match `pattern`).
+ * sort the part of the results of `pRun` that is not sorted yet, see sortRemainder().
  */
-static PyObject* fuzzyEngine_fuzzyMatchEx(PyObject* self, PyObject* args, PyObject* kwargs)
+static int32_t sortRun(FeRun* pRun)
 {
-    PyObject* py_engine = NULL;
-    PyObject* py_source = NULL;
-    PyObject* py_patternCtxt = NULL;
-    uint8_t is_name_only = 0;
-    uint8_t sort_results = 1;
-    uint8_t is_and_mode = 0;
-    static char* kwlist[] = {"engine", "source", "pattern", "is_name_only", "sort_results", "is_and_mode", NULL};
+    if ( getSortedCount(pRun->weights, pRun->size) >= pRun->size )
+        return 0;
 
-    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOO|bbb:fuzzyMatch", kwlist, &py_engine,
-                                      &py_source, &py_patternCtxt, &is_name_only, &sort_results, &is_and_mode) )
-        return NULL;
+    PyObject* args = Py_BuildValue("((OO))", pRun->weights, pRun->items);
+    PyObject* ret = args ? fuzzyEngine_sortRemainder(NULL, args) : NULL;
+    Py_XDECREF(args);
+    if ( !ret )
+        return -1;
 
-    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
-    if ( !pEngine )
-        return NULL;
+    Py_DECREF(ret);
 
-    if ( !PyList_Check(py_source) )
-    {
-        PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list.");
-        return NULL;
-    }
+    return 0;
+}
 
-    uint32_t source_size = (uint32_t)PyList_Size(py_source);
-    if ( source_size == 0 )
-    {
-        return Py_BuildValue("([],[])");
-    }
+/**
+ * merge the last two runs of pAccumulator into one, see merge().
+ */
+static int32_t mergeLastRuns(FeAccumulator* pAccumulator)
+{
+    FeRun* pRun_a = pAccumulator->runs + pAccumulator->run_count - 2;
+    FeRun* pRun_b = pRun_a + 1;
 
-    pEngine->pPattern_ctxt = (PatternContext*)PyCapsule_GetPointer(py_patternCtxt, NULL);
-    if ( !pEngine->pPattern_ctxt )
-        return NULL;
+    /* a run of items can not be merged with a run of indices */
+    if ( (PyList_Check(pRun_a->items) != 0) != (PyList_Check(pRun_b->items) != 0)
+         && (getRunItems(pAccumulator, pRun_a) < 0 || getRunItems(pAccumulator, pRun_b) < 0) )
+        return -1;
 
-    pEngine->is_name_only = is_name_only;
+    PyObject* args = Py_BuildValue("((OO)(OO))", pRun_a->weights, pRun_a->items, pRun_b->weights, pRun_b->items);
+    PyObject* merged = args ? fuzzyEngine_merge(NULL, args) : NULL;
+    Py_XDECREF(args);
+    if ( !merged )
+        return -1;
 
-    uint32_t max_task_count  = MAX_TASK_COUNT(pEngine->cpu_count);
-    uint32_t chunk_size = (source_size + max_task_count - 1) / max_task_count;
-    uint32_t task_count = (source_size + chunk_size - 1) / chunk_size;
-    if ( chunk_size == 1 || pEngine->cpu_count == 1 )
-    {
-        chunk_size = source_size;
-        task_count = 1;
-    }
+    Py_DECREF(pRun_a->weights);
+    Py_DECREF(pRun_a->items);
+    Py_DECREF(pRun_b->weights);
+    Py_DECREF(pRun_b->items);
+    pRun_a->weights = PyTuple_GET_ITEM(merged, 0);
+    pRun_a->items = PyTuple_GET_ITEM(merged, 1);
+    Py_INCREF(pRun_a->weights);
+    Py_INCREF(pRun_a->items);
+    pRun_a->size += pRun_b->size;
+    Py_DECREF(merged);
+    --pAccumulator->run_count;
 
-    pEngine->source = (FeString*)malloc(source_size * sizeof(FeString));
-    if ( !pEngine->source )
-    {
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-        return NULL;
-    }
+    return 0;
+}
 
-    TaskItem* tasks = (TaskItem*)malloc(task_count * sizeof(TaskItem));
-    if ( !tasks )
-    {
-        free(pEngine->source);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+/**
+ * appendAccumulator(accumulator, result, source=None)
+ *
+ * `result` is the return value of fuzzyMatch(), fuzzyMatchPart(), fuzzyMatchRefine() or merge(),
+ * `source` is the list of items that the indices refer to if `result` is returned with `return_array`.
+ * the results are kept as sorted runs, the last two runs are merged as long as the last one is at least
+ * half as large as the one before it, so that a result is merged only O(log n) times
+ * instead of every time a result is appended, and there are only O(log n) runs.
+ *
+ * return the number of all the results appended.
+ */
+static PyObject* fuzzyEngine_appendAccumulator(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    PyObject* py_accumulator = NULL;
+    PyObject* py_weights = NULL;
+    PyObject* py_items = NULL;
+    PyObject* py_source = NULL;
+    static char* kwlist[] = {"accumulator", "result", "source", NULL};
+
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "O(OO)|O:appendAccumulator", kwlist, &py_accumulator,
+                                      &py_weights, &py_items, &py_source) )
         return NULL;
-    }
 
-    pEngine->results = (FeResult*)malloc(source_size * sizeof(FeResult));
-    if ( !pEngine->results )
-    {
-        free(pEngine->source);
-        free(tasks);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+    FeAccumulator* pAccumulator = (FeAccumulator*)PyCapsule_GetPointer(py_accumulator, ACCUMULATOR_CAPSULE_NAME);
+    if ( !pAccumulator )
         return NULL;
+
+    if ( py_source && py_source != Py_None )
+    {
+        /* the items of `source` that the previous indices refer to must not be changed */
+        Py_INCREF(py_source);
+        Py_XDECREF(pAccumulator->source);
+        pAccumulator->source = py_source;
     }
 
-    FeResult* results = pEngine->results;
+    Py_ssize_t size = PyObject_Length(py_items);
+    if ( size < 0 )
+        return NULL;
 
-    if ( !pEngine->threads )
+    if ( size > 0 )
     {
-#if defined(_MSC_VER)
-        pEngine->threads = (HANDLE*)malloc(pEngine->cpu_count * sizeof(HANDLE));
-#else
-        pEngine->threads = (pthread_t*)malloc(pEngine->cpu_count * sizeof(pthread_t));
-#endif
-        if ( !pEngine->threads )
+        if ( pAccumulator->run_count == pAccumulator->run_capacity )
         {
-            free(pEngine->source);
-            free(tasks);
-            free(results);
-            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-            return NULL;
-        }
-
-        uint32_t i = 0;
-        for ( ; i < pEngine->cpu_count; ++i)
-        {
-#if defined(_MSC_VER)
-            pEngine->threads[i] = CreateThread(NULL, 0, _worker, pEngine, 0, NULL);
-            if ( !pEngine->threads[i] )
-#else
-            int ret = pthread_create(&pEngine->threads[i], NULL, _worker, pEngine);
-            if ( ret != 0 )
-#endif
+            uint32_t capacity = pAccumulator->run_capacity == 0 ? 8 : pAccumulator->run_capacity << 1;
+            FeRun* runs = (FeRun*)realloc(pAccumulator->runs, capacity * sizeof(FeRun));
+            if ( !runs )
             {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                free(pEngine->threads);
-                fprintf(stderr, "pthread_create error!\n");
-                return NULL;
+                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+                return PyErr_NoMemory();
             }
+            pAccumulator->runs = runs;
+            pAccumulator->run_capacity = capacity;
         }
-    }
-
-#if defined(_MSC_VER)
-    QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-
-    uint32_t i = 0;
-    for ( ; i < task_count; ++i )
-    {
-        uint32_t offset = i * chunk_size;
-        uint32_t length = MIN(chunk_size, source_size - offset);
-
-        tasks[i].function = GET_WEIGHT;
-        tasks[i].offset = offset;
-        tasks[i].length = length;
 
-        uint32_t j = 0;
-        for ( ; j < length; ++j )
+        FeRun* pRun = pAccumulator->runs + pAccumulator->run_count;
+        Py_INCREF(py_weights);
+        Py_INCREF(py_items);
+        pRun->weights = py_weights;
+        pRun->items = py_items;
+        pRun->size = (uint32_t)size;
+        ++pAccumulator->run_count;
+        pAccumulator->size += (uint32_t)size;
+
+        while ( pAccumulator->run_count > 1
+                && pAccumulator->runs[pAccumulator->run_count - 2].size
+                   < 2 * pAccumulator->runs[pAccumulator->run_count - 1].size )
         {
-            FeString *s = pEngine->source + offset + j;
-            PyObject* item = PyList_GET_ITEM(py_source, offset + j);
-            if ( pyObject_ToStringAndSize(item, &s->str, &s->len) < 0 )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                fprintf(stderr, "pyObject_ToStringAndSize error!\n");
+            if ( mergeLastRuns(pAccumulator) < 0 )
                 return NULL;
-            }
         }
-
-        QUEUE_PUT(pEngine->task_queue, tasks + i);
     }
 
-    QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+    return Py_BuildValue("I", pAccumulator->size);
+}
 
-    uint32_t results_count = 0;
-    for ( i = 0; i < source_size; ++i )
+/**
+ * getTopResults(accumulator, n)
+ *
+ * return a list of the best `n` items of all the results appended, sorted by the weights,
+ * only the best items of each run are merged.
+ */
+static PyObject* fuzzyEngine_getTopResults(PyObject* self, PyObject* args)
+{
+    PyObject* py_accumulator = NULL;
+    uint32_t n = 0;
+    if ( !PyArg_ParseTuple(args, "OI:getTopResults", &py_accumulator, &n) )
+        return NULL;
+
+    FeAccumulator* pAccumulator = (FeAccumulator*)PyCapsule_GetPointer(py_accumulator, ACCUMULATOR_CAPSULE_NAME);
+    if ( !pAccumulator )
+        return NULL;
+
+    n = MIN(n, pAccumulator->size);
+    uint32_t run_count = pAccumulator->run_count;
+    uint32_t i = 0;
+    for ( ; i < run_count; ++i )
     {
-        if ( results[i].weight > MIN_WEIGHT )
-        {
-            if ( i > results_count )
-            {
-                results[results_count] = results[i];
-            }
-            ++results_count;
-        }
+        FeRun* pRun = pAccumulator->runs + i;
+        /* the best `n` items of each run must be sorted */
+        if ( getSortedCount(pRun->weights, pRun->size) < MIN(n, pRun->size) && sortRun(pRun) < 0 )
+            return NULL;
     }
 
-    if ( results_count == 0 )
+    /* the position of the next item, the weights and the index array of each run */
+    uint32_t* positions = (uint32_t*)calloc(run_count + 1, sizeof(uint32_t));
+    weight_t** weights = (weight_t**)calloc(run_count + 1, sizeof(weight_t*));
+    FeArray* index_arrays = (FeArray*)calloc(run_count + 1, sizeof(FeArray));
+    PyObject* items = PyList_New(n);
+    if ( !positions || !weights || !index_arrays || !items )
     {
-        free(pEngine->source);
-        free(tasks);
-        free(results);
-        return Py_BuildValue("([],[])");
+        free(positions);
+        free(weights);
+        free(index_arrays);
+        Py_XDECREF(items);
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return PyErr_Occurred() ? NULL : PyErr_NoMemory();
     }
 
-    if ( sort_results )
+    uint32_t array_count = 0;   /* index_arrays[0, array_count) have been got */
+    PyObject* source = pAccumulator->source;
+    int32_t ret = 0;
+    for ( i = 0; i < run_count; ++i, ++array_count )
     {
-        if ( task_count == 1 || results_count < 60000 )
+        FeRun* pRun = pAccumulator->runs + i;
+        weights[i] = (weight_t*)PyCapsule_GetPointer(pRun->weights, NULL);
+        if ( !weights[i] )
         {
-            qsort(results, results_count, sizeof(FeResult), compare);
+            ret = -1;
+            break;
         }
-        else
+
+        if ( !PyList_Check(pRun->items) )
         {
-            chunk_size = (results_count + task_count - 1) / task_count;
-            if ( chunk_size < 2000 )
-            {
-                chunk_size = (results_count + (task_count >> 1) - 1) / (task_count >> 1);
-            }
-            task_count = (results_count + chunk_size - 1) / chunk_size;
-            FeResult* buffer = (FeResult*)malloc(chunk_size * (task_count >> 1) * sizeof(FeResult));
-            if ( !buffer )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-                return NULL;
-            }
-#if defined(_MSC_VER)
-            QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-            for ( i = 0; i < task_count; ++i )
+            if ( !source || !PyList_Check(source) )
             {
-                uint32_t offset = i * chunk_size;
-                uint32_t length = MIN(chunk_size, results_count - offset);
-
-                tasks[i].function = Q_SORT;
-                tasks[i].offset = offset;
-                tasks[i].length = length;
-                QUEUE_PUT(pEngine->task_queue, tasks + i);
+                PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list.");
+                ret = -1;
+                break;
             }
-
-            QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-            MergeTaskItem* merge_tasks = NULL;
-            merge_tasks = (MergeTaskItem*)malloc(task_count * sizeof(MergeTaskItem));
-            if ( !merge_tasks )
+            if ( getArray(pRun->items, 'I', sizeof(uint32_t), 0, "result", index_arrays + i) < 0 )
             {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                free(buffer);
-                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-                return NULL;
+                ret = -1;
+                break;
             }
+        }
+    }
 
-            while ( chunk_size < results_count )
+    uint32_t k = 0;
+    for ( ; ret == 0 && k < n; ++k )
+    {
+        /* the runs are few, the best of their next items is simply looked for one by one */
+        FeRun* pBest = NULL;
+        uint32_t best = 0;
+        weight_t best_weight = 0;
+        for ( i = 0; i < run_count; ++i )
+        {
+            FeRun* pRun = pAccumulator->runs + i;
+            if ( positions[i] < pRun->size )
             {
-                uint32_t q = results_count / (chunk_size << 1);
-                uint32_t r = results_count % (chunk_size << 1);
-#if defined(_MSC_VER)
-                QUEUE_SET_TASK_COUNT(pEngine->task_queue, q + r/chunk_size);
-#endif
-                for ( i = 0; i < q; ++i )
-                {
-                    merge_tasks[i].function = MERGE;
-                    merge_tasks[i].offset_1 = i * (chunk_size << 1);
-                    merge_tasks[i].length_1 = chunk_size;
-                    merge_tasks[i].length_2 = chunk_size;
-                    merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
-                    QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
-                }
-
-                if ( r > chunk_size )
+                weight_t weight = weights[i][positions[i]];
+                /* the later result comes first if the weights are equal, the same as merge() */
+                if ( !pBest || weight >= best_weight )
                 {
-                    merge_tasks[i].function = MERGE;
-                    merge_tasks[i].offset_1 = i * (chunk_size << 1);
-                    merge_tasks[i].length_1 = chunk_size;
-                    merge_tasks[i].length_2 = r - chunk_size;
-                    merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
-                    QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
+                    pBest = pRun;
+                    best = i;
+                    best_weight = weight;
                 }
-
-                QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-                chunk_size <<= 1;
             }
-
-            free(buffer);
-            free(merge_tasks);
         }
-    }
 
-    if ( is_and_mode )
-    {
-        PyObject* weight_list = PyList_New(results_count);
-        PyObject* index_list = PyList_New(results_count);
-        for ( i = 0; i < results_count; ++i )
+        PyObject* item = NULL;
+        if ( PyList_Check(pBest->items) )
         {
-            /* PyList_SET_ITEM() steals a reference to item.     */
-            PyList_SET_ITEM(weight_list, i, Py_BuildValue("f", results[i].weight));
-            PyList_SET_ITEM(index_list, i, Py_BuildValue("I", results[i].index));
+            item = PyList_GET_ITEM(pBest->items, positions[best]);
         }
-
-        free(pEngine->source);
-        free(tasks);
-        free(results);
-
-        return Py_BuildValue("(NN)", weight_list, index_list);
-    }
-    else
-    {
-        weight_t* weights = (weight_t*)malloc(results_count * sizeof(weight_t));
-        if ( !weights )
+        else
         {
-            free(pEngine->source);
-            free(tasks);
-            free(results);
-            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-            return NULL;
+            uint32_t index = ((const uint32_t*)index_arrays[best].data)[positions[best]];
+            if ( index >= (uint32_t)PyList_GET_SIZE(source) )
+            {
+                PyErr_SetString(PyExc_IndexError, "the index is out of the range of `source`.");
+                ret = -1;
+                break;
+            }
+            item = PyList_GET_ITEM(source, index);
         }
+        Py_INCREF(item);
+        /* PyList_SET_ITEM() steals a reference to item.     */
+        PyList_SET_ITEM(items, k, item);
+        ++positions[best];
+    }
 
-        PyObject* index_list = PyList_New(results_count);
-        for ( i = 0; i < results_count; ++i )
+    for ( i = 0; i < array_count; ++i )
+    {
+        if ( !PyList_Check(pAccumulator->runs[i].items) )
         {
-            weights[i] = results[i].weight;
-            /* PyList_SET_ITEM() steals a reference to item.     */
-            /* PySequence_ITEM() return value: New reference. */
-            PyList_SET_ITEM(index_list, i, Py_BuildValue("I", results[i].index));
+            releaseArray(index_arrays + i);
         }
+    }
+    free(positions);
+    free(weights);
+    free(index_arrays);
 
-        free(pEngine->source);
-        free(tasks);
-        free(results);
-
-        return Py_BuildValue("(NN)", createWeights(weights), index_list);
+    if ( ret < 0 )
+    {
+        Py_DECREF(items);
+        return NULL;
     }
+
+    return items;
 }
 
 /**
- * merge(tuple_a, tuple_b)
- * tuple_a, tuple_b are the return value of fuzzyEngine_fuzzyMatch
+ * getAllResults(accumulator)
+ *
+ * return a list of all the items of the results appended, sorted by the weights.
+ * all the runs are merged into one, so it is cheap to call it again if nothing is appended.
+ * the results matched with `two_phase` are only in the exact order as far as sortRemainder() is.
  */
-static PyObject* fuzzyEngine_merge(PyObject* self, PyObject* args)
+static PyObject* fuzzyEngine_getAllResults(PyObject* self, PyObject* args)
 {
-    PyObject* weight_list_a = NULL;
-    PyObject* text_list_a = NULL;
-    PyObject* weight_list_b = NULL;
-    PyObject* text_list_b = NULL;
-    if ( !PyArg_ParseTuple(args, "(OO)(OO):merge", &weight_list_a, &text_list_a,  &weight_list_b, &text_list_b) )
+    PyObject* py_accumulator = NULL;
+    if ( !PyArg_ParseTuple(args, "O:getAllResults", &py_accumulator) )
         return NULL;
 
-    uint32_t size_a = (uint32_t)PyList_Size(text_list_a);
-    if ( size_a == 0 )
-    {
-        return Py_BuildValue("(OO)", weight_list_b, text_list_b);
-    }
-    uint32_t size_b = (uint32_t)PyList_Size(text_list_b);
-    if ( size_b == 0 )
+    FeAccumulator* pAccumulator = (FeAccumulator*)PyCapsule_GetPointer(py_accumulator, ACCUMULATOR_CAPSULE_NAME);
+    if ( !pAccumulator )
+        return NULL;
+
+    if ( pAccumulator->run_count == 0 )
     {
-        return Py_BuildValue("(OO)", weight_list_a, text_list_a);
+        return PyList_New(0);
     }
 
-    weight_t* weights = (weight_t*)malloc((size_a + size_b) * sizeof(weight_t));
-    if ( !weights )
+    while ( pAccumulator->run_count > 1 )
     {
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-        return NULL;
+        if ( mergeLastRuns(pAccumulator) < 0 )
+            return NULL;
     }
 
-    PyObject* text_list = PyList_New(size_a + size_b);
-
-    uint32_t i = 0;
-    uint32_t j = 0;
+    FeRun* pRun = pAccumulator->runs;
+    if ( sortRun(pRun) < 0 || getRunItems(pAccumulator, pRun) < 0 )
+        return NULL;
 
-    weight_t* weights_a = (weight_t*)PyCapsule_GetPointer(weight_list_a, NULL);
-    weight_t w_a = weights_a[i];
-    weight_t* weights_b = (weight_t*)PyCapsule_GetPointer(weight_list_b, NULL);
-    weight_t w_b = weights_b[j];
-    while ( i < size_a && j < size_b )
-    {
-        if ( w_a > w_b )
-        {
-            weights[i + j] = weights_a[i];
-            PyList_SET_ITEM(text_list, i + j, PySequence_ITEM(text_list_a, i));
-            ++i;
-            if ( i < size_a )
-            {
-                w_a = weights_a[i];
-            }
-        }
-        else
-        {
-            weights[i + j] = weights_b[j];
-            PyList_SET_ITEM(text_list, i + j, PySequence_ITEM(text_list_b, j));
-            ++j;
-            if ( j < size_b )
-            {
-                w_b = weights_b[j];
-            }
-        }
-    }
-    while ( i < size_a )
-    {
-        weights[i + j] = weights_a[i];
-        PyList_SET_ITEM(text_list, i + j, PySequence_ITEM(text_list_a, i));
-        ++i;
-    }
-    while ( j < size_b )
-    {
-        weights[i + j] = weights_b[j];
-        PyList_SET_ITEM(text_list, i + j, PySequence_ITEM(text_list_b, j));
-        ++j;
-    }
-    return Py_BuildValue("(NN)", createWeights(weights), text_list);
+    /* a copy, because the list returned may be modified */
+    return PyList_GetSlice(pRun->items, 0, pRun->size);
 }
+
 /**
  * getHighlights(engine, source, pattern, is_name_only=False)
  *
@@ -1408,7 +4424,7 @@ static PyObject* fuzzyEngine_merge(PyObject* self, PyObject* args)
  *  NOTE: this function must be called after fuzzyMatch() is called, because this function assume that all the
  *  texts in `source` match `pattern` and all the threads in FuzzyEngine have already been started.
  */
-static PyObject* fuzzyEngine_getHighlights(PyObject* self, PyObject* args, PyObject* kwargs)
+static PyObject* fuzzyEngine_getHighlights_(PyObject* self, PyObject* args, PyObject* kwargs)
 {
     PyObject* py_source = NULL;
     PyObject* py_patternCtxt = NULL;
@@ -1437,68 +4453,62 @@ static PyObject* fuzzyEngine_getHighlights(PyObject* self, PyObject* args, PyObj
     pEngine->is_name_only = is_name_only;
 
     uint32_t source_size = (uint32_t)PyList_Size(py_source);
+    if ( source_size == 0 )
+    {
+        return PyList_New(0);
+    }
 
     uint32_t max_task_count  = MAX_TASK_COUNT(pEngine->cpu_count);
     uint32_t chunk_size = (source_size + max_task_count - 1) / max_task_count;
     uint32_t task_count = (source_size + chunk_size - 1) / chunk_size;
 
-    pEngine->source = (FeString*)malloc(source_size * sizeof(FeString));
-    if ( !pEngine->source )
-    {
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+    /* the workers may have been released by releaseWorkers() */
+    if ( startWorkers(pEngine) < 0 )
         return NULL;
-    }
 
-    TaskItem* tasks = (TaskItem*)malloc(task_count * sizeof(TaskItem));
-    if ( !tasks )
+    startPhases(pEngine);
+    pEngine->source = (FeString*)reserveArena(pEngine->arenas + ARENA_SOURCE, source_size * sizeof(FeString));
+    TaskItem* tasks = (TaskItem*)reserveArena(pEngine->arenas + ARENA_TASKS, task_count * sizeof(TaskItem));
+    pEngine->highlights = (HighlightGroup**)reserveArena(pEngine->arenas + ARENA_RESULTS,
+                                                         source_size * sizeof(HighlightGroup*));
+    if ( !pEngine->source || !tasks || !pEngine->highlights )
     {
-        free(pEngine->source);
+        releaseBuffers(pEngine);
         fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
         return NULL;
     }
 
-    pEngine->highlights = (HighlightGroup**)malloc(source_size * sizeof(HighlightGroup*));
-    if ( !pEngine->highlights )
+    /* all the items are converted before any task is put, so that no task is running if an error occurs */
+    uint32_t i = 0;
+    for ( ; i < source_size; ++i )
     {
-        free(pEngine->source);
-        free(tasks);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-        return NULL;
+        FeString *s = pEngine->source + i;
+        PyObject* item = PyList_GET_ITEM(py_source, i);
+        if ( pyObject_ToStringAndSize(item, &s->str, &s->len) < 0 )
+        {
+            releaseBuffers(pEngine);
+            fprintf(stderr, "pyObject_ToStringAndSize error!\n");
+            return NULL;
+        }
     }
+    endPhase(pEngine, PHASE_PREPARE);
 
 #if defined(_MSC_VER)
     QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
 #endif
 
-    uint32_t i = 0;
-    for ( ; i < task_count; ++i )
+    for ( i = 0; i < task_count; ++i )
     {
-        uint32_t offset = i * chunk_size;
-        uint32_t length = MIN(chunk_size, source_size - offset);
-
         tasks[i].function = GET_HIGHLIGHTS;
-        tasks[i].offset = offset;
-        tasks[i].length = length;
-
-        uint32_t j = 0;
-        for ( ; j < length; ++j )
-        {
-            FeString *s = pEngine->source + offset + j;
-            PyObject* item = PyList_GET_ITEM(py_source, offset + j);
-            if ( pyObject_ToStringAndSize(item, &s->str, &s->len) < 0 )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(pEngine->highlights);
-                fprintf(stderr, "pyObject_ToStringAndSize error!\n");
-                return NULL;
-            }
-        }
-
+        tasks[i].offset = i * chunk_size;
+        tasks[i].length = MIN(chunk_size, source_size - tasks[i].offset);
         QUEUE_PUT(pEngine->task_queue, tasks + i);
     }
 
+    Py_BEGIN_ALLOW_THREADS
     QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+    Py_END_ALLOW_THREADS
+    endPhase(pEngine, PHASE_MATCH);
 
     PyObject* res = PyList_New(source_size);
     for ( i = 0; i < source_size; ++i )
@@ -1506,366 +4516,133 @@ static PyObject* fuzzyEngine_getHighlights(PyObject* self, PyObject* args, PyObj
         HighlightGroup* pGroup = pEngine->highlights[i];
         if ( !pGroup )
         {
-            free(pEngine->source);
-            free(tasks);
-            free(pEngine->highlights);
+            for ( ; i < source_size; ++i )
+            {
+                free(pEngine->highlights[i]);
+            }
+            releaseBuffers(pEngine);
             Py_XDECREF(res);
             return NULL;
         }
 
         PyObject* list = PyList_New(pGroup->end_index);
-        uint16_t j;
+        uint32_t j;
         for ( j = 0; j < pGroup->end_index; ++j )
         {
-            PyList_SetItem(list, j, Py_BuildValue("[H,H]", pGroup->positions[j].col, pGroup->positions[j].len));
+            PyList_SetItem(list, j, Py_BuildValue("[I,I]", pGroup->positions[j].col, pGroup->positions[j].len));
         }
         PyList_SetItem(res, i, list);
         free(pGroup);
     }
 
-    free(pEngine->source);
-    free(tasks);
-    free(pEngine->highlights);
+    releaseBuffers(pEngine);
 
     return res;
 }
 
 /**
- * guessMatch(engine, source, filename, suffix, dirname, icon, sort_results=True)
+ * guessMatch(engine, source, filename, suffix, dirname, icon, sort_results=True, begin=0, end=0xFFFFFFFF, return_array=False)
  *
  * e.g., /usr/src/example.tar.gz
  * `filename` is "example.tar"
  * `suffix` is ".gz"
  * `dirname` is "/usr/src"
+ * `source` is a list or a corpus created by createCorpus().
+ * `return_array` is optional, the same as that of fuzzyMatch().
  *
- * return a tuple, (a list of corresponding weight, a sorted list of items from `source` that match `pattern`).
+ * return a tuple, (a list of corresponding weight, a sorted list of items from `source` that match `pattern`),
+ * or None if it is cancelled.
  */
-static PyObject* fuzzyEngine_guessMatch(PyObject* self, PyObject* args, PyObject* kwargs)
+static PyObject* fuzzyEngine_guessMatch_(PyObject* self, PyObject* args, PyObject* kwargs)
 {
     PyObject* py_engine = NULL;
     PyObject* py_source = NULL;
     const char* filename = NULL;
     const char* suffix = NULL;
     const char* dirname = NULL;
-    PyObject* py_icon = NULL;
-    uint8_t sort_results = 1;
-    static char* kwlist[] = {"engine", "source", "filename", "suffix", "dirname", "icon", "sort_results", NULL};
-
-    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOsssO|b:guessMatch", kwlist, &py_engine,
-                                      &py_source, &filename, &suffix, &dirname, &py_icon, &sort_results) )
-        return NULL;
-
-    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
-    if ( !pEngine )
-        return NULL;
-
-    if ( !PyList_Check(py_source) )
-    {
-        PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list.");
-        return NULL;
-    }
-
-    uint32_t source_size = (uint32_t)PyList_Size(py_source);
-    if ( source_size == 0 )
-    {
-        return Py_BuildValue("([],[])");
-    }
-
-    pEngine->filename = filename;
-    pEngine->suffix = suffix;
-    pEngine->dirname = dirname;
-
-    uint32_t max_task_count  = MAX_TASK_COUNT(pEngine->cpu_count);
-    uint32_t chunk_size = (source_size + max_task_count - 1) / max_task_count;
-    uint32_t task_count = (source_size + chunk_size - 1) / chunk_size;
-    if ( chunk_size == 1 || pEngine->cpu_count == 1 )
-    {
-        chunk_size = source_size;
-        task_count = 1;
-    }
-
-    pEngine->source = (FeString*)malloc(source_size * sizeof(FeString));
-    if ( !pEngine->source )
-    {
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+    PyObject* py_icon = NULL;
+    uint8_t sort_results = 1;
+    uint32_t begin = 0;
+    uint32_t end = 0xFFFFFFFF;
+    uint8_t return_array = 0;
+    static char* kwlist[] = {"engine", "source", "filename", "suffix", "dirname", "icon", "sort_results",
+                             "begin", "end", "return_array", NULL};
+
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOsssO|bIIb:guessMatch", kwlist, &py_engine, &py_source,
+                                      &filename, &suffix, &dirname, &py_icon, &sort_results, &begin, &end,
+                                      &return_array) )
         return NULL;
-    }
 
-    TaskItem* tasks = (TaskItem*)malloc(task_count * sizeof(TaskItem));
-    if ( !tasks )
-    {
-        free(pEngine->source);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
+    if ( !pEngine )
         return NULL;
-    }
 
-    pEngine->results = (FeResult*)malloc(source_size * sizeof(FeResult));
-    if ( !pEngine->results )
-    {
-        free(pEngine->source);
-        free(tasks);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+    FeSource source;
+    if ( parseSource(py_source, begin, end, &source) < 0 )
         return NULL;
-    }
-
-    FeResult* results = pEngine->results;
 
-    if ( !pEngine->threads )
+    if ( source.size == 0 )
     {
-#if defined(_MSC_VER)
-        pEngine->threads = (HANDLE*)malloc(pEngine->cpu_count * sizeof(HANDLE));
-#else
-        pEngine->threads = (pthread_t*)malloc(pEngine->cpu_count * sizeof(pthread_t));
-#endif
-        if ( !pEngine->threads )
-        {
-            free(pEngine->source);
-            free(tasks);
-            free(results);
-            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-            return NULL;
-        }
-
-        uint32_t i = 0;
-        for ( ; i < pEngine->cpu_count; ++i)
-        {
-#if defined(_MSC_VER)
-            pEngine->threads[i] = CreateThread(NULL, 0, _worker, pEngine, 0, NULL);
-            if ( !pEngine->threads[i] )
-#else
-            int ret = pthread_create(&pEngine->threads[i], NULL, _worker, pEngine);
-            if ( ret != 0 )
-#endif
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                free(pEngine->threads);
-                fprintf(stderr, "pthread_create error!\n");
-                return NULL;
-            }
-        }
+        return Py_BuildValue("([],[])");
     }
 
-#if defined(_MSC_VER)
-    QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
+    pEngine->filename = filename;
+    pEngine->suffix = suffix;
+    pEngine->dirname = dirname;
 
     char *icon_str = NULL;
     uint32_t icon_len = 0;
     if ( pyObject_ToStringAndSize(py_icon, &icon_str, &icon_len) < 0 )
     {
-        free(pEngine->source);
-        free(tasks);
-        free(results);
         fprintf(stderr, "pyObject_ToStringAndSize error!\n");
         return NULL;
     }
 
-    uint32_t i = 0;
-    for ( ; i < task_count; ++i )
-    {
-        uint32_t offset = i * chunk_size;
-        uint32_t length = MIN(chunk_size, source_size - offset);
-
-        tasks[i].function = GET_PATH_WEIGHT;
-        tasks[i].offset = offset;
-        tasks[i].length = length;
-
-        uint32_t j = 0;
-        for ( ; j < length; ++j )
-        {
-            FeString *s = pEngine->source + offset + j;
-            PyObject* item = PyList_GET_ITEM(py_source, offset + j);
-            if ( pyObject_ToStringAndSize(item, &s->str, &s->len) < 0 )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                fprintf(stderr, "pyObject_ToStringAndSize error!\n");
-                return NULL;
-            }
+    pEngine->skip_len = icon_len;
 
-            if ( icon_len > 0 )
-            {
-                s->str += icon_len;
-                s->len -= icon_len;
-            }
-        }
+    TaskItem* tasks = NULL;
+    uint32_t task_count = 0;
+    int64_t source_size = computeWeights(pEngine, &source, GET_PATH_WEIGHT, NO_CATEGORY, NULL, &tasks, &task_count);
+    pEngine->skip_len = 0;
+    if ( source_size < 0 )
+    {
+        releaseBuffers(pEngine);
+        if ( source_size == CANCELLED )
+            Py_RETURN_NONE;
 
-        QUEUE_PUT(pEngine->task_queue, tasks + i);
+        return NULL;
     }
 
-    QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-    if ( sort_results )
+    if ( sort_results && sortResults(pEngine, tasks, task_count, (uint32_t)source_size, Q_SORT_2, 0) < 0 )
     {
-        if ( task_count == 1 || source_size < 60000 )
-        {
-            qsort(results, source_size, sizeof(FeResult), compare2);
-        }
-        else
-        {
-            chunk_size = (source_size + task_count - 1) / task_count;
-            if ( chunk_size < 2000 )
-            {
-                chunk_size = (source_size + (task_count >> 1) - 1) / (task_count >> 1);
-            }
-            task_count = (source_size + chunk_size - 1) / chunk_size;
-            FeResult* buffer = (FeResult*)malloc(chunk_size * (task_count >> 1) * sizeof(FeResult));
-            if ( !buffer )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-                return NULL;
-            }
-#if defined(_MSC_VER)
-            QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-            for ( i = 0; i < task_count; ++i )
-            {
-                uint32_t offset = i * chunk_size;
-                uint32_t length = MIN(chunk_size, source_size - offset);
-
-                tasks[i].function = Q_SORT_2;
-                tasks[i].offset = offset;
-                tasks[i].length = length;
-                QUEUE_PUT(pEngine->task_queue, tasks + i);
-            }
-
-            QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-            MergeTaskItem* merge_tasks = NULL;
-            merge_tasks = (MergeTaskItem*)malloc(task_count * sizeof(MergeTaskItem));
-            if ( !merge_tasks )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                free(buffer);
-                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-                return NULL;
-            }
-
-            while ( chunk_size < source_size )
-            {
-                uint32_t q = source_size / (chunk_size << 1);
-                uint32_t r = source_size % (chunk_size << 1);
-#if defined(_MSC_VER)
-                QUEUE_SET_TASK_COUNT(pEngine->task_queue, q + r/chunk_size);
-#endif
-                for ( i = 0; i < q; ++i )
-                {
-                    merge_tasks[i].function = MERGE_2;
-                    merge_tasks[i].offset_1 = i * (chunk_size << 1);
-                    merge_tasks[i].length_1 = chunk_size;
-                    merge_tasks[i].length_2 = chunk_size;
-                    merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
-                    QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
-                }
-
-                if ( r > chunk_size )
-                {
-                    merge_tasks[i].function = MERGE_2;
-                    merge_tasks[i].offset_1 = i * (chunk_size << 1);
-                    merge_tasks[i].length_1 = chunk_size;
-                    merge_tasks[i].length_2 = r - chunk_size;
-                    merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
-                    QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
-                }
-
-                QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-                chunk_size <<= 1;
-            }
-
-            free(buffer);
-            free(merge_tasks);
-        }
+        releaseBuffers(pEngine);
+        return NULL;
     }
 
-    uint32_t* path_weights = (uint32_t*)malloc(source_size * sizeof(uint32_t));
+    uint32_t* path_weights = (uint32_t*)malloc((size_t)source_size * sizeof(uint32_t));
     if ( !path_weights )
     {
-        free(pEngine->source);
-        free(tasks);
-        free(results);
+        releaseBuffers(pEngine);
         fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
         return NULL;
     }
 
-    PyObject* text_list = PyList_New(source_size);
-    if ( task_count == 1 || source_size < 40000 )
-    {
-        for ( i = 0; i < source_size; ++i )
-        {
-            path_weights[i] = results[i].path_weight;
-            /* PyList_SET_ITEM() steals a reference to item.     */
-            /* PySequence_ITEM() return value: New reference. */
-            PyList_SET_ITEM(text_list, i, PySequence_ITEM(py_source, results[i].index));
-        }
-    }
+    PyObject* text_list = NULL;
+    if ( return_array )
+        text_list = buildIndexArray(pEngine, (uint32_t)source_size, path_weights, PY_SET_ITEM_2);
     else
+        text_list = buildTextList(pEngine, source.py_source, task_count, (uint32_t)source_size,
+                                  path_weights, PY_SET_ITEM_2);
+    releaseBuffers(pEngine);
+    if ( !text_list )
     {
-        chunk_size = (source_size + task_count - 1) / task_count;
-        if ( chunk_size < 8000 )
-        {
-            chunk_size = (source_size + (task_count >> 1) - 1) / (task_count >> 1);
-        }
-        task_count = (source_size + chunk_size - 1) / chunk_size;
-
-        PySetTaskItem* py_set_tasks = NULL;
-        py_set_tasks = (PySetTaskItem*)malloc(task_count * sizeof(PySetTaskItem));
-        if ( !py_set_tasks )
-        {
-            free(pEngine->source);
-            free(tasks);
-            free(results);
-            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-            return NULL;
-        }
-
-#if defined(_MSC_VER)
-        QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-        for ( i = 0; i < task_count; ++i )
-        {
-            uint32_t offset = i * chunk_size;
-            uint32_t length = MIN(chunk_size, source_size - offset);
-
-            py_set_tasks[i].function = PY_SET_ITEM_2;
-            py_set_tasks[i].offset = offset;
-            py_set_tasks[i].length = length;
-            py_set_tasks[i].path_weights = path_weights;
-            py_set_tasks[i].text_list = text_list;
-            py_set_tasks[i].py_source = py_source;
-            QUEUE_PUT(pEngine->task_queue, py_set_tasks + i);
-        }
-
-        QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-        free(py_set_tasks);
+        free(path_weights);
+        return NULL;
     }
 
-    free(pEngine->source);
-    free(tasks);
-    free(results);
-
     return Py_BuildValue("(NN)", createWeights(path_weights), text_list);
 }
 
-enum
-{
-    Category_Rg = 0,
-    Category_Tag,
-    Category_File,
-    Category_Gtags,
-    Category_Line,
-    Category_GitDiff,
-};
-
 typedef struct RgParameter
 {
     uint32_t display_multi;
@@ -1886,6 +4663,18 @@ typedef struct GtagsParameter
     uint32_t match_path;
 }GtagsParameter;
 
+#define MAX_DIGEST_SEPARATOR_LEN 16
+
+typedef struct DigestParameter
+{
+    uint32_t prefix_len;    /* number of the leading characters to skip */
+    char     separator[MAX_DIGEST_SEPARATOR_LEN];
+    uint32_t separator_len;
+    int32_t  occurrence;    /* which separator to split at, 1 is the first one, -1 is the last one */
+    uint32_t keep_before;   /* keep the text before the separator if it is not 0, otherwise the text after it */
+    uint32_t rstrip;        /* remove the trailing whitespace if it is not 0 */
+}DigestParameter;
+
 static void delParamObj(PyObject* obj)
 {
     free(PyCapsule_GetPointer(obj, NULL));
@@ -1938,6 +4727,56 @@ static PyObject* fuzzyEngine_createParameter(PyObject* self, PyObject* args)
     return PyCapsule_New(param, NULL, delParamObj);
 }
 
+/**
+ * createDigestParameter(prefix_len=0, separator="", occurrence=1, keep_before=True, rstrip=False)
+ *
+ * describe the digest of the lines for Category_Generic, e.g.,
+ * `line[2:].rsplit("\t", 1)[0]` is createDigestParameter(prefix_len=2, separator="\t", occurrence=-1),
+ * `line.split(":", 3)[3]` is createDigestParameter(separator=":", occurrence=3, keep_before=False).
+ *
+ * `prefix_len` is the number of the leading characters of a line to skip.
+ * `separator` is the string to split the rest of the line at, the line is not split if it is empty.
+ * `occurrence` specifies which `separator` to split at, 1 is the first one, 2 is the second one,
+ *      -1 is the last one, and so on. the line is not split if there is no such `separator`.
+ * `keep_before` specifies whether the digest is the text before `separator` or the text after it.
+ * `rstrip` specifies whether to remove the trailing whitespace of the digest.
+ */
+static PyObject* fuzzyEngine_createDigestParameter(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    uint32_t prefix_len = 0;
+    const char* separator = "";
+    Py_ssize_t separator_len = 0;
+    int32_t occurrence = 1;
+    uint8_t keep_before = 1;
+    uint8_t rstrip = 0;
+    static char* kwlist[] = {"prefix_len", "separator", "occurrence", "keep_before", "rstrip", NULL};
+
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "|Is#ibb:createDigestParameter", kwlist, &prefix_len,
+                                      &separator, &separator_len, &occurrence, &keep_before, &rstrip) )
+        return NULL;
+
+    if ( separator_len >= MAX_DIGEST_SEPARATOR_LEN )
+    {
+        PyErr_SetString(PyExc_ValueError, "`separator` is too long.");
+        return NULL;
+    }
+
+    DigestParameter* param = (DigestParameter*)calloc(1, sizeof(DigestParameter));
+    if ( !param )
+    {
+        return NULL;
+    }
+
+    param->prefix_len = prefix_len;
+    memcpy(param->separator, separator, separator_len);
+    param->separator_len = (uint32_t)separator_len;
+    param->occurrence = occurrence;
+    param->keep_before = keep_before;
+    param->rstrip = rstrip;
+
+    return PyCapsule_New(param, NULL, delParamObj);
+}
+
 /**
  * createGtagsParameter(mode, format, match_path)
  */
@@ -2131,38 +4970,236 @@ static void line_getDigest(char** str, uint32_t* length, Parameter* param)
     }
 }
 
-static void gitdiff_getDigest(char** str, uint32_t* length, Parameter* param)
+static void gitdiff_getDigest(char** str, uint32_t* length, Parameter* param)
+{
+    char* s = *str;
+    char *p = s + *length - 1;
+    if ( *p == ']' ) {
+        for ( ; p >= s; --p ) {
+            if ( *p == '\t' ) {
+                *length = (uint32_t)(p - s);
+                break;
+            }
+        }
+    }
+
+    if ( param->mode == 0 ) {
+        uint32_t len = 5;
+        *str += len;
+        *length -= len;
+    }
+    else {
+        file_getDigest(str, length, param);
+    }
+}
+
+static void generic_getDigest(char** str, uint32_t* length, DigestParameter* param)
+{
+    char* s = *str;
+    uint32_t len = *length;
+
+    /* the lengths of python 3 strings are counted in characters, the bytes are UTF-8 */
+#if PY_MAJOR_VERSION >= 3
+    uint32_t i = 0;
+    uint32_t n = 0;
+    for ( ; n < param->prefix_len && i < len; ++n )
+    {
+        ++i;
+        while ( i < len && ((uint8_t)s[i] & 0xC0) == 0x80 )
+        {
+            ++i;
+        }
+    }
+#else
+    uint32_t i = MIN(param->prefix_len, len);
+#endif
+    s += i;
+    len -= i;
+
+    uint32_t sep_len = param->separator_len;
+    if ( sep_len > 0 && param->occurrence != 0 && len >= sep_len )
+    {
+        char* p = NULL;
+        int32_t count = 0;
+        if ( param->occurrence > 0 )
+        {
+            char* q = s;
+            while ( q + sep_len <= s + len )
+            {
+                if ( memcmp(q, param->separator, sep_len) == 0 )
+                {
+                    if ( ++count == param->occurrence )
+                    {
+                        p = q;
+                        break;
+                    }
+                    q += sep_len;
+                }
+                else
+                {
+                    ++q;
+                }
+            }
+        }
+        else
+        {
+            int64_t j = (int64_t)len - sep_len;
+            while ( j >= 0 )
+            {
+                if ( memcmp(s + j, param->separator, sep_len) == 0 )
+                {
+                    if ( --count == param->occurrence )
+                    {
+                        p = s + j;
+                        break;
+                    }
+                    j -= sep_len;
+                }
+                else
+                {
+                    --j;
+                }
+            }
+        }
+
+        if ( p )
+        {
+            if ( param->keep_before )
+            {
+                len = (uint32_t)(p - s);
+            }
+            else
+            {
+                len -= (uint32_t)(p - s) + sep_len;
+                s = p + sep_len;
+            }
+        }
+    }
+
+    if ( param->rstrip )
+    {
+        while ( len > 0 && (s[len - 1] == ' ' || (s[len - 1] >= '\t' && s[len - 1] <= '\r')) )
+        {
+            --len;
+        }
+    }
+
+    *str = s;
+    *length = len;
+}
+
+static void getDigest(char** str, uint32_t* length, uint32_t category, void* param)
+{
+    switch ( category )
+    {
+    case Category_Rg:
+        rg_getDigest(str, length, (RgParameter*)param);
+        break;
+    case Category_Tag:
+        tag_getDigest(str, length, (Parameter*)param);
+        break;
+    case Category_File:
+        file_getDigest(str, length, (Parameter*)param);
+        break;
+    case Category_Gtags:
+        gtags_getDigest(str, length, (GtagsParameter*)param);
+        break;
+    case Category_Line:
+        line_getDigest(str, length, (Parameter*)param);
+        break;
+    case Category_GitDiff:
+        gitdiff_getDigest(str, length, (Parameter*)param);
+        break;
+    case Category_Generic:
+        generic_getDigest(str, length, (DigestParameter*)param);
+        break;
+    }
+}
+
+static void getDigestKey(uint32_t category, void* param, FeDigestKey* pKey)
 {
-    char* s = *str;
-    char *p = s + *length - 1;
-    if ( *p == ']' ) {
-        for ( ; p >= s; --p ) {
-            if ( *p == '\t' ) {
-                *length = (uint32_t)(p - s);
-                break;
-            }
-        }
+    memset(pKey, 0, sizeof(FeDigestKey));
+    pKey->category = category;
+    switch ( category )
+    {
+    case Category_Rg:
+        pKey->values[0] = ((RgParameter*)param)->display_multi;
+        pKey->values[1] = ((RgParameter*)param)->has_column;
+        pKey->separator_len = ((RgParameter*)param)->separator_len;
+        memcpy(pKey->separator, ((RgParameter*)param)->separator,
+               MIN(pKey->separator_len, sizeof(pKey->separator)));
+        break;
+    case Category_Gtags:
+        pKey->values[0] = ((GtagsParameter*)param)->mode;
+        pKey->values[1] = ((GtagsParameter*)param)->format;
+        pKey->values[2] = ((GtagsParameter*)param)->match_path;
+        break;
+    case Category_GitDiff:
+        pKey->values[0] = ((Parameter*)param)->mode;
+        break;
+    case Category_Generic:
+        pKey->values[0] = ((DigestParameter*)param)->prefix_len;
+        pKey->values[1] = (uint32_t)((DigestParameter*)param)->occurrence;
+        pKey->values[2] = ((DigestParameter*)param)->keep_before | (((DigestParameter*)param)->rstrip << 1);
+        pKey->separator_len = ((DigestParameter*)param)->separator_len;
+        memcpy(pKey->separator, ((DigestParameter*)param)->separator, pKey->separator_len);
+        break;
     }
+}
 
-    if ( param->mode == 0 ) {
-        uint32_t len = 5;
-        *str += len;
-        *length -= len;
+/**
+ * compute the digests of the corpus items that have not been digested with the same category and parameter,
+ * so that the digests of a corpus are computed only once no matter how many times it is matched.
+ */
+static void prepareDigests(FeCorpus* pCorpus, uint32_t category, void* param)
+{
+    FeDigestKey key;
+    getDigestKey(category, param, &key);
+    /* a separator that is too long to be kept in the key never compares equal */
+    if ( key.separator_len > sizeof(key.separator)
+         || memcmp(&key, &pCorpus->digest_key, sizeof(FeDigestKey)) != 0 )
+    {
+        pCorpus->digest_count = 0;
+        pCorpus->digest_key = key;
     }
-    else {
-        file_getDigest(str, length, param);
+
+    uint32_t i = pCorpus->digest_count;
+    for ( ; i < pCorpus->size; ++i )
+    {
+        FeCorpusItem* pItem = pCorpus->items + i;
+        char* text = pCorpus->arena + pItem->offset;
+        if ( category == Category_File )
+        {
+            pItem->digest_offset = pItem->basename_offset;
+            pItem->digest_len = pItem->len - pItem->basename_offset;
+        }
+        else
+        {
+            char* str = text;
+            uint32_t len = pItem->len;
+            getDigest(&str, &len, category, param);
+            pItem->digest_offset = (uint32_t)(str - text);
+            pItem->digest_len = len;
+        }
     }
+
+    pCorpus->digest_count = pCorpus->size;
 }
 
 /**
- * fuzzyMatchPart(engine, source, pattern, category, param, is_name_only=False, sort_results=True)
+ * fuzzyMatchPart(engine, source, pattern, category, param, is_name_only=False, sort_results=True, begin=0, end=0xFFFFFFFF, top_k=0, bonus=None, return_array=False, highlight_count=0, highlights=None, min_results=0, two_phase=False)
  *
+ * `source` is a list or a corpus created by createCorpus().
  * `is_name_only` is optional, it defaults to `False`, which indicates using the full path matching algorithm.
  * `sort_results` is optional, it defaults to `True`, which indicates whether to sort the results.
+ * `begin` and `end` are optional, only the items of `source` in range [begin, end) are matched.
+ * `top_k`, `bonus`, `return_array`, `highlight_count`, `highlights`, `min_results` and `two_phase` are
+ *      optional, the same as those of fuzzyMatch(), the columns of the highlights are those of the items rather than the digests.
  *
- * return a tuple, (a list of corresponding weight, a sorted list of items from `source` that match `pattern`).
+ * return a tuple, (a list of corresponding weight, a sorted list of items from `source` that match `pattern`),
+ * or None if it is cancelled.
  */
-static PyObject* fuzzyEngine_fuzzyMatchPart(PyObject* self, PyObject* args, PyObject* kwargs)
+static PyObject* fuzzyEngine_fuzzyMatchPart_(PyObject* self, PyObject* args, PyObject* kwargs)
 {
     PyObject* py_engine = NULL;
     PyObject* py_source = NULL;
@@ -2171,26 +5208,52 @@ static PyObject* fuzzyEngine_fuzzyMatchPart(PyObject* self, PyObject* args, PyOb
     uint32_t category;
     uint8_t is_name_only = 0;
     uint8_t sort_results = 1;
-    static char* kwlist[] = {"engine", "source", "pattern", "category", "param", "is_name_only", "sort_results", NULL};
+    uint32_t begin = 0;
+    uint32_t end = 0xFFFFFFFF;
+    uint32_t top_k = 0;
+    PyObject* py_bonus = NULL;
+    uint8_t return_array = 0;
+    uint32_t highlight_count = 0;
+    PyObject* py_highlights = NULL;
+    uint32_t min_results = 0;
+    uint8_t two_phase = 0;
+    static char* kwlist[] = {"engine", "source", "pattern", "category", "param", "is_name_only", "sort_results",
+                             "begin", "end", "top_k", "bonus", "return_array", "highlight_count", "highlights",
+                             "min_results", "two_phase", NULL};
+
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOOIO|bbIIIObIOIb:fuzzyMatch", kwlist, &py_engine, &py_source,
+                                      &py_patternCtxt, &category, &py_param, &is_name_only, &sort_results,
+                                      &begin, &end, &top_k, &py_bonus, &return_array, &highlight_count,
+                                      &py_highlights, &min_results, &two_phase) )
+        return NULL;
 
-    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOOIO|bb:fuzzyMatch", kwlist, &py_engine, &py_source,
-                                      &py_patternCtxt, &category, &py_param, &is_name_only, &sort_results) )
+    if ( checkHighlights(&py_highlights) < 0 )
         return NULL;
 
     FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
     if ( !pEngine )
         return NULL;
 
-    if ( !PyList_Check(py_source) )
+    FeSource source;
+    if ( parseSource(py_source, begin, end, &source) < 0 )
+        return NULL;
+
+    if ( source.size == 0 )
     {
-        PyErr_SetString(PyExc_TypeError, "parameter `source` must be a list.");
+        return Py_BuildValue("([],[])");
+    }
+
+    if ( category > Category_Generic )
+    {
+        PyErr_SetString(PyExc_ValueError, "invalid `category`.");
         return NULL;
     }
 
-    uint32_t source_size = (uint32_t)PyList_Size(py_source);
-    if ( source_size == 0 )
+    void* param = PyCapsule_GetPointer(py_param, NULL);
+    if ( !param )
     {
-        return Py_BuildValue("([],[])");
+        fprintf(stderr, "PyCapsule_GetPointer error!\n");
+        return NULL;
     }
 
     pEngine->pPattern_ctxt = (PatternContext*)PyCapsule_GetPointer(py_patternCtxt, NULL);
@@ -2198,350 +5261,246 @@ static PyObject* fuzzyEngine_fuzzyMatchPart(PyObject* self, PyObject* args, PyOb
         return NULL;
 
     pEngine->is_name_only = is_name_only;
+    pEngine->skip_len = 0;
+    pEngine->typo_threshold = min_results;
 
-    uint32_t max_task_count  = MAX_TASK_COUNT(pEngine->cpu_count);
-    uint32_t chunk_size = (source_size + max_task_count - 1) / max_task_count;
-    uint32_t task_count = (source_size + chunk_size - 1) / chunk_size;
-    if ( chunk_size == 1 || pEngine->cpu_count == 1 )
-    {
-        chunk_size = source_size;
-        task_count = 1;
-    }
-
-    pEngine->source = (FeString*)malloc(source_size * sizeof(FeString));
-    if ( !pEngine->source )
-    {
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+    FeArray bonus;
+    if ( getBonus(pEngine, py_bonus, &bonus) < 0 )
         return NULL;
-    }
 
-    TaskItem* tasks = (TaskItem*)malloc(task_count * sizeof(TaskItem));
-    if ( !tasks )
+    TaskItem* tasks = NULL;
+    uint32_t task_count = 0;
+    uint32_t function = getWeightFunction(pEngine, two_phase && sort_results, top_k);
+    int64_t results_count = computeWeights(pEngine, &source, function, category, param, &tasks, &task_count);
+    pEngine->typo_threshold = 0;
+    releaseBonus(pEngine, &bonus);
+    if ( results_count <= 0 )
     {
-        free(pEngine->source);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-        return NULL;
+        releaseBuffers(pEngine);
+        if ( results_count == CANCELLED )
+            Py_RETURN_NONE;
+
+        return results_count == 0 ? Py_BuildValue("([],[])") : NULL;
     }
 
-    pEngine->results = (FeResult*)malloc(source_size * sizeof(FeResult));
-    if ( !pEngine->results )
+    int64_t sorted_count = results_count;
+    if ( function == GET_WEIGHT_BOUND )
     {
-        free(pEngine->source);
-        free(tasks);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-        return NULL;
+        /* the best results have been sorted by scoreBestResults() */
+        sorted_count = MIN(top_k, results_count);
     }
-
-    FeResult* results = pEngine->results;
-
-    if ( !pEngine->threads )
+    else if ( sort_results )
     {
-#if defined(_MSC_VER)
-        pEngine->threads = (HANDLE*)malloc(pEngine->cpu_count * sizeof(HANDLE));
-#else
-        pEngine->threads = (pthread_t*)malloc(pEngine->cpu_count * sizeof(pthread_t));
-#endif
-        if ( !pEngine->threads )
+        sorted_count = sortResults(pEngine, tasks, task_count, (uint32_t)results_count, Q_SORT, top_k);
+        if ( sorted_count < 0 )
         {
-            free(pEngine->source);
-            free(tasks);
-            free(results);
-            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+            releaseBuffers(pEngine);
             return NULL;
         }
-
-        uint32_t i = 0;
-        for ( ; i < pEngine->cpu_count; ++i)
-        {
-#if defined(_MSC_VER)
-            pEngine->threads[i] = CreateThread(NULL, 0, _worker, pEngine, 0, NULL);
-            if ( !pEngine->threads[i] )
-#else
-            int ret = pthread_create(&pEngine->threads[i], NULL, _worker, pEngine);
-            if ( ret != 0 )
-#endif
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                free(pEngine->threads);
-                fprintf(stderr, "pthread_create error!\n");
-                return NULL;
-            }
-        }
     }
 
-#if defined(_MSC_VER)
-    QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-
-    uint32_t i = 0;
-    for ( ; i < task_count; ++i )
+    if ( py_highlights && putHighlights(pEngine, source.py_source, (uint32_t)MIN(highlight_count, sorted_count),
+                                        py_highlights) < 0 )
     {
-        uint32_t offset = i * chunk_size;
-        uint32_t length = MIN(chunk_size, source_size - offset);
-
-        tasks[i].function = GET_WEIGHT;
-        tasks[i].offset = offset;
-        tasks[i].length = length;
-
-        uint32_t j = 0;
-        for ( ; j < length; ++j )
-        {
-            FeString *s = pEngine->source + offset + j;
-            PyObject* item = PyList_GET_ITEM(py_source, offset + j);
-            if ( pyObject_ToStringAndSize(item, &s->str, &s->len) < 0 )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                fprintf(stderr, "pyObject_ToStringAndSize error!\n");
-                return NULL;
-            }
-
-            switch ( category )
-            {
-            case Category_Rg:
-            {
-                RgParameter* param = (RgParameter*)PyCapsule_GetPointer(py_param, NULL);
-                if ( !param )
-                {
-                    free(pEngine->source);
-                    free(tasks);
-                    free(results);
-                    fprintf(stderr, "PyCapsule_GetPointer error!\n");
-                    return NULL;
-                }
-                rg_getDigest(&s->str, &s->len, param);
-                break;
-            }
-            case Category_Tag:
-                tag_getDigest(&s->str, &s->len, (Parameter*)PyCapsule_GetPointer(py_param, NULL));
-                break;
-            case Category_File:
-                file_getDigest(&s->str, &s->len, (Parameter*)PyCapsule_GetPointer(py_param, NULL));
-                break;
-            case Category_Gtags:
-            {
-                GtagsParameter* param = (GtagsParameter*)PyCapsule_GetPointer(py_param, NULL);
-                if ( !param )
-                {
-                    free(pEngine->source);
-                    free(tasks);
-                    free(results);
-                    fprintf(stderr, "PyCapsule_GetPointer error!\n");
-                    return NULL;
-                }
-                gtags_getDigest(&s->str, &s->len, param);
-                break;
-            }
-            case Category_Line:
-                line_getDigest(&s->str, &s->len, (Parameter*)PyCapsule_GetPointer(py_param, NULL));
-                break;
-            case Category_GitDiff:
-                gitdiff_getDigest(&s->str, &s->len, (Parameter*)PyCapsule_GetPointer(py_param, NULL));
-                break;
-            }
-        }
-
-        QUEUE_PUT(pEngine->task_queue, tasks + i);
+        releaseBuffers(pEngine);
+        return NULL;
     }
 
-    QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
-
-    uint32_t results_count = 0;
-    for ( i = 0; i < source_size; ++i )
+    weight_t* weights = (weight_t*)malloc((size_t)results_count * sizeof(weight_t));
+    if ( !weights )
     {
-        if ( results[i].weight > MIN_WEIGHT )
-        {
-            if ( i > results_count )
-            {
-                results[results_count] = results[i];
-            }
-            ++results_count;
-        }
+        releaseBuffers(pEngine);
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return NULL;
     }
 
-    if ( results_count == 0 )
+    PyObject* text_list = NULL;
+    if ( return_array )
+        text_list = buildIndexArray(pEngine, (uint32_t)results_count, weights, PY_SET_ITEM);
+    else
+        text_list = buildTextList(pEngine, source.py_source, task_count, (uint32_t)results_count,
+                                  weights, PY_SET_ITEM);
+    releaseBuffers(pEngine);
+    if ( !text_list )
     {
-        free(pEngine->source);
-        free(tasks);
-        free(results);
-        return Py_BuildValue("([],[])");
+        free(weights);
+        return NULL;
     }
 
-    if ( sort_results )
-    {
-        if ( task_count == 1 || results_count < 60000 )
-        {
-            qsort(results, results_count, sizeof(FeResult), compare);
-        }
-        else
-        {
-            chunk_size = (results_count + task_count - 1) / task_count;
-            if ( chunk_size < 2000 )
-            {
-                chunk_size = (results_count + (task_count >> 1) - 1) / (task_count >> 1);
-            }
-            task_count = (results_count + chunk_size - 1) / chunk_size;
-            FeResult* buffer = (FeResult*)malloc(chunk_size * (task_count >> 1) * sizeof(FeResult));
-            if ( !buffer )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-                return NULL;
-            }
-#if defined(_MSC_VER)
-            QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-            for ( i = 0; i < task_count; ++i )
-            {
-                uint32_t offset = i * chunk_size;
-                uint32_t length = MIN(chunk_size, results_count - offset);
+    PyObject* py_weights = createWeights(weights);
+    setSortedCount(py_weights, (uint32_t)sorted_count, (uint32_t)results_count);
 
-                tasks[i].function = Q_SORT;
-                tasks[i].offset = offset;
-                tasks[i].length = length;
-                QUEUE_PUT(pEngine->task_queue, tasks + i);
-            }
+    return Py_BuildValue("(NN)", py_weights, text_list);
+}
 
-            QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+#if !defined(_MSC_VER)
 
-            MergeTaskItem* merge_tasks = NULL;
-            merge_tasks = (MergeTaskItem*)malloc(task_count * sizeof(MergeTaskItem));
-            if ( !merge_tasks )
-            {
-                free(pEngine->source);
-                free(tasks);
-                free(results);
-                free(buffer);
-                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-                return NULL;
-            }
+/**
+ * regexMatch(engine, source, pattern, category=NO_CATEGORY, param=None, ignore_case=False, begin=0, end=0xFFFFFFFF)
+ *
+ * `source` is a list or a corpus created by createCorpus().
+ * `pattern` is a POSIX extended regular expression.
+ * `category` and `param` are optional, if they are specified, the digests of the items are matched,
+ *      see fuzzyMatchPart().
+ * `begin` and `end` are optional, only the items of `source` in range [begin, end) are matched.
+ *
+ * only the items that consist of ASCII characters are matched, because the meaning of a regular expression
+ * depends on the encoding for the others, the caller decides whether they match.
+ *
+ * return a tuple, (a list of index to items from `source` that match `pattern`, a list of index to items
+ * that are left to the caller), both in the order of `source`, or None if it is cancelled.
+ */
+static PyObject* fuzzyEngine_regexMatch_(PyObject* self, PyObject* args, PyObject* kwargs)
+{
+    PyObject* py_engine = NULL;
+    PyObject* py_source = NULL;
+    const char* pattern = NULL;
+    uint32_t category = NO_CATEGORY;
+    PyObject* py_param = NULL;
+    uint8_t ignore_case = 0;
+    uint32_t begin = 0;
+    uint32_t end = 0xFFFFFFFF;
+    static char* kwlist[] = {"engine", "source", "pattern", "category", "param", "ignore_case", "begin", "end", NULL};
 
-            while ( chunk_size < results_count )
-            {
-                uint32_t q = results_count / (chunk_size << 1);
-                uint32_t r = results_count % (chunk_size << 1);
-#if defined(_MSC_VER)
-                QUEUE_SET_TASK_COUNT(pEngine->task_queue, q + r/chunk_size);
-#endif
-                for ( i = 0; i < q; ++i )
-                {
-                    merge_tasks[i].function = MERGE;
-                    merge_tasks[i].offset_1 = i * (chunk_size << 1);
-                    merge_tasks[i].length_1 = chunk_size;
-                    merge_tasks[i].length_2 = chunk_size;
-                    merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
-                    QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
-                }
+    if ( !PyArg_ParseTupleAndKeywords(args, kwargs, "OOs|IObII:regexMatch", kwlist, &py_engine, &py_source,
+                                      &pattern, &category, &py_param, &ignore_case, &begin, &end) )
+        return NULL;
 
-                if ( r > chunk_size )
-                {
-                    merge_tasks[i].function = MERGE;
-                    merge_tasks[i].offset_1 = i * (chunk_size << 1);
-                    merge_tasks[i].length_1 = chunk_size;
-                    merge_tasks[i].length_2 = r - chunk_size;
-                    merge_tasks[i].buffer = buffer + (merge_tasks[i].offset_1 >> 1); /* buffer + i * chunk_size */
-                    QUEUE_PUT(pEngine->task_queue, merge_tasks + i);
-                }
+    FuzzyEngine* pEngine = (FuzzyEngine*)PyCapsule_GetPointer(py_engine, NULL);
+    if ( !pEngine )
+        return NULL;
 
-                QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+    FeSource source;
+    if ( parseSource(py_source, begin, end, &source) < 0 )
+        return NULL;
 
-                chunk_size <<= 1;
-            }
+    void* param = NULL;
+    if ( category != NO_CATEGORY )
+    {
+        if ( category > Category_Generic )
+        {
+            PyErr_SetString(PyExc_ValueError, "invalid `category`.");
+            return NULL;
+        }
 
-            free(buffer);
-            free(merge_tasks);
+        param = py_param ? PyCapsule_GetPointer(py_param, NULL) : NULL;
+        if ( !param )
+        {
+            PyErr_SetString(PyExc_ValueError, "`param` is required by `category`.");
+            return NULL;
         }
     }
 
-    weight_t* weights = (weight_t*)malloc(results_count * sizeof(weight_t));
-    if ( !weights )
+    int regex_flags = REG_EXTENDED | REG_NOSUB | (ignore_case ? REG_ICASE : 0);
+    regex_t regex;
+    int ret = regcomp(&regex, pattern, regex_flags);
+    if ( ret != 0 )
     {
-        free(pEngine->source);
-        free(tasks);
-        free(results);
-        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        char errbuf[256];
+        regerror(ret, &regex, errbuf, sizeof(errbuf));
+        PyErr_SetString(PyExc_ValueError, errbuf);
         return NULL;
     }
+    regfree(&regex);
 
-    PyObject* text_list = PyList_New(results_count);
-    if ( task_count == 1 || results_count < 40000 )
+    if ( source.size == 0 )
     {
-        for ( i = 0; i < results_count; ++i )
-        {
-            weights[i] = results[i].weight;
-            /* PyList_SET_ITEM() steals a reference to item.     */
-            /* PySequence_ITEM() return value: New reference. */
-            PyList_SET_ITEM(text_list, i, PySequence_ITEM(py_source, results[i].index));
-        }
+        return Py_BuildValue("([],[])");
     }
-    else
-    {
-        chunk_size = (results_count + task_count - 1) / task_count;
-        if ( chunk_size < 8000 )
-        {
-            chunk_size = (results_count + (task_count >> 1) - 1) / (task_count >> 1);
-        }
-        task_count = (results_count + chunk_size - 1) / chunk_size;
 
-        PySetTaskItem* py_set_tasks = NULL;
-        py_set_tasks = (PySetTaskItem*)malloc(task_count * sizeof(PySetTaskItem));
-        if ( !py_set_tasks )
-        {
-            free(pEngine->source);
-            free(tasks);
-            free(results);
-            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
-            return NULL;
-        }
+    pEngine->regex = pattern;
+    pEngine->regex_flags = regex_flags;
+    pEngine->skip_len = 0;
 
-#if defined(_MSC_VER)
-        QUEUE_SET_TASK_COUNT(pEngine->task_queue, task_count);
-#endif
-        for ( i = 0; i < task_count; ++i )
-        {
-            uint32_t offset = i * chunk_size;
-            uint32_t length = MIN(chunk_size, results_count - offset);
+    TaskItem* tasks = NULL;
+    uint32_t task_count = 0;
+    int64_t source_size = computeWeights(pEngine, &source, REGEX_MATCH, category, param, &tasks, &task_count);
+    if ( source_size < 0 )
+    {
+        releaseBuffers(pEngine);
+        if ( source_size == CANCELLED )
+            Py_RETURN_NONE;
 
-            py_set_tasks[i].function = PY_SET_ITEM;
-            py_set_tasks[i].offset = offset;
-            py_set_tasks[i].length = length;
-            py_set_tasks[i].weights = weights;
-            py_set_tasks[i].text_list = text_list;
-            py_set_tasks[i].py_source = py_source;
-            QUEUE_PUT(pEngine->task_queue, py_set_tasks + i);
-        }
+        return NULL;
+    }
 
-        QUEUE_JOIN(pEngine->task_queue);    /* blocks until all tasks have finished */
+    FeResult* results = pEngine->results;
+    uint32_t matched_count = 0;
+    uint32_t undecided_count = 0;
+    uint32_t i = 0;
+    for ( ; i < source_size; ++i )
+    {
+        if ( results[i].path_weight == REGEX_MATCHED )
+            ++matched_count;
+        else if ( results[i].path_weight == REGEX_UNDECIDED )
+            ++undecided_count;
+    }
 
-        free(py_set_tasks);
+    PyObject* index_list = PyList_New(matched_count);
+    PyObject* undecided_list = PyList_New(undecided_count);
+    matched_count = 0;
+    undecided_count = 0;
+    for ( i = 0; i < source_size; ++i )
+    {
+        /* PyList_SET_ITEM() steals a reference to item.     */
+        if ( results[i].path_weight == REGEX_MATCHED )
+            PyList_SET_ITEM(index_list, matched_count++, Py_BuildValue("I", results[i].index));
+        else if ( results[i].path_weight == REGEX_UNDECIDED )
+            PyList_SET_ITEM(undecided_list, undecided_count++, Py_BuildValue("I", results[i].index));
     }
 
-    free(pEngine->source);
-    free(tasks);
-    free(results);
+    releaseBuffers(pEngine);
 
-    return Py_BuildValue("(NN)", createWeights(weights), text_list);
+    return Py_BuildValue("(NN)", index_list, undecided_list);
 }
 
+#endif
+
+/* only one call can use an engine at a time, see acquireEngine() */
+ENGINE_METHOD(fuzzyEngine_fuzzyMatch)
+ENGINE_METHOD(fuzzyEngine_fuzzyMatchEx)
+ENGINE_METHOD(fuzzyEngine_fuzzyMatchPart)
+ENGINE_METHOD(fuzzyEngine_fuzzyMatchAnd)
+ENGINE_METHOD(fuzzyEngine_fuzzyMatchRefine)
+#if !defined(_MSC_VER)
+ENGINE_METHOD(fuzzyEngine_regexMatch)
+#endif
+ENGINE_METHOD(fuzzyEngine_getHighlights)
+ENGINE_METHOD(fuzzyEngine_guessMatch)
+
 static PyMethodDef fuzzyEngine_Methods[] =
 {
     { "createFuzzyEngine", (PyCFunction)fuzzyEngine_createFuzzyEngine, METH_VARARGS | METH_KEYWORDS, "" },
     { "closeFuzzyEngine", (PyCFunction)fuzzyEngine_closeFuzzyEngine, METH_VARARGS, "" },
+    { "releaseWorkers", (PyCFunction)fuzzyEngine_releaseWorkers, METH_VARARGS, "" },
+    { "stats", (PyCFunction)fuzzyEngine_stats, METH_VARARGS, "" },
+    { "cancel", (PyCFunction)fuzzyEngine_cancel, METH_VARARGS, "" },
     { "initPattern", (PyCFunction)fuzzyEngine_initPattern, METH_VARARGS, "initialize the pattern." },
     { "fuzzyMatch", (PyCFunction)fuzzyEngine_fuzzyMatch, METH_VARARGS | METH_KEYWORDS, "" },
     { "fuzzyMatchEx", (PyCFunction)fuzzyEngine_fuzzyMatchEx, METH_VARARGS | METH_KEYWORDS, "" },
     { "fuzzyMatchPart", (PyCFunction)fuzzyEngine_fuzzyMatchPart, METH_VARARGS | METH_KEYWORDS, "" },
+    { "fuzzyMatchAnd", (PyCFunction)fuzzyEngine_fuzzyMatchAnd, METH_VARARGS | METH_KEYWORDS, "" },
+    { "fuzzyMatchRefine", (PyCFunction)fuzzyEngine_fuzzyMatchRefine, METH_VARARGS | METH_KEYWORDS, "" },
+#if !defined(_MSC_VER)
+    { "regexMatch", (PyCFunction)fuzzyEngine_regexMatch, METH_VARARGS | METH_KEYWORDS, "" },
+#endif
     { "getHighlights", (PyCFunction)fuzzyEngine_getHighlights, METH_VARARGS | METH_KEYWORDS, "" },
     { "guessMatch", (PyCFunction)fuzzyEngine_guessMatch, METH_VARARGS | METH_KEYWORDS, "" },
     { "merge", (PyCFunction)fuzzyEngine_merge, METH_VARARGS, "" },
+    { "sortRemainder", (PyCFunction)fuzzyEngine_sortRemainder, METH_VARARGS, "" },
     { "createRgParameter", (PyCFunction)fuzzyEngine_createRgParameter, METH_VARARGS, "" },
     { "createParameter", (PyCFunction)fuzzyEngine_createParameter, METH_VARARGS, "" },
     { "createGtagsParameter", (PyCFunction)fuzzyEngine_createGtagsParameter, METH_VARARGS, "" },
+    { "createDigestParameter", (PyCFunction)fuzzyEngine_createDigestParameter, METH_VARARGS | METH_KEYWORDS, "" },
+    { "createCorpus", (PyCFunction)fuzzyEngine_createCorpus, METH_VARARGS, "" },
+    { "appendCorpus", (PyCFunction)fuzzyEngine_appendCorpus, METH_VARARGS, "" },
+    { "indexCorpus", (PyCFunction)fuzzyEngine_indexCorpus, METH_VARARGS, "" },
+    { "saveCorpusIndex", (PyCFunction)fuzzyEngine_saveCorpusIndex, METH_VARARGS, "" },
+    { "loadCorpusIndex", (PyCFunction)fuzzyEngine_loadCorpusIndex, METH_VARARGS, "" },
+    { "createAccumulator", (PyCFunction)fuzzyEngine_createAccumulator, METH_NOARGS, "" },
+    { "appendAccumulator", (PyCFunction)fuzzyEngine_appendAccumulator, METH_VARARGS | METH_KEYWORDS, "" },
+    { "getTopResults", (PyCFunction)fuzzyEngine_getTopResults, METH_VARARGS, "" },
+    { "getAllResults", (PyCFunction)fuzzyEngine_getAllResults, METH_VARARGS, "" },
     { NULL, NULL, 0, NULL }
 };
 
@@ -2600,6 +5559,12 @@ PyMODINIT_FUNC PyInit_fuzzyEngine(void)
         return NULL;
     }
 
+    if ( PyModule_AddObject(module, "Category_Generic", Py_BuildValue("I", Category_Generic)) )
+    {
+        Py_DECREF(module);
+        return NULL;
+    }
+
     return module;
 }
 
@@ -2648,6 +5613,12 @@ PyMODINIT_FUNC initfuzzyEngine(void)
         Py_DECREF(module);
         return;
     }
+
+    if ( PyModule_AddObject(module, "Category_Generic", Py_BuildValue("I", Category_Generic)) )
+    {
+        Py_DECREF(module);
+        return;
+    }
 }
 
 #endif
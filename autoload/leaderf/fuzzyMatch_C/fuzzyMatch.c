@@ -151,15 +151,30 @@
 
 #endif
 
+#if defined(__x86_64__) || defined(_M_X64) || defined(_M_AMD64)
+
+    #define FM_SSE2
+    #include <emmintrin.h>
+
+    #if (defined(__GNUC__) || defined(__clang__)) && !defined(_MSC_VER)
+        #define FM_AVX2
+        #include <immintrin.h>
+    #endif
+
+#endif
+
 #if defined(_MSC_VER)
     #define THREAD_LOCAL thread_local
 #else
     #define THREAD_LOCAL __thread
 #endif
 
+/* the non-ASCII bytes are left as they are, which are the symbols of a UTF-8 pattern */
+#define FM_TOLOWER(c) ((char)((uint8_t)(c) < 0x80 ? tolower(c) : (c)))
+
 static THREAD_LOCAL uint64_t TEXT_MASK[256*2];
 
-static uint16_t valTable[64] =
+static uint16_t valTable[65] =
 {
     0,   1,   4,   7,   13,  19,  25,  31,
     37,  43,  49,  55,  61,  67,  73,  79,
@@ -168,83 +183,475 @@ static uint16_t valTable[64] =
     181, 187, 193, 199, 205, 211, 217, 223,
     229, 235, 241, 247, 253, 259, 265, 271,
     277, 283, 289, 295, 301, 307, 313, 319,
-    325, 331, 337, 343, 349, 355, 361, 367
+    325, 331, 337, 343, 349, 355, 361, 367,
+    373
 };
 
 typedef struct TextContext
 {
     const char* text;
     uint64_t* text_mask;
-    uint16_t text_len;
-    uint16_t col_num;
-    uint16_t offset;
+    uint32_t text_len;
+    uint32_t col_num;
+    uint32_t offset;
 }TextContext;
 
 typedef struct ValueElements
 {
     float score;
-    uint16_t beg;
-    uint16_t end;
+    uint32_t beg;
+    uint32_t end;
 }ValueElements;
 
-PatternContext* initPattern(const char* pattern, uint16_t pattern_len)
+/**
+ * decode the UTF-8 character at the beginning of `str`, an invalid byte is
+ * decoded as a character of its own, which never equals a valid code point.
+ * return the length of the character in bytes.
+ */
+static uint32_t decodeUtf8(const char* str, uint32_t len, uint32_t* pCode_point)
+{
+    const uint8_t* s = (const uint8_t*)str;
+    uint32_t code_point = 0;
+    uint32_t n = 0;
+    if ( s[0] < 0x80 )
+    {
+        *pCode_point = s[0];
+        return 1;
+    }
+    else if ( (s[0] & 0xE0) == 0xC0 )
+    {
+        n = 2;
+        code_point = s[0] & 0x1F;
+    }
+    else if ( (s[0] & 0xF0) == 0xE0 )
+    {
+        n = 3;
+        code_point = s[0] & 0x0F;
+    }
+    else if ( (s[0] & 0xF8) == 0xF0 )
+    {
+        n = 4;
+        code_point = s[0] & 0x07;
+    }
+
+    if ( n > 0 && n <= len )
+    {
+        uint32_t i;
+        for ( i = 1; i < n; ++i )
+        {
+            if ( (s[i] & 0xC0) != 0x80 )
+                break;
+            code_point = (code_point << 6) | (s[i] & 0x3F);
+        }
+        if ( i == n )
+        {
+            *pCode_point = code_point;
+            return n;
+        }
+    }
+
+    *pCode_point = 0x80000000 | s[0];
+    return 1;
+}
+
+/**
+ * simple case folding of the Latin, Greek, Cyrillic, Armenian and fullwidth Latin letters.
+ */
+static uint32_t toLowerCodePoint(uint32_t c)
+{
+    if ( c < 0x80 )
+        return (uint32_t)tolower((int)c);
+    /* Latin-1 Supplement */
+    else if ( c >= 0xC0 && c <= 0xDE && c != 0xD7 )
+        return c + 0x20;
+    /* Latin Extended-A */
+    else if ( c >= 0x100 && c <= 0x17F )
+    {
+        if ( ((c <= 0x12F || (c >= 0x132 && c <= 0x137) || (c >= 0x14A && c <= 0x177)) && (c & 1) == 0)
+             || (((c >= 0x139 && c <= 0x148) || (c >= 0x179 && c <= 0x17E)) && (c & 1) == 1) )
+            return c + 1;
+        else if ( c == 0x178 )
+            return 0xFF;
+    }
+    /* Greek */
+    else if ( c >= 0x386 && c <= 0x3AB )
+    {
+        if ( c >= 0x391 && c != 0x3A2 )
+            return c + 0x20;
+        else if ( c == 0x386 )
+            return 0x3AC;
+        else if ( c >= 0x388 && c <= 0x38A )
+            return c + 0x25;
+        else if ( c == 0x38C )
+            return 0x3CC;
+        else if ( c == 0x38E || c == 0x38F )
+            return c + 0x3F;
+    }
+    /* Cyrillic */
+    else if ( c >= 0x400 && c <= 0x4BF )
+    {
+        if ( c <= 0x40F )
+            return c + 0x50;
+        else if ( c <= 0x42F )
+            return c + 0x20;
+        else if ( ((c >= 0x460 && c <= 0x481) || c >= 0x48A) && (c & 1) == 0 )
+            return c + 1;
+    }
+    /* Armenian */
+    else if ( c >= 0x531 && c <= 0x556 )
+        return c + 0x30;
+    /* Latin Extended Additional */
+    else if ( ((c >= 0x1E00 && c <= 0x1E95) || (c >= 0x1EA0 && c <= 0x1EFF)) && (c & 1) == 0 )
+        return c + 1;
+    /* Fullwidth Latin letters */
+    else if ( c >= 0xFF21 && c <= 0xFF3A )
+        return c + 0x20;
+
+    return c;
+}
+
+static uint8_t getSymbol(PatternContext* pPattern_ctxt, uint32_t code_point)
+{
+    uint8_t i;
+    for ( i = 0; i < pPattern_ctxt->symbol_count; ++i )
+    {
+        if ( pPattern_ctxt->code_points[i] == code_point )
+            return UNKNOWN_SYMBOL + 1 + i;
+    }
+
+    return UNKNOWN_SYMBOL;
+}
+
+static uint64_t signature_table[256];
+static uint8_t signature_table_ready = 0;
+
+/**
+ * letters are case insensitive and take a bit each, so do digits, the other
+ * ASCII characters share the remaining bits, and all the non-ASCII bytes share the last bit.
+ */
+static void initSignatureTable(void)
+{
+    uint32_t c;
+    for ( c = 0; c < 256; ++c )
+    {
+        if ( c >= 0x80 )
+            signature_table[c] = 1ULL << 63;
+        else if ( isalpha(c) )
+            signature_table[c] = 1ULL << (tolower(c) - 'a');
+        else if ( isdigit(c) )
+            signature_table[c] = 1ULL << (c - '0' + 26);
+        else
+            signature_table[c] = 1ULL << (36 + c % 27);
+    }
+    signature_table_ready = 1;
+}
+
+/**
+ * return a bit set of the characters in `text`, if a text can match a pattern,
+ * all the bits of the pattern's signature are set in the text's signature.
+ */
+uint64_t getTextSignature(const char* text, uint32_t text_len)
+{
+    if ( !signature_table_ready )
+    {
+        initSignatureTable();
+    }
+
+    uint64_t signature = 0;
+    uint32_t i;
+    for ( i = 0; i < text_len; ++i )
+    {
+        signature |= signature_table[(uint8_t)text[i]];
+    }
+
+    return signature;
+}
+
+/**
+ * return the index of the first character in `str` that is `a` or `b`, -1 if not found.
+ */
+static int64_t findChar_scalar(const char* str, uint32_t len, char a, char b)
+{
+    uint32_t i;
+    for ( i = 0; i < len; ++i )
+    {
+        if ( str[i] == a || str[i] == b )
+            return i;
+    }
+
+    return -1;
+}
+
+#if defined(FM_SSE2)
+
+static int64_t findChar_sse2(const char* str, uint32_t len, char a, char b)
 {
-    PatternContext* pPattern_ctxt = (PatternContext*)malloc(sizeof(PatternContext));
+    __m128i va = _mm_set1_epi8(a);
+    __m128i vb = _mm_set1_epi8(b);
+    uint32_t i = 0;
+    for ( ; i + 16 <= len; i += 16 )
+    {
+        __m128i x = _mm_loadu_si128((const __m128i*)(str + i));
+        uint32_t mask = (uint32_t)_mm_movemask_epi8(_mm_or_si128(_mm_cmpeq_epi8(x, va), _mm_cmpeq_epi8(x, vb)));
+        if ( mask != 0 )
+            return i + FM_CTZ(mask);
+    }
+
+    int64_t pos = findChar_scalar(str + i, len - i, a, b);
+
+    return pos < 0 ? pos : i + pos;
+}
+
+#endif
+
+#if defined(FM_AVX2)
+
+__attribute__((target("avx2")))
+static int64_t findChar_avx2(const char* str, uint32_t len, char a, char b)
+{
+    __m256i va = _mm256_set1_epi8(a);
+    __m256i vb = _mm256_set1_epi8(b);
+    uint32_t i = 0;
+    for ( ; i + 32 <= len; i += 32 )
+    {
+        __m256i x = _mm256_loadu_si256((const __m256i*)(str + i));
+        uint32_t mask = (uint32_t)_mm256_movemask_epi8(_mm256_or_si256(_mm256_cmpeq_epi8(x, va),
+                                                                       _mm256_cmpeq_epi8(x, vb)));
+        if ( mask != 0 )
+            return i + FM_CTZ(mask);
+    }
+
+    int64_t pos = findChar_sse2(str + i, len - i, a, b);
+
+    return pos < 0 ? pos : i + pos;
+}
+
+#endif
+
+typedef int64_t (*FindChar)(const char* str, uint32_t len, char a, char b);
+
+static FindChar getFindChar(void)
+{
+#if defined(FM_AVX2)
+    __builtin_cpu_init();
+    if ( __builtin_cpu_supports("avx2") )
+        return findChar_avx2;
+#endif
+
+#if defined(FM_SSE2)
+    return findChar_sse2;
+#else
+    return findChar_scalar;
+#endif
+}
+
+static FindChar findChar = NULL;
+
+/**
+ * a cheap test before computing the weight, return 0 if `text` can not match the pattern.
+ * the ASCII characters of the pattern must appear in `text` in order, a lowercase
+ * character can match its uppercase, which is a necessary condition of a match
+ * no matter whether the pattern is lowercase or not.
+ */
+static int prefilter(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt)
+{
+    const char* pattern = pPattern_ctxt->pattern;
+    uint32_t i = 0;
+    uint32_t j;
+    for ( j = 0; j < pPattern_ctxt->actual_pattern_len; ++j )
+    {
+        char c = pattern[j];
+        /* a symbol of UTF-8 pattern */
+        if ( (uint8_t)c >= 0x80 )
+            continue;
+
+        int64_t pos = findChar(text + i, text_len - i, c, islower(c) ? (char)toupper(c) : c);
+        if ( pos < 0 )
+            return 0;
+
+        i += (uint32_t)pos + 1;
+    }
+
+    return 1;
+}
+
+/**
+ * long_pattern_mask and the pattern are kept in the memory following the PatternContext,
+ * the non-ASCII characters of the pattern are replaced with the symbols they are mapped to.
+ * if `is_exact` is not 0, the pattern only matches the texts that contain it, and the bytes of
+ * the pattern are kept after the symbols.
+ */
+PatternContext* initPattern(const char* pattern, uint32_t pattern_len, uint8_t is_exact)
+{
+    uint32_t word_num = ((pattern_len < MAX_PATTERN_LEN ? pattern_len : MAX_PATTERN_LEN) + 63) >> 6;
+    size_t mask_size = pattern_len >= 64 ? (word_num << 8) * sizeof(int64_t) : 0;
+    /* an empty pattern matches any text, exactly or not */
+    is_exact = is_exact && pattern_len > 0;
+    size_t exact_size = is_exact ? (size_t)pattern_len << 1 : 0;
+    PatternContext* pPattern_ctxt = (PatternContext*)malloc(sizeof(PatternContext) + mask_size + pattern_len + 1
+                                                            + exact_size);
     if ( !pPattern_ctxt )
     {
         fprintf(stderr, "Out of memory in initPattern()!\n");
         return NULL;
     }
+
+    if ( !findChar )
+    {
+        findChar = getFindChar();
+    }
+
+    char* symbols = (char*)(pPattern_ctxt + 1) + mask_size;
+    pPattern_ctxt->is_exact = is_exact;
+    pPattern_ctxt->exact_pattern = NULL;
+    pPattern_ctxt->exact_upper = NULL;
+    pPattern_ctxt->exact_pattern_len = 0;
+    if ( is_exact )
+    {
+        char* exact_pattern = symbols + pattern_len + 1;
+        char* exact_upper = exact_pattern + pattern_len;
+        uint32_t k = 0;
+        for ( ; k < pattern_len; ++k )
+        {
+            exact_pattern[k] = pattern[k];
+            exact_upper[k] = islower((uint8_t)pattern[k]) ? (char)toupper(pattern[k]) : pattern[k];
+        }
+        pPattern_ctxt->exact_pattern = exact_pattern;
+        pPattern_ctxt->exact_upper = exact_upper;
+        pPattern_ctxt->exact_pattern_len = pattern_len;
+    }
+    uint32_t symbol_len = 0;
+    uint32_t first_upper = 0xFFFFFFFF;
+    pPattern_ctxt->is_utf8 = 0;
+    pPattern_ctxt->symbol_count = 0;
+
+    uint32_t i = 0;
+    while ( i < pattern_len )
+    {
+        if ( (uint8_t)pattern[i] < 0x80 )
+        {
+            if ( isupper(pattern[i]) && first_upper == 0xFFFFFFFF )
+                first_upper = symbol_len;
+            symbols[symbol_len++] = pattern[i++];
+        }
+        else
+        {
+            uint32_t code_point;
+            i += decodeUtf8(pattern + i, pattern_len - i, &code_point);
+            if ( toLowerCodePoint(code_point) != code_point && first_upper == 0xFFFFFFFF )
+                first_upper = symbol_len;
+
+            uint8_t symbol = getSymbol(pPattern_ctxt, code_point);
+            /* if there are too many different characters, the rest match any unknown character */
+            if ( symbol == UNKNOWN_SYMBOL && pPattern_ctxt->symbol_count < MAX_SYMBOL_COUNT )
+            {
+                pPattern_ctxt->code_points[pPattern_ctxt->symbol_count++] = code_point;
+                symbol = UNKNOWN_SYMBOL + pPattern_ctxt->symbol_count;
+            }
+            symbols[symbol_len++] = (char)symbol;
+            pPattern_ctxt->is_utf8 = 1;
+        }
+    }
+    symbols[symbol_len] = '\0';
+    pattern = symbols;
+    pattern_len = symbol_len;
+
     pPattern_ctxt->actual_pattern_len = pattern_len;
-    if ( pattern_len >= 64 )
+    pPattern_ctxt->signature = getTextSignature(pattern, pattern_len);
+    if ( pattern_len > MAX_PATTERN_LEN )
     {
-        pattern_len = 63;
+        pattern_len = MAX_PATTERN_LEN;
     }
     pPattern_ctxt->pattern = pattern;
     pPattern_ctxt->pattern_len = pattern_len;
     memset(pPattern_ctxt->pattern_mask, -1, sizeof(pPattern_ctxt->pattern_mask));
 
-    uint16_t i;
-    for ( i = 0; i < pattern_len; ++i )
+    if ( pattern_len < 64 )
     {
-        pPattern_ctxt->pattern_mask[(uint8_t)pattern[i]] ^= (1LL << i);
-        if ( islower(pattern[i]) && pPattern_ctxt->pattern_mask[(uint8_t)toupper(pattern[i])] != -1 )
+        pPattern_ctxt->long_pattern_mask = NULL;
+        pPattern_ctxt->word_num = 1;
+        for ( i = 0; i < pattern_len; ++i )
         {
-            pPattern_ctxt->pattern_mask[(uint8_t)toupper(pattern[i])] ^= (1LL << i);
+            pPattern_ctxt->pattern_mask[(uint8_t)pattern[i]] ^= (1LL << i);
+            if ( islower((uint8_t)pattern[i]) && pPattern_ctxt->pattern_mask[(uint8_t)toupper(pattern[i])] != -1 )
+            {
+                pPattern_ctxt->pattern_mask[(uint8_t)toupper(pattern[i])] ^= (1LL << i);
+            }
         }
     }
-    pPattern_ctxt->is_lower = 1;
-
-    for ( i = 0; i < pattern_len; ++i )
+    else
     {
-        if ( isupper(pattern[i]) )
-        {
-            pPattern_ctxt->is_lower = 0;
-            break;
+        word_num = (pattern_len + 63) >> 6;
+        int64_t* long_pattern_mask = (int64_t*)(pPattern_ctxt + 1);
+        memset(long_pattern_mask, -1, (word_num << 8) * sizeof(int64_t));
+        pPattern_ctxt->long_pattern_mask = long_pattern_mask;
+        pPattern_ctxt->word_num = word_num;
+        for ( i = 0; i < pattern_len; ++i )
+        {
+            uint8_t c = (uint8_t)pattern[i];
+            long_pattern_mask[c * word_num + (i >> 6)] ^= (int64_t)(1ULL << (i & 63));
+            if ( islower(c) && pPattern_ctxt->pattern_mask[(uint8_t)toupper(c)] != -1 )
+            {
+                long_pattern_mask[(uint8_t)toupper(c) * word_num + (i >> 6)] ^= (int64_t)(1ULL << (i & 63));
+            }
+            pPattern_ctxt->pattern_mask[c] = 0;
         }
     }
 
+    pPattern_ctxt->row_count = 0;
+    for ( i = 0; i < 256; ++i )
+    {
+        if ( pPattern_ctxt->pattern_mask[i] != -1 )
+            pPattern_ctxt->mask_row[i] = (uint8_t)pPattern_ctxt->row_count++;
+    }
+
+    pPattern_ctxt->is_lower = first_upper >= pattern_len;
+
     return pPattern_ctxt;
 }
 
+/**
+ * return the bits of long_pattern_mask[c] starting from the k-th character of the pattern,
+ * only 63 bits are returned, the sign bit is always set as that of pattern_mask[c] >> k.
+ */
+static int64_t getLongPatternMask(PatternContext* pPattern_ctxt, uint8_t c, uint32_t k)
+{
+    uint32_t word_num = pPattern_ctxt->word_num;
+    const int64_t* mask = pPattern_ctxt->long_pattern_mask + c * word_num;
+    uint32_t w = k >> 6;
+    uint32_t shift = k & 63;
+    uint64_t x = (uint64_t)mask[w] >> shift;
+    if ( shift > 0 )
+        x |= (uint64_t)(w + 1 < word_num ? mask[w + 1] : -1) << (64 - shift);
+
+    return (int64_t)(x | 0x8000000000000000ULL);
+}
+
+#define HIGHLIGHT_GROUP_SIZE(pattern_len) \
+    (sizeof(HighlightGroup) + ((pattern_len) > 64 ? (pattern_len) - 64 : 0) * sizeof(HighlightPos))
+
+#define PATTERN_MASK(c, k) (long_pattern_mask ? getLongPatternMask(pPattern_ctxt, c, k) : pattern_mask[c] >> (k))
+
+#define TEXT_MASK_ROW(c) (pPattern_ctxt->mask_row[(uint8_t)(c)] * col_num)
+
 ValueElements* evaluate_nameOnly(TextContext* pText_ctxt,
                                  PatternContext* pPattern_ctxt,
-                                 uint16_t k,
+                                 uint32_t k,
                                  ValueElements val[])
 {
     uint64_t* text_mask = pText_ctxt->text_mask;
-    uint16_t col_num = pText_ctxt->col_num;
-    uint16_t j = pText_ctxt->offset;
+    uint32_t col_num = pText_ctxt->col_num;
+    uint32_t j = pText_ctxt->offset;
 
     const char* pattern = pPattern_ctxt->pattern;
-    uint16_t base_offset = pattern[k] * col_num;
+    uint32_t base_offset = TEXT_MASK_ROW(pattern[k]);
     uint64_t x = text_mask[base_offset + (j >> 6)] >> (j & 63);
-    uint16_t i = 0;
+    uint32_t i = 0;
 
     if ( x == 0 )
     {
         uint64_t bits = 0;
-        uint16_t col = 0;
+        uint32_t col = 0;
         for ( col = (j >> 6) + 1; col < col_num; ++col )
         {
             if ( (bits = text_mask[base_offset + col]) != 0 )
@@ -271,18 +678,19 @@ ValueElements* evaluate_nameOnly(TextContext* pText_ctxt,
     if ( j > 0 && val[k].beg >= j )
         return val + k;
 
-    uint16_t beg = 0;
-    uint16_t end = 0;
+    uint32_t beg = 0;
+    uint32_t end = 0;
 
-    uint16_t max_prefix_score = 0;
+    uint32_t max_prefix_score = 0;
     float max_score = MIN_WEIGHT;
 
     const char* text = pText_ctxt->text;
-    uint16_t text_len = pText_ctxt->text_len;
-    uint16_t pattern_len = pPattern_ctxt->pattern_len - k;
+    uint32_t text_len = pText_ctxt->text_len;
+    uint32_t pattern_len = pPattern_ctxt->pattern_len - k;
     int64_t* pattern_mask = pPattern_ctxt->pattern_mask;
+    int64_t* long_pattern_mask = pPattern_ctxt->long_pattern_mask;
 
-    uint16_t special = 0;
+    uint32_t special = 0;
     if ( i == 0 )
         special = 3;
     else if ( isupper(text[i]) )
@@ -304,24 +712,24 @@ ValueElements* evaluate_nameOnly(TextContext* pText_ctxt,
         char c = text[i];
         /* c in pattern */
         if ( pattern_mask[(uint8_t)c] != -1 )
-            d = (d << 1) | (pattern_mask[(uint8_t)c] >> k);
+            d = (d << 1) | PATTERN_MASK((uint8_t)c, k);
         /**
          * text = 'xxABC', pattern = 'abc'; text[i] == 'B'
          * text = 'xxABC', pattern = 'abc'; text[i] == 'C'
          * NOT text = 'xxABCd', pattern = 'abc'; text[i] == 'C'
          * 'Cd' is considered as a word
          */
-        else if ( isupper(text[i-1]) && pattern_mask[(uint8_t)tolower(c)] != -1
+        else if ( isupper(text[i-1]) && pattern_mask[(uint8_t)FM_TOLOWER(c)] != -1
                   && (i+1 == text_len || !islower(text[i+1])) )
-            d = (d << 1) | (pattern_mask[(uint8_t)tolower(c)] >> k);
+            d = (d << 1) | PATTERN_MASK((uint8_t)FM_TOLOWER(c), k);
         else
             d = ~0;
 
         if ( d >= last )
         {
             float score = MIN_WEIGHT;
-            uint16_t end_pos = 0;
-            uint16_t n = FM_BIT_LENGTH(~last);
+            uint32_t end_pos = 0;
+            uint32_t n = FM_BIT_LENGTH(~last);
             /* e.g., text = '~~abcd~~~~', pattern = 'abcd' */
             if ( n == pattern_len )
             {
@@ -338,7 +746,7 @@ ValueElements* evaluate_nameOnly(TextContext* pText_ctxt,
             }
             else
             {
-                uint16_t prefix_score = special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n];
+                uint32_t prefix_score = special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n];
                 if ( prefix_score > max_prefix_score )
                 {
                     max_prefix_score = prefix_score;
@@ -377,7 +785,7 @@ ValueElements* evaluate_nameOnly(TextContext* pText_ctxt,
             if ( x == 0 )
             {
                 uint64_t bits = 0;
-                uint16_t col = 0;
+                uint32_t col = 0;
                 for ( col = (i >> 6) + 1; col < col_num; ++col )
                 {
                     if ( (bits = text_mask[base_offset + col]) != 0 )
@@ -413,7 +821,7 @@ ValueElements* evaluate_nameOnly(TextContext* pText_ctxt,
     /* e.g., text = '~~~~abcd', pattern = 'abcd' */
     if ( i == text_len )
     {
-        if ( ~d >> (pattern_len - 1) )
+        if ( pattern_len < 64 && ~d >> (pattern_len - 1) )
         {
             float score = (float)(special > 0 ? (pattern_len > 1 ? valTable[pattern_len + 1] : valTable[pattern_len]) + special
                             : valTable[pattern_len]);
@@ -435,22 +843,22 @@ ValueElements* evaluate_nameOnly(TextContext* pText_ctxt,
 
 ValueElements* evaluate(TextContext* pText_ctxt,
                         PatternContext* pPattern_ctxt,
-                        uint16_t k,
+                        uint32_t k,
                         ValueElements val[])
 {
     uint64_t* text_mask = pText_ctxt->text_mask;
-    uint16_t col_num = pText_ctxt->col_num;
-    uint16_t j = pText_ctxt->offset;
+    uint32_t col_num = pText_ctxt->col_num;
+    uint32_t j = pText_ctxt->offset;
 
     const char* pattern = pPattern_ctxt->pattern;
-    uint16_t base_offset = pattern[k] * col_num;
+    uint32_t base_offset = TEXT_MASK_ROW(pattern[k]);
     uint64_t x = text_mask[base_offset + (j >> 6)] >> (j & 63);
-    uint16_t i = 0;
+    uint32_t i = 0;
 
     if ( x == 0 )
     {
         uint64_t bits = 0;
-        uint16_t col = 0;
+        uint32_t col = 0;
         for ( col = (j >> 6) + 1; col < col_num; ++col )
         {
             if ( (bits = text_mask[base_offset + col]) != 0 )
@@ -477,18 +885,19 @@ ValueElements* evaluate(TextContext* pText_ctxt,
     if ( j > 0 && val[k].beg >= j )
         return val + k;
 
-    uint16_t beg = 0;
-    uint16_t end = 0;
+    uint32_t beg = 0;
+    uint32_t end = 0;
 
-    uint16_t max_prefix_score = 0;
+    uint32_t max_prefix_score = 0;
     float max_score = MIN_WEIGHT;
 
     const char* text = pText_ctxt->text;
-    uint16_t text_len = pText_ctxt->text_len;
-    uint16_t pattern_len = pPattern_ctxt->pattern_len - k;
+    uint32_t text_len = pText_ctxt->text_len;
+    uint32_t pattern_len = pPattern_ctxt->pattern_len - k;
     int64_t* pattern_mask = pPattern_ctxt->pattern_mask;
+    int64_t* long_pattern_mask = pPattern_ctxt->long_pattern_mask;
 
-    uint16_t special = 0;
+    uint32_t special = 0;
     if ( i == 0 )
         special = 5;
 #if defined(_MSC_VER)
@@ -518,25 +927,25 @@ ValueElements* evaluate(TextContext* pText_ctxt,
         char c = text[i];
         /* c in pattern */
         if ( pattern_mask[(uint8_t)c] != -1 )
-            d = (d << 1) | (pattern_mask[(uint8_t)c] >> k);
+            d = (d << 1) | PATTERN_MASK((uint8_t)c, k);
         /**
          * text = 'xxABC', pattern = 'abc'; text[i] == 'B'
          * text = 'xxABC', pattern = 'abc'; text[i] == 'C'
          * NOT text = 'xxABCd', pattern = 'abc'; text[i] == 'C'
          * 'Cd' is considered as a word
          */
-        /* else if ( isupper(text[i-1]) && pattern_mask[(uint8_t)tolower(c)] != -1 */
+        /* else if ( isupper(text[i-1]) && pattern_mask[(uint8_t)FM_TOLOWER(c)] != -1 */
         /*           && (i+1 == text_len || !islower(text[i+1])) )                 */
-        else if ( pattern_mask[(uint8_t)tolower(c)] != -1 )
-            d = (d << 1) | (pattern_mask[(uint8_t)tolower(c)] >> k);
+        else if ( pattern_mask[(uint8_t)FM_TOLOWER(c)] != -1 )
+            d = (d << 1) | PATTERN_MASK((uint8_t)FM_TOLOWER(c), k);
         else
             d = ~0;
 
         if ( d >= last )
         {
             float score = MIN_WEIGHT;
-            uint16_t end_pos = 0;
-            uint16_t n = FM_BIT_LENGTH(~last);
+            uint32_t end_pos = 0;
+            uint32_t n = FM_BIT_LENGTH(~last);
             /* e.g., text = '~~abcd~~~~', pattern = 'abcd' */
             if ( n == pattern_len )
             {
@@ -553,7 +962,7 @@ ValueElements* evaluate(TextContext* pText_ctxt,
             }
             else
             {
-                uint16_t prefix_score = special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n];
+                uint32_t prefix_score = special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n];
                 /**
                  * e.g., text = 'AbcxxAbcyyde', pattern = 'abcde'
                  * prefer matching 'Abcyyde'
@@ -598,7 +1007,7 @@ ValueElements* evaluate(TextContext* pText_ctxt,
             if ( x == 0 )
             {
                 uint64_t bits = 0;
-                uint16_t col = 0;
+                uint32_t col = 0;
                 for ( col = (i >> 6) + 1; col < col_num; ++col )
                 {
                     if ( (bits = text_mask[base_offset + col]) != 0 )
@@ -640,7 +1049,7 @@ ValueElements* evaluate(TextContext* pText_ctxt,
     /* e.g., text = '~~~~abcd', pattern = 'abcd' */
     if ( i == text_len )
     {
-        if ( ~d >> (pattern_len - 1) )
+        if ( pattern_len < 64 && ~d >> (pattern_len - 1) )
         {
             float score = (float)(special > 0 ? (pattern_len > 1 ? valTable[pattern_len + 1] : valTable[pattern_len]) + special
                             : valTable[pattern_len]);
@@ -660,35 +1069,35 @@ ValueElements* evaluate(TextContext* pText_ctxt,
     return val + k;
 }
 
-float getWeight(const char* text, uint16_t text_len,
-                PatternContext* pPattern_ctxt,
-                uint8_t is_name_only)
+static float _getWeight(const char* text, uint32_t text_len,
+                        PatternContext* pPattern_ctxt,
+                        uint8_t is_name_only)
 {
     if ( !text || !pPattern_ctxt )
         return MIN_WEIGHT;
 
-    uint16_t j = 0;
-    uint16_t col_num = 0;
+    uint32_t j = 0;
+    uint32_t col_num = 0;
     uint64_t* text_mask = NULL;
     const char* pattern = pPattern_ctxt->pattern;
-    uint16_t pattern_len = pPattern_ctxt->pattern_len;
+    uint32_t pattern_len = pPattern_ctxt->pattern_len;
     int64_t* pattern_mask = pPattern_ctxt->pattern_mask;
     char first_char = pattern[0];
     char last_char = pattern[pattern_len - 1];
 
-    /* maximum number of int16_t is (1 << 15) - 1 */
-    if ( text_len >= (1 << 15) )
+    /* the positions of text are int32_t */
+    if ( text_len > 0x7FFFFFFF )
     {
-        text_len = (1 << 15) - 1;
+        text_len = 0x7FFFFFFF;
     }
 
     if ( pattern_len == 1 )
     {
         if ( isupper(first_char) )
         {
-            int16_t first_char_pos = -1;
-            int16_t i;
-            for ( i = 0; i < text_len; ++i )
+            int32_t first_char_pos = -1;
+            int32_t i;
+            for ( i = 0; i < (int32_t)text_len; ++i )
             {
                 if ( text[i] == first_char )
                 {
@@ -703,11 +1112,11 @@ float getWeight(const char* text, uint16_t text_len,
         }
         else
         {
-            int16_t first_char_pos = -1;
-            int16_t i;
-            for ( i = 0; i < text_len; ++i )
+            int32_t first_char_pos = -1;
+            int32_t i;
+            for ( i = 0; i < (int32_t)text_len; ++i )
             {
-                if ( tolower(text[i]) == first_char )
+                if ( FM_TOLOWER(text[i]) == first_char )
                 {
                     if ( first_char_pos == -1 )
                         first_char_pos = i;
@@ -723,14 +1132,14 @@ float getWeight(const char* text, uint16_t text_len,
         }
     }
 
-    int16_t first_char_pos = -1;
-    uint16_t short_text_len = text_len;
+    int32_t first_char_pos = -1;
+    uint32_t short_text_len = text_len;
     if ( pPattern_ctxt->is_lower )
     {
-        int16_t i;
-        for ( i = 0; i < text_len; ++i )
+        int32_t i;
+        for ( i = 0; i < (int32_t)text_len; ++i )
         {
-            if ( tolower(text[i]) == first_char )
+            if ( FM_TOLOWER(text[i]) == first_char )
             {
                 first_char_pos = i;
                 break;
@@ -739,10 +1148,10 @@ float getWeight(const char* text, uint16_t text_len,
         if ( first_char_pos == -1 )
             return MIN_WEIGHT;
 
-        int16_t last_char_pos = -1;
+        int32_t last_char_pos = -1;
         for ( i = text_len - 1; i >= first_char_pos; --i )
         {
-            if ( tolower(text[i]) == last_char )
+            if ( FM_TOLOWER(text[i]) == last_char )
             {
                 last_char_pos = i;
                 break;
@@ -755,13 +1164,13 @@ float getWeight(const char* text, uint16_t text_len,
         col_num = (short_text_len + 63) >> 6;     /* (short_text_len + 63)/64 */
         if (col_num <= 2)
         {
-            memset(TEXT_MASK, 0, sizeof(TEXT_MASK));
+            memset(TEXT_MASK, 0, pPattern_ctxt->row_count * col_num * sizeof(uint64_t));
             text_mask = TEXT_MASK;
         }
         else
         {
-            /* uint64_t text_mask[256][col_num] */
-            text_mask = (uint64_t*)calloc(col_num << 8, sizeof(uint64_t));
+            /* uint64_t text_mask[row_count][col_num] */
+            text_mask = (uint64_t*)calloc((size_t)pPattern_ctxt->row_count * col_num, sizeof(uint64_t));
             if ( !text_mask )
             {
                 fprintf(stderr, "Out of memory in getWeight()!\n");
@@ -771,11 +1180,11 @@ float getWeight(const char* text, uint16_t text_len,
         char c;
         for ( i = first_char_pos; i <= last_char_pos; ++i )
         {
-            c = tolower(text[i]);
+            c = FM_TOLOWER(text[i]);
             /* c in pattern */
             if ( pattern_mask[(uint8_t)c] != -1 )
             {
-                text_mask[(uint8_t)c * col_num + (i >> 6)] |= 1ULL << (i & 63);
+                text_mask[TEXT_MASK_ROW(c) + (i >> 6)] |= 1ULL << (i & 63);
                 if ( j < pattern_len && c == pattern[j] )
                     ++j;
             }
@@ -785,8 +1194,8 @@ float getWeight(const char* text, uint16_t text_len,
     {
         if ( isupper(first_char) )
         {
-            int16_t i;
-            for ( i = 0; i < text_len; ++i )
+            int32_t i;
+            for ( i = 0; i < (int32_t)text_len; ++i )
             {
                 if ( text[i] == first_char )
                 {
@@ -797,10 +1206,10 @@ float getWeight(const char* text, uint16_t text_len,
         }
         else
         {
-            int16_t i;
-            for ( i = 0; i < text_len; ++i )
+            int32_t i;
+            for ( i = 0; i < (int32_t)text_len; ++i )
             {
-                if ( tolower(text[i]) == first_char )
+                if ( FM_TOLOWER(text[i]) == first_char )
                 {
                     first_char_pos = i;
                     break;
@@ -810,10 +1219,10 @@ float getWeight(const char* text, uint16_t text_len,
         if ( first_char_pos == -1 )
             return MIN_WEIGHT;
 
-        int16_t last_char_pos = -1;
+        int32_t last_char_pos = -1;
         if ( isupper(last_char) )
         {
-            int16_t i;
+            int32_t i;
             for ( i = text_len - 1; i >= first_char_pos; --i )
             {
                 if ( text[i] == last_char )
@@ -825,10 +1234,10 @@ float getWeight(const char* text, uint16_t text_len,
         }
         else
         {
-            int16_t i;
+            int32_t i;
             for ( i = text_len - 1; i >= first_char_pos; --i )
             {
-                if ( tolower(text[i]) == last_char )
+                if ( FM_TOLOWER(text[i]) == last_char )
                 {
                     last_char_pos = i;
                     break;
@@ -842,13 +1251,13 @@ float getWeight(const char* text, uint16_t text_len,
         col_num = (short_text_len + 63) >> 6;
         if (col_num <= 2)
         {
-            memset(TEXT_MASK, 0, sizeof(TEXT_MASK));
+            memset(TEXT_MASK, 0, pPattern_ctxt->row_count * col_num * sizeof(uint64_t));
             text_mask = TEXT_MASK;
         }
         else
         {
-            /* uint64_t text_mask[256][col_num] */
-            text_mask = (uint64_t*)calloc(col_num << 8, sizeof(uint64_t));
+            /* uint64_t text_mask[row_count][col_num] */
+            text_mask = (uint64_t*)calloc((size_t)pPattern_ctxt->row_count * col_num, sizeof(uint64_t));
             if ( !text_mask )
             {
                 fprintf(stderr, "Out of memory in getWeight()!\n");
@@ -856,7 +1265,7 @@ float getWeight(const char* text, uint16_t text_len,
             }
         }
         char c;
-        int16_t i;
+        int32_t i;
         for ( i = first_char_pos; i <= last_char_pos; ++i )
         {
             c = text[i];
@@ -864,9 +1273,9 @@ float getWeight(const char* text, uint16_t text_len,
             {
                 /* c in pattern */
                 if ( pattern_mask[(uint8_t)c] != -1 )
-                    text_mask[(uint8_t)c * col_num + (i >> 6)] |= 1ULL << (i & 63);
-                if ( pattern_mask[(uint8_t)tolower(c)] != -1 )
-                    text_mask[(uint8_t)tolower(c) * col_num + (i >> 6)] |= 1ULL << (i & 63);
+                    text_mask[TEXT_MASK_ROW(c) + (i >> 6)] |= 1ULL << (i & 63);
+                if ( pattern_mask[(uint8_t)FM_TOLOWER(c)] != -1 )
+                    text_mask[TEXT_MASK_ROW(FM_TOLOWER(c)) + (i >> 6)] |= 1ULL << (i & 63);
                 if ( j < pattern_len && c == toupper(pattern[j]) )
                     ++j;
             }
@@ -875,7 +1284,7 @@ float getWeight(const char* text, uint16_t text_len,
                 /* c in pattern */
                 if ( pattern_mask[(uint8_t)c] != -1 )
                 {
-                    text_mask[(uint8_t)c * col_num + (i >> 6)] |= 1ULL << (i & 63);
+                    text_mask[TEXT_MASK_ROW(c) + (i >> 6)] |= 1ULL << (i & 63);
                     if ( j < pattern_len && c == pattern[j] )
                         ++j;
                 }
@@ -892,15 +1301,15 @@ float getWeight(const char* text, uint16_t text_len,
         return MIN_WEIGHT;
     }
 
-    if ( pPattern_ctxt->actual_pattern_len >= 64 )
+    if ( pPattern_ctxt->actual_pattern_len > pattern_len )
     {
-        int16_t i;
+        int32_t i;
         j = 0;
-        for ( i = first_char_pos; i < short_text_len; ++i )
+        for ( i = first_char_pos; i < (int32_t)text_len; ++i )
         {
             if ( j < pPattern_ctxt->actual_pattern_len )
             {
-                if ( (pPattern_ctxt->is_lower && tolower(text[i]) == pattern[j])
+                if ( (pPattern_ctxt->is_lower && FM_TOLOWER(text[i]) == pattern[j])
                      || text[i] == pattern[j] )
                 {
                     ++j;
@@ -927,60 +1336,79 @@ float getWeight(const char* text, uint16_t text_len,
     text_ctxt.col_num = col_num;
     text_ctxt.offset = first_char_pos;
 
-    ValueElements val[64];
-    memset(val, 0, sizeof(val));
+    ValueElements val_buffer[64];
+    ValueElements* val = val_buffer;
+    if ( pattern_len > 64 )
+    {
+        val = (ValueElements*)malloc(pattern_len * sizeof(ValueElements));
+        if ( !val )
+        {
+            fprintf(stderr, "Out of memory in getWeight()!\n");
+            if (col_num > 2)
+            {
+                free(text_mask);
+            }
+            return MIN_WEIGHT;
+        }
+    }
+    memset(val, 0, (pattern_len > 64 ? pattern_len : 64) * sizeof(ValueElements));
+
+    float weight;
     if ( is_name_only )
     {
         ValueElements* pVal = evaluate_nameOnly(&text_ctxt, pPattern_ctxt, 0, val);
         float score = pVal->score;
-        uint16_t beg = pVal->beg;
-        uint16_t end = pVal->end;
-
-        if (col_num > 2)
-        {
-            free(text_mask);
-        }
+        uint32_t beg = pVal->beg;
+        uint32_t end = pVal->end;
 
-        return score + (1 >> beg) + 1.0f/(beg + end) + 1.0f/text_len;
+        weight = score + (1 >> beg) + 1.0f/(beg + end) + 1.0f/text_len;
     }
     else
     {
         ValueElements* pVal = evaluate(&text_ctxt, pPattern_ctxt, 0, val);
         float score = pVal->score;
-        uint16_t beg = pVal->beg;
+        uint32_t beg = pVal->beg;
 
-        if (col_num > 2)
-        {
-            free(text_mask);
-        }
+        weight = score + (float)(pattern_len<<1)/text_len + (float)pattern_len/(text_len - beg);
+    }
 
-        return score + (float)(pattern_len<<1)/text_len + (float)pattern_len/(text_len - beg);
+    if (col_num > 2)
+    {
+        free(text_mask);
     }
+    if ( val != val_buffer )
+    {
+        free(val);
+    }
+
+    return weight;
 }
 
 
 HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
                                             PatternContext* pPattern_ctxt,
-                                            uint16_t k,
+                                            uint32_t k,
                                             HighlightGroup* groups[])
 {
-    uint16_t j = pText_ctxt->offset;
+    uint32_t j = pText_ctxt->offset;
 
     if ( groups[k] && groups[k]->beg >= j )
         return groups[k];
 
+    size_t group_size = HIGHLIGHT_GROUP_SIZE(pPattern_ctxt->pattern_len);
+
     uint64_t* text_mask = pText_ctxt->text_mask;
-    uint16_t col_num = pText_ctxt->col_num;
+    uint32_t col_num = pText_ctxt->col_num;
 
     const char* pattern = pPattern_ctxt->pattern;
-    uint16_t base_offset = pattern[k] * col_num;
+    uint32_t base_offset = TEXT_MASK_ROW(pattern[k]);
     uint64_t x = text_mask[base_offset + (j >> 6)] >> (j & 63);
-    uint16_t i = 0;
+    uint32_t i = 0;
 
     if ( x == 0 )
     {
         uint64_t bits = 0;
-        uint16_t col = 0;
+        uint32_t col = 0;
         for ( col = (j >> 6) + 1; col < col_num; ++col )
         {
             if ( (bits = text_mask[base_offset + col]) != 0 )
@@ -1000,12 +1428,12 @@ HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
         i = j + FM_CTZ(x);
     }
 
-    uint16_t max_prefix_score = 0;
+    uint32_t max_prefix_score = 0;
     float max_score = MIN_WEIGHT;
 
     if ( !groups[k] )
     {
-        groups[k] = (HighlightGroup*)calloc(1, sizeof(HighlightGroup));
+        groups[k] = (HighlightGroup*)calloc(1, group_size);
         if ( !groups[k] )
         {
             fprintf(stderr, "Out of memory in evaluateHighlights_nameOnly()!\n");
@@ -1014,18 +1442,35 @@ HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
     }
     else
     {
-        memset(groups[k], 0, sizeof(HighlightGroup));
+        memset(groups[k], 0, group_size);
     }
 
-    HighlightGroup cur_highlights;
-    memset(&cur_highlights, 0, sizeof(HighlightGroup));
+    /* the group of a long pattern is too large to be put on the stack */
+    HighlightGroup cur_group;
+    HighlightGroup* pCur = &cur_group;
+    if ( group_size > sizeof(HighlightGroup) )
+    {
+        uint32_t index = pPattern_ctxt->pattern_len + k;
+        if ( !groups[index] )
+        {
+            groups[index] = (HighlightGroup*)malloc(group_size);
+            if ( !groups[index] )
+            {
+                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+                return NULL;
+            }
+        }
+        pCur = groups[index];
+    }
+    memset(pCur, 0, group_size);
 
     const char* text = pText_ctxt->text;
-    uint16_t text_len = pText_ctxt->text_len;
-    uint16_t pattern_len = pPattern_ctxt->pattern_len - k;
+    uint32_t text_len = pText_ctxt->text_len;
+    uint32_t pattern_len = pPattern_ctxt->pattern_len - k;
     int64_t* pattern_mask = pPattern_ctxt->pattern_mask;
+    int64_t* long_pattern_mask = pPattern_ctxt->long_pattern_mask;
 
-    uint16_t special = 0;
+    uint32_t special = 0;
     if ( i == 0 )
         special = 3;
     else if ( isupper(text[i]) )
@@ -1047,42 +1492,42 @@ HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
         char c = text[i];
         /* c in pattern */
         if ( pattern_mask[(uint8_t)c] != -1 )
-            d = (d << 1) | (pattern_mask[(uint8_t)c] >> k);
+            d = (d << 1) | PATTERN_MASK((uint8_t)c, k);
         /**
          * text = 'xxABC', pattern = 'abc'; text[i] == 'B'
          * text = 'xxABC', pattern = 'abc'; text[i] == 'C'
          * NOT text = 'xxABCd', pattern = 'abc'; text[i] == 'C'
          * 'Cd' is considered as a word
          */
-        else if ( isupper(text[i-1]) && pattern_mask[(uint8_t)tolower(c)] != -1
+        else if ( isupper(text[i-1]) && pattern_mask[(uint8_t)FM_TOLOWER(c)] != -1
                   && (i+1 == text_len || !islower(text[i+1])) )
-            d = (d << 1) | (pattern_mask[(uint8_t)tolower(c)] >> k);
+            d = (d << 1) | PATTERN_MASK((uint8_t)FM_TOLOWER(c), k);
         else
             d = ~0;
 
         if ( d >= last )
         {
             float score = MIN_WEIGHT;
-            uint16_t n = FM_BIT_LENGTH(~last);
+            uint32_t n = FM_BIT_LENGTH(~last);
             /* e.g., text = '~~abcd~~~~', pattern = 'abcd' */
             if ( n == pattern_len )
             {
                 score = (float)(special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n]);
-                cur_highlights.score = score;
-                cur_highlights.beg = i - n;
-                cur_highlights.end = i;
-                cur_highlights.end_index = 1;
-                cur_highlights.positions[0].col = i - n + 1;
-                cur_highlights.positions[0].len = n;
+                pCur->score = score;
+                pCur->beg = i - n;
+                pCur->end = i;
+                pCur->end_index = 1;
+                pCur->positions[0].col = i - n + 1;
+                pCur->positions[0].len = n;
                 if ( special > 0 )
                 {
-                    memcpy(groups[k], &cur_highlights, sizeof(HighlightGroup));
+                    memcpy(groups[k], pCur, group_size);
                     return groups[k];
                 }
             }
             else
             {
-                uint16_t prefix_score = special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n];
+                uint32_t prefix_score = special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n];
                 if ( prefix_score > max_prefix_score )
                 {
                     max_prefix_score = prefix_score;
@@ -1093,13 +1538,13 @@ HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
                         if ( pGroup->end )
                         {
                             score = prefix_score + pGroup->score - 0.2f * (pGroup->beg - i);
-                            cur_highlights.score = score;
-                            cur_highlights.beg = i - n;
-                            cur_highlights.end = pGroup->end;
-                            cur_highlights.positions[0].col = i - n + 1;
-                            cur_highlights.positions[0].len = n;
-                            memcpy(cur_highlights.positions + 1, pGroup->positions, pGroup->end_index * sizeof(HighlightPos));
-                            cur_highlights.end_index = pGroup->end_index + 1;
+                            pCur->score = score;
+                            pCur->beg = i - n;
+                            pCur->end = pGroup->end;
+                            pCur->positions[0].col = i - n + 1;
+                            pCur->positions[0].len = n;
+                            memcpy(pCur->positions + 1, pGroup->positions, pGroup->end_index * sizeof(HighlightPos));
+                            pCur->end_index = pGroup->end_index + 1;
                         }
                     }
                 }
@@ -1107,7 +1552,7 @@ HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
             if ( score > max_score )
             {
                 max_score = score;
-                memcpy(groups[k], &cur_highlights, sizeof(HighlightGroup));
+                memcpy(groups[k], pCur, group_size);
             }
             /* e.g., text = '~_ababc~~~~', pattern = 'abc' */
             special = 0;
@@ -1125,7 +1570,7 @@ HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
             if ( x == 0 )
             {
                 uint64_t bits = 0;
-                uint16_t col = 0;
+                uint32_t col = 0;
                 for ( col = (i >> 6) + 1; col < col_num; ++col )
                 {
                     if ( (bits = text_mask[base_offset + col]) != 0 )
@@ -1161,7 +1606,7 @@ HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
     /* e.g., text = '~~~~abcd', pattern = 'abcd' */
     if ( i == text_len )
     {
-        if ( ~d >> (pattern_len - 1) )
+        if ( pattern_len < 64 && ~d >> (pattern_len - 1) )
         {
             float score = (float)(special > 0 ? (pattern_len > 1 ? valTable[pattern_len + 1] : valTable[pattern_len]) + special
                             : valTable[pattern_len]);
@@ -1183,26 +1628,28 @@ HighlightGroup* evaluateHighlights_nameOnly(TextContext* pText_ctxt,
 
 HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
                                    PatternContext* pPattern_ctxt,
-                                   uint16_t k,
+                                   uint32_t k,
                                    HighlightGroup* groups[])
 {
-    uint16_t j = pText_ctxt->offset;
+    uint32_t j = pText_ctxt->offset;
 
     if ( groups[k] && groups[k]->beg >= j )
         return groups[k];
 
+    size_t group_size = HIGHLIGHT_GROUP_SIZE(pPattern_ctxt->pattern_len);
+
     uint64_t* text_mask = pText_ctxt->text_mask;
-    uint16_t col_num = pText_ctxt->col_num;
+    uint32_t col_num = pText_ctxt->col_num;
 
     const char* pattern = pPattern_ctxt->pattern;
-    uint16_t base_offset = pattern[k] * col_num;
+    uint32_t base_offset = TEXT_MASK_ROW(pattern[k]);
     uint64_t x = text_mask[base_offset + (j >> 6)] >> (j & 63);
-    uint16_t i = 0;
+    uint32_t i = 0;
 
     if ( x == 0 )
     {
         uint64_t bits = 0;
-        uint16_t col = 0;
+        uint32_t col = 0;
         for ( col = (j >> 6) + 1; col < col_num; ++col )
         {
             if ( (bits = text_mask[base_offset + col]) != 0 )
@@ -1222,12 +1669,12 @@ HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
         i = j + FM_CTZ(x);
     }
 
-    uint16_t max_prefix_score = 0;
+    uint32_t max_prefix_score = 0;
     float max_score = MIN_WEIGHT;
 
     if ( !groups[k] )
     {
-        groups[k] = (HighlightGroup*)calloc(1, sizeof(HighlightGroup));
+        groups[k] = (HighlightGroup*)calloc(1, group_size);
         if ( !groups[k] )
         {
             fprintf(stderr, "Out of memory in evaluateHighlights()!\n");
@@ -1236,18 +1683,35 @@ HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
     }
     else
     {
-        memset(groups[k], 0, sizeof(HighlightGroup));
+        memset(groups[k], 0, group_size);
     }
 
-    HighlightGroup cur_highlights;
-    memset(&cur_highlights, 0, sizeof(HighlightGroup));
+    /* the group of a long pattern is too large to be put on the stack */
+    HighlightGroup cur_group;
+    HighlightGroup* pCur = &cur_group;
+    if ( group_size > sizeof(HighlightGroup) )
+    {
+        uint32_t index = pPattern_ctxt->pattern_len + k;
+        if ( !groups[index] )
+        {
+            groups[index] = (HighlightGroup*)malloc(group_size);
+            if ( !groups[index] )
+            {
+                fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+                return NULL;
+            }
+        }
+        pCur = groups[index];
+    }
+    memset(pCur, 0, group_size);
 
     const char* text = pText_ctxt->text;
-    uint16_t text_len = pText_ctxt->text_len;
-    uint16_t pattern_len = pPattern_ctxt->pattern_len - k;
+    uint32_t text_len = pText_ctxt->text_len;
+    uint32_t pattern_len = pPattern_ctxt->pattern_len - k;
     int64_t* pattern_mask = pPattern_ctxt->pattern_mask;
+    int64_t* long_pattern_mask = pPattern_ctxt->long_pattern_mask;
 
-    uint16_t special = 0;
+    uint32_t special = 0;
     if ( i == 0 )
         special = 5;
 #if defined(_MSC_VER)
@@ -1275,43 +1739,43 @@ HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
         char c = text[i];
         /* c in pattern */
         if ( pattern_mask[(uint8_t)c] != -1 )
-            d = (d << 1) | (pattern_mask[(uint8_t)c] >> k);
+            d = (d << 1) | PATTERN_MASK((uint8_t)c, k);
         /**
          * text = 'xxABC', pattern = 'abc'; text[i] == 'B'
          * text = 'xxABC', pattern = 'abc'; text[i] == 'C'
          * NOT text = 'xxABCd', pattern = 'abc'; text[i] == 'C'
          * 'Cd' is considered as a word
          */
-        /* else if ( isupper(text[i-1]) && pattern_mask[(uint8_t)tolower(c)] != -1 */
+        /* else if ( isupper(text[i-1]) && pattern_mask[(uint8_t)FM_TOLOWER(c)] != -1 */
         /*           && (i+1 == text_len || !islower(text[i+1])) )                 */
-        else if ( pattern_mask[(uint8_t)tolower(c)] != -1 )
-            d = (d << 1) | (pattern_mask[(uint8_t)tolower(c)] >> k);
+        else if ( pattern_mask[(uint8_t)FM_TOLOWER(c)] != -1 )
+            d = (d << 1) | PATTERN_MASK((uint8_t)FM_TOLOWER(c), k);
         else
             d = ~0;
 
         if ( d >= last )
         {
             float score = MIN_WEIGHT;
-            uint16_t n = FM_BIT_LENGTH(~last);
+            uint32_t n = FM_BIT_LENGTH(~last);
             /* e.g., text = '~~abcd~~~~', pattern = 'abcd' */
             if ( n == pattern_len )
             {
                 score = (float)(special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n]);
-                cur_highlights.score = score;
-                cur_highlights.beg = i - n;
-                cur_highlights.end = i;
-                cur_highlights.end_index = 1;
-                cur_highlights.positions[0].col = i - n + 1;
-                cur_highlights.positions[0].len = n;
+                pCur->score = score;
+                pCur->beg = i - n;
+                pCur->end = i;
+                pCur->end_index = 1;
+                pCur->positions[0].col = i - n + 1;
+                pCur->positions[0].len = n;
                 if ( (k == 0 && special == 5) || (k > 0 && special > 0) )
                 {
-                    memcpy(groups[k], &cur_highlights, sizeof(HighlightGroup));
+                    memcpy(groups[k], pCur, group_size);
                     return groups[k];
                 }
             }
             else
             {
-                uint16_t prefix_score = special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n];
+                uint32_t prefix_score = special > 0 ? (n > 1 ? valTable[n+1] : valTable[n]) + special : valTable[n];
                 /**
                  * e.g., text = 'AbcxxAbcyyde', pattern = 'abcde'
                  * prefer matching 'Abcyyde'
@@ -1325,13 +1789,13 @@ HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
                     if ( pGroup && pGroup->end )
                     {
                         score = prefix_score + pGroup->score - 0.3f * (pGroup->beg - i);
-                        cur_highlights.score = score;
-                        cur_highlights.beg = i - n;
-                        cur_highlights.end = pGroup->end;
-                        cur_highlights.positions[0].col = i - n + 1;
-                        cur_highlights.positions[0].len = n;
-                        memcpy(cur_highlights.positions + 1, pGroup->positions, pGroup->end_index * sizeof(HighlightPos));
-                        cur_highlights.end_index = pGroup->end_index + 1;
+                        pCur->score = score;
+                        pCur->beg = i - n;
+                        pCur->end = pGroup->end;
+                        pCur->positions[0].col = i - n + 1;
+                        pCur->positions[0].len = n;
+                        memcpy(pCur->positions + 1, pGroup->positions, pGroup->end_index * sizeof(HighlightPos));
+                        pCur->end_index = pGroup->end_index + 1;
                     }
                     else
                     {
@@ -1342,7 +1806,7 @@ HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
             if ( score > max_score )
             {
                 max_score = score;
-                memcpy(groups[k], &cur_highlights, sizeof(HighlightGroup));
+                memcpy(groups[k], pCur, group_size);
             }
             /* e.g., text = '~_ababc~~~~', pattern = 'abc' */
             special = 0;
@@ -1360,7 +1824,7 @@ HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
             if ( x == 0 )
             {
                 uint64_t bits = 0;
-                uint16_t col = 0;
+                uint32_t col = 0;
                 for ( col = (i >> 6) + 1; col < col_num; ++col )
                 {
                     if ( (bits = text_mask[base_offset + col]) != 0 )
@@ -1402,7 +1866,7 @@ HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
     /* e.g., text = '~~~~abcd', pattern = 'abcd' */
     if ( i == text_len )
     {
-        if ( ~d >> (pattern_len - 1) )
+        if ( pattern_len < 64 && ~d >> (pattern_len - 1) )
         {
             float score = (float)(special > 0 ? (pattern_len > 1 ? valTable[pattern_len + 1] : valTable[pattern_len]) + special
                             : valTable[pattern_len]);
@@ -1421,41 +1885,35 @@ HighlightGroup* evaluateHighlights(TextContext* pText_ctxt,
     return groups[k];
 }
 
-/**
- * return a list of pair [col, length], where `col` is the column number(start
- * from 1, the value must correspond to the byte index of `text`) and `length`
- * is the length of the highlight in bytes.
- * e.g., [ [2,3], [6,2], [10,4], ... ]
- */
-HighlightGroup* getHighlights(const char* text,
-                              uint16_t text_len,
-                              PatternContext* pPattern_ctxt,
-                              uint8_t is_name_only)
+static HighlightGroup* _getHighlights(const char* text,
+                                      uint32_t text_len,
+                                      PatternContext* pPattern_ctxt,
+                                      uint8_t is_name_only)
 {
     if ( !text || !pPattern_ctxt )
         return NULL;
 
-    uint16_t col_num = 0;
+    uint32_t col_num = 0;
     uint64_t* text_mask = NULL;
     const char* pattern = pPattern_ctxt->pattern;
-    uint16_t pattern_len = pPattern_ctxt->pattern_len;
+    uint32_t pattern_len = pPattern_ctxt->pattern_len;
     int64_t* pattern_mask = pPattern_ctxt->pattern_mask;
     char first_char = pattern[0];
     char last_char = pattern[pattern_len - 1];
 
-    /* maximum number of int16_t is (1 << 15) - 1 */
-    if ( text_len >= (1 << 15) )
+    /* the positions of text are int32_t */
+    if ( text_len > 0x7FFFFFFF )
     {
-        text_len = (1 << 15) - 1;
+        text_len = 0x7FFFFFFF;
     }
 
     if ( pattern_len == 1 )
     {
         if ( isupper(first_char) )
         {
-            int16_t first_char_pos = -1;
-            int16_t i;
-            for ( i = 0; i < text_len; ++i )
+            int32_t first_char_pos = -1;
+            int32_t i;
+            for ( i = 0; i < (int32_t)text_len; ++i )
             {
                 if ( text[i] == first_char )
                 {
@@ -1482,11 +1940,11 @@ HighlightGroup* getHighlights(const char* text,
         }
         else
         {
-            int16_t first_char_pos = -1;
-            int16_t i;
-            for ( i = 0; i < text_len; ++i )
+            int32_t first_char_pos = -1;
+            int32_t i;
+            for ( i = 0; i < (int32_t)text_len; ++i )
             {
-                if ( tolower(text[i]) == first_char )
+                if ( FM_TOLOWER(text[i]) == first_char )
                 {
                     if ( first_char_pos == -1 )
                         first_char_pos = i;
@@ -1517,41 +1975,45 @@ HighlightGroup* getHighlights(const char* text,
         }
     }
 
-    int16_t first_char_pos = -1;
-    uint16_t short_text_len = text_len;
+    int32_t first_char_pos = -1;
+    uint32_t short_text_len = text_len;
     if ( pPattern_ctxt->is_lower )
     {
-        int16_t i;
-        for ( i = 0; i < text_len; ++i )
+        int32_t i;
+        for ( i = 0; i < (int32_t)text_len; ++i )
         {
-            if ( tolower(text[i]) == first_char )
+            if ( FM_TOLOWER(text[i]) == first_char )
             {
                 first_char_pos = i;
                 break;
             }
         }
 
-        int16_t last_char_pos = -1;
+        int32_t last_char_pos = -1;
         for ( i = text_len - 1; i >= first_char_pos; --i )
         {
-            if ( tolower(text[i]) == last_char )
+            if ( FM_TOLOWER(text[i]) == last_char )
             {
                 last_char_pos = i;
                 break;
             }
         }
 
+        /* the first or the last character of the pattern is not in the text */
+        if ( first_char_pos < 0 || last_char_pos < first_char_pos )
+            return NULL;
+
         short_text_len = last_char_pos + 1;
         col_num = (short_text_len + 63) >> 6;     /* (short_text_len + 63)/64 */
         if (col_num <= 2)
         {
-            memset(TEXT_MASK, 0, sizeof(TEXT_MASK));
+            memset(TEXT_MASK, 0, pPattern_ctxt->row_count * col_num * sizeof(uint64_t));
             text_mask = TEXT_MASK;
         }
         else
         {
-            /* uint64_t text_mask[256][col_num] */
-            text_mask = (uint64_t*)calloc(col_num << 8, sizeof(uint64_t));
+            /* uint64_t text_mask[row_count][col_num] */
+            text_mask = (uint64_t*)calloc((size_t)pPattern_ctxt->row_count * col_num, sizeof(uint64_t));
             if ( !text_mask )
             {
                 fprintf(stderr, "Out of memory in getHighlights()!\n");
@@ -1561,18 +2023,18 @@ HighlightGroup* getHighlights(const char* text,
         char c;
         for ( i = first_char_pos; i <= last_char_pos; ++i )
         {
-            c = tolower(text[i]);
+            c = FM_TOLOWER(text[i]);
             /* c in pattern */
             if ( pattern_mask[(uint8_t)c] != -1 )
-                text_mask[(uint8_t)c * col_num + (i >> 6)] |= 1ULL << (i & 63);
+                text_mask[TEXT_MASK_ROW(c) + (i >> 6)] |= 1ULL << (i & 63);
         }
     }
     else
     {
         if ( isupper(first_char) )
         {
-            int16_t i;
-            for ( i = 0; i < text_len; ++i )
+            int32_t i;
+            for ( i = 0; i < (int32_t)text_len; ++i )
             {
                 if ( text[i] == first_char )
                 {
@@ -1583,10 +2045,10 @@ HighlightGroup* getHighlights(const char* text,
         }
         else
         {
-            int16_t i;
-            for ( i = 0; i < text_len; ++i )
+            int32_t i;
+            for ( i = 0; i < (int32_t)text_len; ++i )
             {
-                if ( tolower(text[i]) == first_char )
+                if ( FM_TOLOWER(text[i]) == first_char )
                 {
                     first_char_pos = i;
                     break;
@@ -1594,10 +2056,10 @@ HighlightGroup* getHighlights(const char* text,
             }
         }
 
-        int16_t last_char_pos = -1;
+        int32_t last_char_pos = -1;
         if ( isupper(last_char) )
         {
-            int16_t i;
+            int32_t i;
             for ( i = text_len - 1; i >= first_char_pos; --i )
             {
                 if ( text[i] == last_char )
@@ -1609,10 +2071,10 @@ HighlightGroup* getHighlights(const char* text,
         }
         else
         {
-            int16_t i;
+            int32_t i;
             for ( i = text_len - 1; i >= first_char_pos; --i )
             {
-                if ( tolower(text[i]) == last_char )
+                if ( FM_TOLOWER(text[i]) == last_char )
                 {
                     last_char_pos = i;
                     break;
@@ -1620,17 +2082,21 @@ HighlightGroup* getHighlights(const char* text,
             }
         }
 
+        /* the first or the last character of the pattern is not in the text */
+        if ( first_char_pos < 0 || last_char_pos < first_char_pos )
+            return NULL;
+
         short_text_len = last_char_pos + 1;
         col_num = (short_text_len + 63) >> 6;
         if (col_num <= 2)
         {
-            memset(TEXT_MASK, 0, sizeof(TEXT_MASK));
+            memset(TEXT_MASK, 0, pPattern_ctxt->row_count * col_num * sizeof(uint64_t));
             text_mask = TEXT_MASK;
         }
         else
         {
-            /* uint64_t text_mask[256][col_num] */
-            text_mask = (uint64_t*)calloc(col_num << 8, sizeof(uint64_t));
+            /* uint64_t text_mask[row_count][col_num] */
+            text_mask = (uint64_t*)calloc((size_t)pPattern_ctxt->row_count * col_num, sizeof(uint64_t));
             if ( !text_mask )
             {
                 fprintf(stderr, "Out of memory in getHighlights()!\n");
@@ -1639,7 +2105,7 @@ HighlightGroup* getHighlights(const char* text,
         }
 
         char c;
-        int16_t i;
+        int32_t i;
         for ( i = first_char_pos; i <= last_char_pos; ++i )
         {
             c = text[i];
@@ -1647,15 +2113,15 @@ HighlightGroup* getHighlights(const char* text,
             {
                 /* c in pattern */
                 if ( pattern_mask[(uint8_t)c] != -1 )
-                    text_mask[(uint8_t)c * col_num + (i >> 6)] |= 1ULL << (i & 63);
-                if ( pattern_mask[(uint8_t)tolower(c)] != -1 )
-                    text_mask[(uint8_t)tolower(c) * col_num + (i >> 6)] |= 1ULL << (i & 63);
+                    text_mask[TEXT_MASK_ROW(c) + (i >> 6)] |= 1ULL << (i & 63);
+                if ( pattern_mask[(uint8_t)FM_TOLOWER(c)] != -1 )
+                    text_mask[TEXT_MASK_ROW(FM_TOLOWER(c)) + (i >> 6)] |= 1ULL << (i & 63);
             }
             else
             {
                 /* c in pattern */
                 if ( pattern_mask[(uint8_t)c] != -1 )
-                    text_mask[(uint8_t)c * col_num + (i >> 6)] |= 1ULL << (i & 63);
+                    text_mask[TEXT_MASK_ROW(c) + (i >> 6)] |= 1ULL << (i & 63);
             }
         }
     }
@@ -1667,8 +2133,11 @@ HighlightGroup* getHighlights(const char* text,
     text_ctxt.col_num = col_num;
     text_ctxt.offset = first_char_pos;
 
-    /* HighlightGroup* groups[pattern_len] */
-    HighlightGroup** groups = (HighlightGroup**)calloc(pattern_len, sizeof(HighlightGroup*));
+    /**
+     * HighlightGroup* groups[pattern_len << 1],
+     * the second half is used by a long pattern as the scratch groups.
+     */
+    HighlightGroup** groups = (HighlightGroup**)calloc(pattern_len << 1, sizeof(HighlightGroup*));
     if ( !groups )
     {
         fprintf(stderr, "Out of memory in getHighlights()!\n");
@@ -1689,8 +2158,8 @@ HighlightGroup* getHighlights(const char* text,
     {
         free(text_mask);
     }
-    uint16_t i;
-    for ( i = 0; i < pattern_len; ++i )
+    uint32_t i;
+    for ( i = 0; i < pattern_len << 1; ++i )
     {
         if ( groups[i] && groups[i] != pGroup )
             free(groups[i]);
@@ -1700,6 +2169,673 @@ HighlightGroup* getHighlights(const char* text,
     return pGroup;
 }
 
+#define SYMBOL_BUFFER_SIZE 512
+
+typedef struct SymbolText
+{
+    char* symbols;
+    /* offsets[i] is the byte index of symbols[i] in the text, offsets[len] is the length of the text */
+    uint32_t* offsets;
+    uint32_t len;
+    char symbols_buffer[SYMBOL_BUFFER_SIZE];
+    uint32_t offsets_buffer[SYMBOL_BUFFER_SIZE + 1];
+}SymbolText;
+
+/**
+ * map each character of the UTF-8 `text` to a symbol of the pattern, so that
+ * the text can be matched byte by byte.
+ * return -1 if out of memory, 0 if `text` has no non-ASCII character, which means
+ * `text` can not match the pattern, otherwise 1.
+ */
+static int initSymbolText(SymbolText* pSymbol_text, const char* text, uint32_t text_len,
+                          PatternContext* pPattern_ctxt)
+{
+    uint32_t i = 0;
+    while ( i < text_len && (uint8_t)text[i] < 0x80 )
+        ++i;
+
+    if ( i == text_len )
+        return 0;
+
+    if ( text_len <= SYMBOL_BUFFER_SIZE )
+    {
+        pSymbol_text->symbols = pSymbol_text->symbols_buffer;
+        pSymbol_text->offsets = pSymbol_text->offsets_buffer;
+    }
+    else
+    {
+        /* the offsets follow the symbols, aligned to uint32_t */
+        size_t symbols_size = ((size_t)text_len + sizeof(uint32_t) - 1) & ~(sizeof(uint32_t) - 1);
+        pSymbol_text->symbols = (char*)malloc(symbols_size + (text_len + 1) * sizeof(uint32_t));
+        if ( !pSymbol_text->symbols )
+        {
+            fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+            return -1;
+        }
+        pSymbol_text->offsets = (uint32_t*)(pSymbol_text->symbols + symbols_size);
+    }
+
+    char* symbols = pSymbol_text->symbols;
+    uint32_t* offsets = pSymbol_text->offsets;
+    uint32_t n = 0;
+    for ( i = 0; i < text_len; ++n )
+    {
+        offsets[n] = i;
+        if ( (uint8_t)text[i] < 0x80 )
+        {
+            symbols[n] = text[i++];
+        }
+        else
+        {
+            uint32_t code_point;
+            i += (uint32_t)decodeUtf8(text + i, text_len - i, &code_point);
+            uint8_t symbol = getSymbol(pPattern_ctxt, code_point);
+            /* a lowercase character of the pattern also matches its uppercase */
+            if ( symbol == UNKNOWN_SYMBOL )
+                symbol = getSymbol(pPattern_ctxt, toLowerCodePoint(code_point));
+            symbols[n] = (char)symbol;
+        }
+    }
+    offsets[n] = text_len;
+    pSymbol_text->len = n;
+
+    return 1;
+}
+
+static void freeSymbolText(SymbolText* pSymbol_text)
+{
+    if ( pSymbol_text->symbols != pSymbol_text->symbols_buffer )
+        free(pSymbol_text->symbols);
+}
+
+/* about what valTable gives each character of a contiguous match */
+#define EXACT_CHAR_SCORE 6.0f
+
+/**
+ * return 1 if the text at position i begins a word, e.g., "b" of "a_b" or "B" of "aBc".
+ */
+static int isWordStart(const char* text, uint32_t i)
+{
+    if ( i == 0 || !isalnum((uint8_t)text[i-1]) )
+        return 1;
+
+    return isupper((uint8_t)text[i]) && !isupper((uint8_t)text[i-1]);
+}
+
+/* return 1 if the exact pattern occurs at `text`, whose first and last bytes have been compared */
+static int isExactAt(const char* text, PatternContext* pPattern_ctxt)
+{
+    const char* pattern = pPattern_ctxt->exact_pattern;
+    const char* upper = pPattern_ctxt->exact_upper;
+    uint32_t last = pPattern_ctxt->exact_pattern_len - 1;
+    uint32_t j = 1;
+    while ( j < last && (text[j] == pattern[j] || text[j] == upper[j]) )
+        ++j;
+
+    return j >= last;
+}
+
+/**
+ * return the position of the first occurrence of the exact pattern in `text` at or after `start`,
+ * or -1 if there is none. a lowercase ASCII character of the pattern also matches its uppercase,
+ * the other bytes must be the same.
+ * like the SIMD implementations of memmem(), the first and the last bytes of the pattern are compared
+ * with 16 positions at a time, only the positions where both of them match are compared byte by byte.
+ */
+static int64_t findExact(const char* text, uint32_t text_len, uint32_t start, PatternContext* pPattern_ctxt)
+{
+    const char* pattern = pPattern_ctxt->exact_pattern;
+    const char* upper = pPattern_ctxt->exact_upper;
+    uint32_t last = pPattern_ctxt->exact_pattern_len - 1;
+    uint32_t i = start;
+
+#if defined(FM_SSE2)
+    __m128i first_a = _mm_set1_epi8(pattern[0]);
+    __m128i first_b = _mm_set1_epi8(upper[0]);
+    __m128i last_a = _mm_set1_epi8(pattern[last]);
+    __m128i last_b = _mm_set1_epi8(upper[last]);
+    for ( ; i + last + 16 <= text_len; i += 16 )
+    {
+        __m128i x = _mm_loadu_si128((const __m128i*)(text + i));
+        __m128i y = _mm_loadu_si128((const __m128i*)(text + i + last));
+        uint32_t mask = (uint32_t)_mm_movemask_epi8(
+                _mm_and_si128(_mm_or_si128(_mm_cmpeq_epi8(x, first_a), _mm_cmpeq_epi8(x, first_b)),
+                              _mm_or_si128(_mm_cmpeq_epi8(y, last_a), _mm_cmpeq_epi8(y, last_b))));
+        while ( mask != 0 )
+        {
+            uint32_t k = i + (uint32_t)FM_CTZ(mask);
+            if ( isExactAt(text + k, pPattern_ctxt) )
+                return k;
+            mask &= mask - 1;
+        }
+    }
+#endif
+
+    for ( ; i + last < text_len; ++i )
+    {
+        if ( (text[i] == pattern[0] || text[i] == upper[0])
+             && (text[i + last] == pattern[last] || text[i + last] == upper[last])
+             && isExactAt(text + i, pPattern_ctxt) )
+            return i;
+    }
+
+    return -1;
+}
+
+/**
+ * return the position of the occurrence of the exact pattern in `text` that is scored,
+ * or -1 if there is none. an occurrence at the start of a word is preferred, the first one
+ * if `is_name_only` is not 0, otherwise the last one, which is nearer the basename of a path.
+ */
+static int64_t getExactPos(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt,
+                           uint8_t is_name_only, int* pIs_word_start)
+{
+    if ( text_len > 0x7FFFFFFF )
+    {
+        text_len = 0x7FFFFFFF;
+    }
+
+    int64_t pos = findExact(text, text_len, 0, pPattern_ctxt);
+    if ( pos < 0 )
+        return -1;
+
+    int64_t result = pos;
+    int is_word_start = isWordStart(text, (uint32_t)pos);
+    while ( !(is_name_only && is_word_start) )
+    {
+        pos = findExact(text, text_len, (uint32_t)pos + 1, pPattern_ctxt);
+        if ( pos < 0 )
+            break;
+
+        if ( isWordStart(text, (uint32_t)pos) )
+        {
+            result = pos;
+            is_word_start = 1;
+        }
+        else if ( !is_word_start && !is_name_only )
+        {
+            result = pos;
+        }
+    }
+
+    *pIs_word_start = is_word_start;
+
+    return result;
+}
+
+/**
+ * the weight of the exact pattern, it is on the same scale as that of a fuzzy pattern of the same length.
+ */
+static float getExactWeight(const char* text, uint32_t text_len,
+                            PatternContext* pPattern_ctxt,
+                            uint8_t is_name_only)
+{
+    int is_word_start = 0;
+    int64_t pos = getExactPos(text, text_len, pPattern_ctxt, is_name_only, &is_word_start);
+    if ( pos < 0 )
+        return MIN_WEIGHT;
+
+    uint32_t pattern_len = pPattern_ctxt->exact_pattern_len;
+    float score = EXACT_CHAR_SCORE * pattern_len + (is_word_start ? 3 : 0);
+    if ( is_name_only )
+        return score + 1.0f/(pos + 1) + (float)pattern_len/text_len;
+    else
+        return score + (float)(pattern_len<<1)/text_len + (float)pattern_len/(text_len - pos);
+}
+
+static HighlightGroup* getExactHighlights(const char* text, uint32_t text_len,
+                                          PatternContext* pPattern_ctxt,
+                                          uint8_t is_name_only)
+{
+    int is_word_start = 0;
+    int64_t pos = getExactPos(text, text_len, pPattern_ctxt, is_name_only, &is_word_start);
+    if ( pos < 0 )
+        return NULL;
+
+    HighlightGroup* pGroup = (HighlightGroup*)malloc(sizeof(HighlightGroup));
+    if ( !pGroup )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return NULL;
+    }
+
+    pGroup->score = 0;
+    pGroup->beg = (uint32_t)pos;
+    pGroup->end = (uint32_t)pos + pPattern_ctxt->exact_pattern_len;
+    pGroup->end_index = 1;
+    pGroup->positions[0].col = pGroup->beg + 1;
+    pGroup->positions[0].len = pPattern_ctxt->exact_pattern_len;
+
+    return pGroup;
+}
+
+float getWeight(const char* text, uint32_t text_len,
+                PatternContext* pPattern_ctxt,
+                uint8_t is_name_only)
+{
+    if ( !text || !pPattern_ctxt )
+        return MIN_WEIGHT;
+
+    if ( pPattern_ctxt->is_exact )
+        return getExactWeight(text, text_len, pPattern_ctxt, is_name_only);
+
+    if ( !prefilter(text, text_len, pPattern_ctxt) )
+        return MIN_WEIGHT;
+
+    if ( !pPattern_ctxt->is_utf8 )
+        return _getWeight(text, text_len, pPattern_ctxt, is_name_only);
+
+    SymbolText symbol_text;
+    if ( initSymbolText(&symbol_text, text, text_len, pPattern_ctxt) <= 0 )
+        return MIN_WEIGHT;
+
+    float weight = _getWeight(symbol_text.symbols, symbol_text.len, pPattern_ctxt, is_name_only);
+    freeSymbolText(&symbol_text);
+
+    return weight;
+}
+
+/* whether getWeightBound() can be used, i.e., the pattern has 2 ~ 63 ASCII characters and is matched fuzzily */
+uint32_t isWeightBounded(PatternContext* pPattern_ctxt)
+{
+    return !pPattern_ctxt->is_exact && !pPattern_ctxt->is_utf8
+        && pPattern_ctxt->pattern_len >= 2 && pPattern_ctxt->pattern_len < 64
+        && pPattern_ctxt->actual_pattern_len == pPattern_ctxt->pattern_len;
+}
+
+/**
+ * return the least that the score of evaluate() or evaluate_nameOnly() is below 6 * pattern_len, a run is
+ * some characters matched in a row, the longest run of the pattern in the text is `longest_run`,
+ * `longest_word_run` if it starts at a word boundary, and `longest_path_run` if it can start with
+ * `special` 5, which at most `path_run_count` runs can.
+ * a run of n characters scores valTable[n+1] + special == 6n - 5 + special, or valTable[n] <= 6n - 5
+ * if `special` is 0, which it is unless the run starts at a word boundary, and it is at most 3 otherwise.
+ */
+static uint32_t getRunPenalty(uint32_t pattern_len, uint32_t longest_run, uint32_t longest_word_run,
+                              uint32_t longest_path_run, uint32_t path_run_count)
+{
+    uint32_t min_penalty = 0xFFFFFFFF;
+    uint32_t f = 0;     /* the number of the runs whose `special` is 5 */
+    for ( ; f <= (longest_path_run > 0 ? path_run_count : 0); ++f )
+    {
+        uint32_t t = 0; /* the number of the runs whose `special` is 0 */
+        for ( ; ; ++t )
+        {
+            uint32_t covered = f * longest_path_run + t * longest_run;
+            uint32_t rest = covered >= pattern_len ? 0 : pattern_len - covered;
+            if ( rest == 0 || longest_word_run > 0 )
+            {
+                uint32_t s = rest == 0 ? 0 : (rest + longest_word_run - 1) / longest_word_run;
+                uint32_t penalty = 5 * t + 2 * s;
+                if ( penalty < min_penalty )
+                    min_penalty = penalty;
+            }
+
+            if ( rest == 0 )
+                break;
+        }
+    }
+
+    return min_penalty;
+}
+
+/**
+ * return an upper bound of getWeight(), which is much cheaper to compute, MIN_WEIGHT if and only if
+ * getWeight() returns MIN_WEIGHT. it is only valid if isWeightBounded() returns nonzero.
+ * the score is bounded by how long the runs of the pattern in the text can be, see getRunPenalty().
+ */
+float getWeightBound(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt, uint8_t is_name_only)
+{
+    const char* pattern = pPattern_ctxt->pattern;
+    uint32_t pattern_len = pPattern_ctxt->pattern_len;
+    int64_t* pattern_mask = pPattern_ctxt->pattern_mask;
+    uint64_t pattern_bits = (1ULL << pattern_len) - 1;
+
+    if ( !prefilter(text, text_len, pPattern_ctxt) )
+        return MIN_WEIGHT;
+
+    /* the positions of text are int32_t */
+    if ( text_len > 0x7FFFFFFF )
+    {
+        text_len = 0x7FFFFFFF;
+    }
+
+    /**
+     * bit j of runs[n-1] is set if pattern[j-n+1..j] matches the text ending at the current character,
+     * regardless of case, runs[0 ~ depth-1] are not 0. word_runs[n-1] and path_runs[n-1] are the same
+     * except that the runs start at a word boundary, or where `special` of evaluate() can be 5.
+     */
+    uint64_t runs[64];
+    uint64_t word_runs[64];
+    uint64_t path_runs[64];
+    uint32_t depth = 0;
+    uint32_t longest_run = 0;
+    uint32_t longest_word_run = 0;
+    uint32_t longest_path_run = 0;
+    /* the first run of the path and the runs that start before the 5th character */
+    uint32_t path_run_count = 1;
+    uint32_t j = 0;
+    int32_t first_pos = -1;     /* the first and the last character that can match pattern[0] */
+    int32_t last_pos = -1;
+    /**
+     * whether pattern[0] can match a character at a multiple of 32, `1 >> beg` of _getWeight()
+     * is 1 if beg is 0, and it may be 1 as well if beg is another multiple of 32 on some platforms.
+     */
+    int32_t aligned = 0;
+    int32_t i;
+    for ( i = 0; i < (int32_t)text_len; ++i )
+    {
+        char c = text[i];
+        uint8_t lower = (uint8_t)FM_TOLOWER(c);
+        uint64_t mask = ~(uint64_t)(pattern_mask[lower] & pattern_mask[(uint8_t)toupper(lower)]) & pattern_bits;
+        if ( mask == 0 )
+        {
+            depth = 0;
+            continue;
+        }
+
+        uint32_t n = depth;
+        for ( ; n > 0; --n )
+        {
+            runs[n] = (runs[n-1] << 1) & mask;
+            word_runs[n] = (word_runs[n-1] << 1) & mask;
+            path_runs[n] = (path_runs[n-1] << 1) & mask;
+            if ( word_runs[n] != 0 && n >= longest_word_run )
+                longest_word_run = n + 1;
+            if ( path_runs[n] != 0 && n >= longest_path_run )
+                longest_path_run = n + 1;
+        }
+        runs[0] = mask;
+
+        /* where `special` of evaluate() and evaluate_nameOnly() can be greater than 0 */
+        int32_t is_word_start = i == 0 || !isalnum(text[i-1]) || isupper(c);
+        word_runs[0] = is_word_start ? mask : 0;
+        path_runs[0] = !is_name_only && ((is_word_start && i < 5) || text[i-1] == '/' || text[i-1] == '\\')
+                       ? mask : 0;
+        if ( word_runs[0] != 0 && longest_word_run == 0 )
+            longest_word_run = 1;
+        if ( path_runs[0] != 0 && longest_path_run == 0 )
+            longest_path_run = 1;
+        if ( path_runs[0] != 0 && i < 5 )
+            ++path_run_count;
+
+        n = depth + 1;
+        while ( runs[n-1] == 0 )
+            --n;
+        depth = n;
+        if ( depth > longest_run )
+            longest_run = depth;
+
+        if ( mask & 1 )
+        {
+            if ( first_pos < 0 )
+                first_pos = i;
+            last_pos = i;
+            aligned |= (i & 31) == 0;
+        }
+
+        /* the same as how _getWeight() checks whether the text matches */
+        if ( j < pattern_len && (c == pattern[j] || (islower(pattern[j]) && c == toupper(pattern[j]))) )
+            ++j;
+    }
+
+    if ( j < pattern_len )
+        return MIN_WEIGHT;
+
+    uint32_t score = 6 * pattern_len - getRunPenalty(pattern_len, longest_run, longest_word_run,
+                                                     longest_path_run, path_run_count);
+    if ( is_name_only )
+    {
+        /* beg >= first_pos, end >= beg + pattern_len */
+        return (float)score + aligned + 1.0f/(2 * first_pos + pattern_len) + 1.0f/text_len;
+    }
+    else
+    {
+        /* beg <= last_pos, beg <= text_len - pattern_len */
+        uint32_t max_beg = (uint32_t)last_pos < text_len - pattern_len ? (uint32_t)last_pos : text_len - pattern_len;
+        return (float)score + (float)(pattern_len<<1)/text_len + (float)pattern_len/(text_len - max_beg);
+    }
+}
+
+/* the pattern, plus the empty prefix, must fit in the bits of a uint64_t, see typoSearch() */
+#define MAX_TYPO_PATTERN_LEN 62
+
+/**
+ * return the number of typos a text may have to match the pattern, 0 if typos are not tolerated,
+ * e.g., "lenaerf" matches "leaderf" with 2 typos.
+ */
+static uint32_t getMaxTypos(PatternContext* pPattern_ctxt)
+{
+    uint32_t pattern_len = pPattern_ctxt->pattern_len;
+    if ( pattern_len < 4 || pattern_len > MAX_TYPO_PATTERN_LEN )
+        return 0;
+
+    uint32_t max_typos = (pattern_len + 3) / 5;
+
+    return max_typos < MAX_TYPOS ? max_typos : MAX_TYPOS;
+}
+
+/**
+ * return the mask of the symbol `c` used by typoSearch(), bit i + 1 is set if `c` matches pattern[i],
+ * a lowercase character of the pattern also matches its uppercase.
+ */
+static uint64_t getTypoMask(PatternContext* pPattern_ctxt, uint8_t c)
+{
+    int64_t mask = pPattern_ctxt->pattern_mask[c];
+    if ( isupper(c) )
+        mask &= pPattern_ctxt->pattern_mask[(uint8_t)tolower(c)];
+
+    return (~(uint64_t)mask & ((1ULL << pPattern_ctxt->pattern_len) - 1)) << 1;
+}
+
+/* reverse the order of bits 1 ~ n of `x`, bit 0 is cleared */
+static uint64_t reverseTypoMask(uint64_t x, uint32_t n)
+{
+    uint64_t r = 0;
+    uint32_t i;
+    for ( i = 1; i <= n; ++i )
+    {
+        if ( x & (1ULL << i) )
+            r |= 1ULL << (n + 1 - i);
+    }
+
+    return r;
+}
+
+/**
+ * the bit-parallel approximate matching of Wu and Manber, an extension of the shift-and algorithm.
+ * bit i + 1 of state[d] is set if pattern[0..i] matches the text ending at the current character
+ * with at most d typos(insertions, deletions or substitutions), bit 0 stands for the empty prefix.
+ *
+ * if `is_reversed` is 0, return the minimum number of typos not more than `max_typos` with which
+ * the pattern matches a substring of `text`, and *pPos is the end of the first such substring.
+ * otherwise, the reversed pattern is matched against `text` read backwards from its end, the substring
+ * must end at the end of `text`, and *pPos is the start of the shortest such substring.
+ *
+ * return -1 if the pattern does not match with at most `max_typos` typos.
+ */
+static int32_t typoSearch(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt,
+                          uint32_t max_typos, int is_reversed, uint32_t* pPos)
+{
+    uint32_t pattern_len = pPattern_ctxt->pattern_len;
+    uint64_t accept = 1ULL << pattern_len;
+    /* the substring can start anywhere unless it is anchored at the end of `text` */
+    uint64_t start = is_reversed ? 0 : 1;
+    uint64_t state[MAX_TYPOS + 1];
+    uint32_t d;
+    for ( d = 0; d <= max_typos; ++d )
+    {
+        /* the first d characters of the pattern can be deleted */
+        state[d] = (1ULL << (d + 1)) - 1;
+    }
+
+    int32_t typos = -1;
+    uint32_t i;
+    for ( i = 0; i < text_len; ++i )
+    {
+        uint8_t c = (uint8_t)(is_reversed ? text[text_len - 1 - i] : text[i]);
+        uint64_t mask = getTypoMask(pPattern_ctxt, c);
+        if ( is_reversed )
+        {
+            mask = reverseTypoMask(mask, pattern_len);
+        }
+
+        uint64_t prev = state[0];
+        state[0] = ((state[0] << 1) & mask) | start;
+        for ( d = 1; d <= max_typos; ++d )
+        {
+            uint64_t old = state[d];
+            /* match, substitution, insertion and deletion */
+            state[d] = ((old << 1) & mask) | (prev << 1) | prev | (state[d-1] << 1) | start;
+            prev = old;
+        }
+
+        for ( d = 0; d <= max_typos; ++d )
+        {
+            if ( state[d] & accept )
+            {
+                typos = (int32_t)d;
+                *pPos = is_reversed ? text_len - 1 - i : i;
+                break;
+            }
+        }
+
+        if ( typos == 0 || (typos > 0 && is_reversed) )
+            break;
+        else if ( typos > 0 )
+            max_typos = (uint32_t)typos - 1;
+    }
+
+    return typos;
+}
+
+static float _getTypoWeight(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt)
+{
+    uint32_t max_typos = getMaxTypos(pPattern_ctxt);
+    if ( max_typos == 0 )
+        return MIN_WEIGHT;
+
+    uint32_t end = 0;
+    int32_t typos = typoSearch(text, text_len, pPattern_ctxt, max_typos, 0, &end);
+    if ( typos < 0 )
+        return MIN_WEIGHT;
+
+    /* fewer typos first, then the earlier and the shorter the better */
+    return TYPO_WEIGHT - typos - 1.0f + 0.5f/(end + 1) + 0.5f/text_len;
+}
+
+static HighlightGroup* _getTypoHighlights(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt)
+{
+    uint32_t max_typos = getMaxTypos(pPattern_ctxt);
+    if ( max_typos == 0 )
+        return NULL;
+
+    uint32_t end = 0;
+    int32_t typos = typoSearch(text, text_len, pPattern_ctxt, max_typos, 0, &end);
+    if ( typos < 0 )
+        return NULL;
+
+    uint32_t beg = 0;
+    if ( typoSearch(text, end + 1, pPattern_ctxt, (uint32_t)typos, 1, &beg) < 0 )
+        return NULL;
+
+    HighlightGroup* pGroup = (HighlightGroup*)malloc(sizeof(HighlightGroup));
+    if ( !pGroup )
+    {
+        fprintf(stderr, "Out of memory at %s:%d\n", __FILE__, __LINE__);
+        return NULL;
+    }
+
+    pGroup->score = 0;
+    pGroup->beg = beg;
+    pGroup->end = end + 1;
+    pGroup->end_index = 1;
+    pGroup->positions[0].col = beg + 1;
+    pGroup->positions[0].len = end + 1 - beg;
+
+    return pGroup;
+}
+
+/**
+ * the weight of a text that does not match the pattern, but matches it with a few typos,
+ * e.g., "leaderf" matches "lenaerf". return MIN_WEIGHT if it does not match even so.
+ */
+float getTypoWeight(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt)
+{
+    if ( !text || !pPattern_ctxt )
+        return MIN_WEIGHT;
+
+    if ( !pPattern_ctxt->is_utf8 )
+        return _getTypoWeight(text, text_len, pPattern_ctxt);
+
+    SymbolText symbol_text;
+    if ( initSymbolText(&symbol_text, text, text_len, pPattern_ctxt) <= 0 )
+        return MIN_WEIGHT;
+
+    float weight = _getTypoWeight(symbol_text.symbols, symbol_text.len, pPattern_ctxt);
+    freeSymbolText(&symbol_text);
+
+    return weight;
+}
+
+/**
+ * return a list of pair [col, length], where `col` is the column number(start
+ * from 1, the value must correspond to the byte index of `text`) and `length`
+ * is the length of the highlight in bytes.
+ * e.g., [ [2,3], [6,2], [10,4], ... ]
+ * if `text` only matches the pattern with typos, the substring that matches is highlighted.
+ */
+HighlightGroup* getHighlights(const char* text,
+                              uint32_t text_len,
+                              PatternContext* pPattern_ctxt,
+                              uint8_t is_name_only)
+{
+    if ( !text || !pPattern_ctxt )
+        return NULL;
+
+    /* a text is only highlighted as a match with typos if it does not match otherwise */
+    HighlightGroup* pGroup = NULL;
+    if ( pPattern_ctxt->is_exact )
+    {
+        pGroup = getExactHighlights(text, text_len, pPattern_ctxt, is_name_only);
+        if ( pGroup || getMaxTypos(pPattern_ctxt) == 0 )
+            return pGroup;
+    }
+
+    if ( !pPattern_ctxt->is_utf8 )
+    {
+        if ( !pPattern_ctxt->is_exact )
+            pGroup = _getHighlights(text, text_len, pPattern_ctxt, is_name_only);
+        return pGroup ? pGroup : _getTypoHighlights(text, text_len, pPattern_ctxt);
+    }
+
+    SymbolText symbol_text;
+    if ( initSymbolText(&symbol_text, text, text_len, pPattern_ctxt) <= 0 )
+        return NULL;
+
+    if ( !pPattern_ctxt->is_exact )
+        pGroup = _getHighlights(symbol_text.symbols, symbol_text.len, pPattern_ctxt, is_name_only);
+    if ( !pGroup )
+        pGroup = _getTypoHighlights(symbol_text.symbols, symbol_text.len, pPattern_ctxt);
+    if ( pGroup )
+    {
+        /* convert the positions of symbols to the positions of bytes */
+        uint32_t* offsets = symbol_text.offsets;
+        uint32_t i;
+        for ( i = 0; i < pGroup->end_index; ++i )
+        {
+            uint32_t col = pGroup->positions[i].col - 1;
+            pGroup->positions[i].len = offsets[col + pGroup->positions[i].len] - offsets[col];
+            pGroup->positions[i].col = offsets[col] + 1;
+        }
+        pGroup->beg = offsets[pGroup->beg];
+        pGroup->end = offsets[pGroup->end];
+    }
+    freeSymbolText(&symbol_text);
+
+    return pGroup;
+}
+
 /**
  * e.g., /usr/src/example.tar.gz
  * `dirname` is "/usr/src"
@@ -1886,11 +3022,12 @@ static PyObject* fuzzyMatchC_initPattern(PyObject* self, PyObject* args)
 {
     const char* pattern;
     Py_ssize_t pattern_len;
+    uint8_t is_exact = 0;
 
-    if ( !PyArg_ParseTuple(args, "s#:initPattern", &pattern, &pattern_len) )
+    if ( !PyArg_ParseTuple(args, "s#|b:initPattern", &pattern, &pattern_len, &is_exact) )
         return NULL;
 
-    PatternContext* pCtxt = initPattern(pattern, (uint16_t)pattern_len);
+    PatternContext* pCtxt = initPattern(pattern, (uint32_t)pattern_len, is_exact);
 
     return PyCapsule_New(pCtxt, NULL, delPatternContext);
 }
@@ -1911,7 +3048,7 @@ static PyObject* fuzzyMatchC_getWeight(PyObject* self, PyObject* args, PyObject*
     if ( !pCtxt )
         return NULL;
 
-    return Py_BuildValue("f", getWeight(text, (uint16_t)text_len, pCtxt, is_name_only));
+    return Py_BuildValue("f", getWeight(text, (uint32_t)text_len, pCtxt, is_name_only));
 }
 
 static PyObject* fuzzyMatchC_getHighlights(PyObject* self, PyObject* args, PyObject* kwargs)
@@ -1930,15 +3067,16 @@ static PyObject* fuzzyMatchC_getHighlights(PyObject* self, PyObject* args, PyObj
     if ( !pCtxt )
         return NULL;
 
-    HighlightGroup* pGroup = getHighlights(text, (uint16_t)text_len, pCtxt, is_name_only);
+    HighlightGroup* pGroup = getHighlights(text, (uint32_t)text_len, pCtxt, is_name_only);
+    /* `text` does not match the pattern */
     if ( !pGroup )
-        return NULL;
+        return PyList_New(0);
 
     PyObject* list = PyList_New(pGroup->end_index);
-    uint16_t i;
+    uint32_t i;
     for ( i = 0; i < pGroup->end_index; ++i )
     {
-        PyList_SetItem(list, i, Py_BuildValue("[H,H]", pGroup->positions[i].col, pGroup->positions[i].len));
+        PyList_SetItem(list, i, Py_BuildValue("[I,I]", pGroup->positions[i].col, pGroup->positions[i].len));
     }
     free(pGroup);
 
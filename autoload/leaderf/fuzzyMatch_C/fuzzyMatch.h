@@ -21,39 +21,93 @@
 
 #define MIN_WEIGHT (-1000000.0f)
 
+/**
+ * the non-ASCII characters of a UTF-8 pattern are mapped to the symbols 0x81 ~ 0xFF,
+ * the other non-ASCII characters are mapped to UNKNOWN_SYMBOL.
+ */
+#define UNKNOWN_SYMBOL 0x80
+#define MAX_SYMBOL_COUNT 127
+
+/**
+ * only the first MAX_PATTERN_LEN characters of the pattern are used to compute
+ * the weight and highlights, the rest are only required to be matched.
+ */
+#define MAX_PATTERN_LEN 512
+
+/**
+ * the weight of a text that only matches the pattern with typos is in (TYPO_WEIGHT - MAX_TYPOS - 1, TYPO_WEIGHT],
+ * which is lower than the weight of any text that matches the pattern, see getTypoWeight().
+ */
+#define TYPO_WEIGHT (-1000.0f)
+#define MAX_TYPOS 3
+
 typedef struct PatternContext
 {
     const char* pattern;
     int64_t pattern_mask[256];
-    uint16_t pattern_len;
-    uint16_t actual_pattern_len;
+    /**
+     * int64_t long_pattern_mask[256][word_num], it is NULL unless the pattern is
+     * longer than 63 characters, in which case pattern_mask[c] is only used to
+     * check whether c is in the pattern.
+     */
+    int64_t* long_pattern_mask;
+    uint32_t word_num;
+    /* the row of the text mask of each character in the pattern */
+    uint8_t mask_row[256];
+    uint32_t row_count;
+    uint32_t pattern_len;
+    uint32_t actual_pattern_len;
+    /* the bits of the characters in the pattern, see getTextSignature() */
+    uint64_t signature;
     uint8_t is_lower;
+    uint8_t is_utf8;
+    uint8_t symbol_count;
+    /* code_points[i] is mapped to the symbol UNKNOWN_SYMBOL + 1 + i */
+    uint32_t code_points[MAX_SYMBOL_COUNT];
+    /**
+     * if is_exact is not 0, the pattern only matches a text that contains it, see getExactWeight().
+     * exact_pattern is the pattern in bytes, exact_upper[i] is the uppercase of exact_pattern[i]
+     * if it is a lowercase ASCII character, otherwise exact_pattern[i].
+     */
+    uint8_t is_exact;
+    const char* exact_pattern;
+    const char* exact_upper;
+    uint32_t exact_pattern_len;
 }PatternContext;
 
 typedef struct HighlightPos
 {
-    uint16_t col;
-    uint16_t len;
+    uint32_t col;
+    uint32_t len;
 }HighlightPos;
 
 typedef struct HighlightGroup
 {
     float score;
-    uint16_t beg;
-    uint16_t end;
+    uint32_t beg;
+    uint32_t end;
+    uint32_t end_index;
+    /* the group of a pattern longer than 64 characters is allocated with more positions */
     HighlightPos positions[64];
-    uint16_t end_index;
 }HighlightGroup;
 
 #ifdef __cplusplus
 extern "C" {
 #endif
 
-PatternContext* initPattern(const char* pattern, uint16_t pattern_len);
+PatternContext* initPattern(const char* pattern, uint32_t pattern_len, uint8_t is_exact);
+
+float getWeight(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt, uint8_t is_name_only);
+
+HighlightGroup* getHighlights(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt, uint8_t is_name_only);
+
+float getTypoWeight(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt);
+
+uint32_t isWeightBounded(PatternContext* pPattern_ctxt);
 
-float getWeight(const char* text, uint16_t text_len, PatternContext* pPattern_ctxt, uint8_t is_name_only);
+float getWeightBound(const char* text, uint32_t text_len, PatternContext* pPattern_ctxt, uint8_t is_name_only);
 
-HighlightGroup* getHighlights(const char* text, uint16_t text_len, PatternContext* pPattern_ctxt, uint8_t is_name_only);
+uint64_t getTextSignature(const char* text, uint32_t text_len);
 
 uint32_t getPathWeight(const char* filename,
                        const char* suffix,
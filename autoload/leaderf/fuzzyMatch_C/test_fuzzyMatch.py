@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+regression tests of the C extension, run it after install.sh:
+    python test_fuzzyMatch.py [directory of the built extension]
+"""
+import os
+import subprocess
+import sys
+import unittest
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+    BUILD_DIR = os.path.abspath(sys.argv.pop(1))
+else:
+    BUILD_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "python")
+sys.path.insert(0, BUILD_DIR)
+
+try:
+    import fuzzyMatchC
+except ImportError:
+    raise unittest.SkipTest("the C extension is not built")
+
+
+def runIsolated(code):
+    """
+    run `code` in another process, so that a crash fails the test instead of the runner.
+    return the exit code and the output.
+    """
+    code = "import sys; sys.path.insert(0, %r)\n%s" % (BUILD_DIR, code)
+    proc = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = proc.communicate()[0]
+    return proc.returncode, output.decode("utf-8", "replace")
+
+
+class TestHighlights(unittest.TestCase):
+    def test_missing_first_or_last_char(self):
+        code = (
+            "import fuzzyMatchC\n"
+            "for is_name_only in (True, False):\n"
+            "    for pattern in ('Cz', 'zA', 'Az', 'Ca'):\n"
+            "        pattern = fuzzyMatchC.initPattern(pattern)\n"
+            "        print(fuzzyMatchC.getHighlights(text='ADya- Yab/YeYeeDD.Y.A', pattern=pattern,\n"
+            "                                        is_name_only=is_name_only))\n"
+        )
+        returncode, output = runIsolated(code)
+        self.assertEqual(returncode, 0, output)
+        self.assertEqual(output.split(), ["[]"] * 8)
+
+    def test_match(self):
+        pattern = fuzzyMatchC.initPattern("yab")
+        self.assertEqual(fuzzyMatchC.getHighlights(text="ADya- Yab/YeYeeDD.Y.A", pattern=pattern,
+                                                   is_name_only=True), [[7, 3]])
+
+
+if __name__ == "__main__":
+    unittest.main()
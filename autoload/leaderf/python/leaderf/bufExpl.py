@@ -177,6 +177,16 @@ class BufExplManager(Manager):
             start_pos = line.find(' "')
             return line[start_pos+2 : -1]
 
+    def _getBonus(self, lines):
+        # the buffers are listed by recency
+        return self._getRecencyBonus(lines)
+
+    def _getDigestSpec(self, mode):
+        if mode == 0:
+            return {"prefix_len": self._getExplorer().getPrefixLength()}
+        else:   # the name of the buffer is not in the line
+            return None
+
     def _getDigestStartPos(self, line, mode):
         """
         return the start position of the digest returned by _getDigest()
@@ -280,6 +290,7 @@ class BufExplManager(Manager):
             lfCmd("setlocal modifiable")
         if len(self._content) > 0:
             self._content.remove(line)
+            self._corpus = None
             self._getInstance().setStlTotal(len(self._content)//self._getUnit())
             self._getInstance().setStlResultsCount(len(self._content)//self._getUnit())
         buf_number = int(re.sub(r"^.*?(\d+).*$", r"\1", line))
@@ -57,6 +57,7 @@ class LfCli(object):
         self._cursor_pos = 0
         self._start_time = datetime.now()
         self._idle = False
+        self._is_reading_input = False
         self._blinkon = True
         self._key_dict = lfEval("g:Lf_KeyDict")
         self._refine = False
@@ -65,6 +66,11 @@ class LfCli(object):
         self._supports_nameonly = False
         self._supports_refine = False
         self._is_and_mode = False
+        self._is_exact = False
+        self._exact_match_length = int(lfEval("get(g:, 'Lf_ExactMatchLength', 30)"))
+        # only the C extension can match a pattern as a substring, see _isExact()
+        self._supports_exact = (lfEval("get(g:, 'Lf_fuzzyEngine_C', 0)") == '1'
+                                or lfEval("get(g:, 'Lf_fuzzyMatch_C', 0)") == '1')
         self._running_status = 0
         self._input_buf_namespace = None
         self._setDefaultMode()
@@ -396,6 +402,7 @@ class LfCli(object):
                 self._pattern = tuple([i * pattern_dict[i] for i in pattern_dict])
                 if self._pattern == ('',):
                     self._pattern = None
+                self._is_exact = False
             else:
                 self._is_and_mode = False
 
@@ -412,16 +419,45 @@ class LfCli(object):
                                          ''.join(self._cmdline[idx+1:]))
                     if self._pattern == ('', ''):
                         self._pattern = None
+                    self._is_exact = False
                 else:
                     self._refine = False
+                    pattern = ''.join(self._cmdline)
+                    self._is_exact = self._isExact(pattern)
+                    pattern = self._stripQuote(pattern)
                     if case_insensitive:
-                        self._pattern = ''.join(self._cmdline).lower()
+                        self._pattern = pattern.lower()
                     else:
-                        self._pattern = ''.join(self._cmdline)
+                        self._pattern = pattern
         else:
             self._is_and_mode = False
+            self._is_exact = False
             self._pattern = ''.join(self._cmdline)
 
+    def _isExact(self, cmdline):
+        """
+        return True if `cmdline` is matched as a substring rather than fuzzily,
+        i.e., it starts with a quote or it has at least g:Lf_ExactMatchLength characters.
+        two quotes stand for a literal quote, e.g., ''abc is the pattern 'abc.
+        """
+        if not self._supports_exact:
+            return False
+        if cmdline.startswith("'") and not cmdline.startswith("''"):
+            return True
+        length = len(self._stripQuote(cmdline))
+        return self._exact_match_length > 0 and length >= self._exact_match_length
+
+    def _stripQuote(self, cmdline):
+        """
+        remove the leading quote of `cmdline`, a string or a list of characters, which either
+        makes the pattern an exact one or escapes a literal quote, see _isExact().
+        the quote is kept if it can not be matched as a substring.
+        """
+        if (self._supports_exact and cmdline and cmdline[0] == "'"
+                and not (self._is_and_mode or self._refine)):
+            return cmdline[1:]
+        return cmdline
+
     def _join(self, cmdline):
         if not cmdline:
             return ''
@@ -445,9 +481,14 @@ class LfCli(object):
                     lfEval("g:Lf_HighlightIndividual") == '1'):
                 return
             cmdline = [r'\/' if c == '/' else r'\\' if c == '\\' else c
-                       for c in self._cmdline] # \/ for syn match
+                       for c in self._stripQuote(self._cmdline)] # \/ for syn match
+            if not cmdline:
+                return
             if self._is_full_path:
-                regex = r'\c\V' + self._join(cmdline)
+                if self._is_exact:
+                    regex = r'\c\V' + ''.join(cmdline)
+                else:
+                    regex = r'\c\V' + self._join(cmdline)
                 lfCmd("syn match Lf_hl_match display /%s/ containedin="
                       "Lf_hl_nonHelp, Lf_hl_dirname, Lf_hl_filename contained" % regex)
             else:
@@ -471,7 +512,10 @@ class LfCli(object):
                               r"/%s\(\.\*\[\/]\)\@=/ containedin="
                               "Lf_hl_dirname contained" % regex[1])
                 else:
-                    regex = r'\c\V' + self._join(cmdline)
+                    if self._is_exact:
+                        regex = r'\c\V' + ''.join(cmdline)
+                    else:
+                        regex = r'\c\V' + self._join(cmdline)
                     lfCmd("syn match Lf_hl_match display /%s/ "
                           "containedin=Lf_hl_filename contained" % regex)
         else:
@@ -635,6 +679,40 @@ class LfCli(object):
                 return True
         return False
 
+    def _isNarrowed(self, prefix, was_and_mode, was_exact=False):
+        """
+        return True if the current command line is `prefix` with some characters
+        inserted, and the lines that match the current pattern must be a subset of
+        the lines that match the pattern built from `prefix`, so that only the
+        previous results need to be filtered.
+        """
+        if was_exact:
+            # e.g., 'abc' contains 'ab' but not 'ac' -> 'abc'
+            return (self._is_exact and ''.join(self._cmdline).startswith(prefix)
+                    and not (self._is_and_mode or self._refine))
+
+        cmdline = ''.join(self._cmdline)
+        if len(cmdline) < len(prefix):
+            return False
+
+        i = 0
+        while i < len(prefix) and cmdline[i] == prefix[i]:
+            i += 1
+        j = 0
+        while j < len(prefix) - i and cmdline[-1 - j] == prefix[-1 - j]:
+            j += 1
+        if i + j != len(prefix):
+            return False
+
+        inserted = cmdline[i:len(cmdline) - j]
+        if j == 0: # appended
+            # e.g., 'a b' -> 'a b;c', and mode is switched to refinement
+            return not (was_and_mode and self._delimiter in inserted)
+        else:
+            # e.g., 'ab' -> 'a b', the pattern is split into two
+            return (self._is_fuzzy and self._and_delimiter not in inserted
+                    and self._delimiter not in inserted)
+
     @property
     def pattern(self):
         return self._pattern
@@ -651,10 +729,24 @@ class LfCli(object):
     def isAndMode(self):
         return self._is_and_mode
 
+    @property
+    def isExact(self):
+        return self._is_exact
+
     @property
     def isFuzzy(self):
         return self._is_fuzzy
 
+    @property
+    def isReadingInput(self):
+        return self._is_reading_input
+
+    def isInputPending(self):
+        """
+        return True if a key has been typed but not read yet, the key is not consumed.
+        """
+        return lfEval("getchar(1)") != '0'
+
     @cursorController
     def input(self, callback):
         try:
@@ -663,7 +755,10 @@ class LfCli(object):
             start = time.time()
             update = False
             prefix = ""
+            prefix_and_mode = False
+            prefix_exact = False
             block = "1"
+            self._is_reading_input = True
 
             while 1:
                 if len(self._instance._manager._content) < 60000:
@@ -689,7 +784,7 @@ class LfCli(object):
                         if update == True:
                             if time.time() - start >= threshold:
                                 update = False
-                                if ''.join(self._cmdline).startswith(prefix):
+                                if self._isNarrowed(prefix, prefix_and_mode, prefix_exact):
                                     yield '<Update>'
                                 else:
                                     yield '<Shorten>'
@@ -730,6 +825,8 @@ class LfCli(object):
                     if update == False:
                         update = True
                         prefix = ''.join(self._cmdline)
+                        prefix_and_mode = self._is_and_mode
+                        prefix_exact = self._is_exact
 
                     self._insert(char)
                     self._buildPattern()
@@ -740,7 +837,10 @@ class LfCli(object):
                         continue
                     else:
                         update = False
-                        yield '<Update>'
+                        if self._isNarrowed(prefix, prefix_and_mode, prefix_exact):
+                            yield '<Update>'
+                        else:
+                            yield '<Shorten>'
                         start = time.time()
                 else:
                     cmd = ''
@@ -772,6 +872,8 @@ class LfCli(object):
                         if update == False:
                             update = True
                             prefix = ''.join(self._cmdline)
+                            prefix_and_mode = self._is_and_mode
+                            prefix_exact = self._is_exact
 
                         self._backspace()
                         self._buildPattern()
@@ -801,9 +903,18 @@ class LfCli(object):
                         self._buildPattern()
                         yield '<Shorten>'
                     elif equal(cmd, '<C-V>') or equal(cmd, '<S-Insert>'):
+                        if update == False:
+                            prefix = ''.join(self._cmdline)
+                            prefix_and_mode = self._is_and_mode
+                            prefix_exact = self._is_exact
                         self._paste()
                         self._buildPattern()
-                        yield '<Update>'
+                        update = False
+                        if self._isNarrowed(prefix, prefix_and_mode, prefix_exact):
+                            yield '<Update>'
+                        else:
+                            yield '<Shorten>'
+                        start = time.time()
                     elif equal(cmd, '<Home>') or equal(cmd, '<C-B>'):
                         self._toBegin()
                     elif equal(cmd, '<End>') or equal(cmd, '<C-E>'):
@@ -825,3 +936,5 @@ class LfCli(object):
         except vim.error: # for neovim
             lfCmd("call getchar(0)")
             yield '<Quit>'
+        finally:
+            self._is_reading_input = False
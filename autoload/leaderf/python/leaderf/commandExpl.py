@@ -91,6 +91,9 @@ class CommandExplManager(Manager):
     def _getDigest(self, line, mode):
         return line
 
+    def _getDigestSpec(self, mode):
+        return {}
+
     def _getDegestStartPos(self, line, mode):
         return 0
 
@@ -60,6 +60,9 @@ class FiletypeExplManager(Manager):
     def _getDigest(self, line, mode):
         return line
 
+    def _getDigestSpec(self, mode):
+        return {}
+
     def _getDegestStartPos(self, line, mode):
         return 0
 
@@ -253,6 +253,12 @@ class FunctionExplManager(Manager):
         else:
             return line.rsplit("\t", 1)[1][1:-1]
 
+    def _getDigestSpec(self, mode):
+        if mode == 0:
+            return {"prefix_len": 2}
+        else:
+            return {"prefix_len": 2, "separator": "\t", "occurrence": -1}
+
     def _getDigestStartPos(self, line, mode):
         """
         return the start position of the digest returned by _getDigest()
@@ -1191,6 +1191,7 @@ class GtagsExplManager(Manager):
         line = instance._buffer_object[instance.window.cursor[0] - 1]
         if len(self._content) > 0:
             self._content.remove(line)
+            self._corpus = None
             self._getInstance().setStlTotal(len(self._content)//self._getUnit())
             self._getInstance().setStlResultsCount(len(self._content)//self._getUnit())
         # `del vim.current.line` does not work in neovim
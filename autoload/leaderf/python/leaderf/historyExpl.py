@@ -94,6 +94,9 @@ class HistoryExplManager(Manager):
         """
         return line
 
+    def _getDigestSpec(self, mode):
+        return {}
+
     def _getDigestStartPos(self, line, mode):
         """
         return the start position of the digest returned by _getDigest()
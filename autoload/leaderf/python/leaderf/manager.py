@@ -10,6 +10,7 @@ import operator
 import itertools
 import threading
 import multiprocessing
+from array import array
 from functools import partial
 from functools import wraps
 from .instance import LfInstance
@@ -54,6 +55,241 @@ else:
         except UnicodeDecodeError:
             return False
 
+def isUtf8(str):
+    """
+    fuzzyMatchC and fuzzyEngine can only handle UTF-8 strings
+    """
+    return sys.version_info >= (3, 0) or isAscii(str) or lfEval("&encoding") == "utf-8"
+
+def skipCaseFlags(pattern, i):
+    """
+    return the index of the first character from `pattern[i]` that is not part of \\c or \\C
+    """
+    while pattern[i:i+2] in ('\\c', '\\C'):
+        i += 2
+    return i
+
+def vimRegexToPosix(pattern):
+    """
+    translate a Vim regular expression, where 'magic' is on, to a POSIX extended regular expression,
+    so that fuzzyEngine.regexMatch() can be used.
+    return a tuple (regex, ignore_case), `ignore_case` is None unless \\c or \\C is in `pattern`,
+    return None if `pattern` has any item that is not supported.
+    """
+    classes = {
+        's': '[ \t]', 'S': '[^ \t]',
+        'd': '[0-9]', 'D': '[^0-9]',
+        'w': '[0-9A-Za-z_]', 'W': '[^0-9A-Za-z_]',
+        'a': '[A-Za-z]', 'A': '[^A-Za-z]',
+        'x': '[0-9A-Fa-f]', 'X': '[^0-9A-Fa-f]',
+        'h': '[A-Za-z_]', 'H': '[^A-Za-z_]',
+    }
+    if not isAscii(pattern):
+        return None
+
+    result = []
+    ignore_case = None
+    at_start = True         # whether `^` is an anchor and `*` is literal
+    can_repeat = False      # whether the previous item can be followed by a multi
+    i = 0
+    length = len(pattern)
+    while i < length:
+        c = pattern[i]
+        i += 1
+        if c == '\\':
+            if i == length:
+                return None
+            c = pattern[i]
+            i += 1
+            if c in classes:
+                result.append(classes[c])
+            elif c in '.*[]~/^$\\':
+                result.append('\\' + c if c in '.*[^$\\' else c)
+            elif c == 't':
+                result.append('\t')
+            elif c == 'e':
+                result.append('\x1b')
+            elif c in '+=?':
+                if not can_repeat:
+                    return None
+                result.append('+' if c == '+' else '?')
+                can_repeat = False
+                continue
+            elif c == '{':
+                j = pattern.find('}', i)
+                if j == -1 or not can_repeat:
+                    return None
+                bound = pattern[i:j].lstrip('-').rstrip('\\')
+                i = j + 1
+                if bound == '':
+                    result.append('*')
+                else:
+                    bounds = bound.split(',')
+                    if len(bounds) > 2 or not all(b.isdigit() or b == '' for b in bounds):
+                        return None
+                    if bounds[0] == '':
+                        bounds[0] = '0'
+                    result.append('{%s}' % ','.join(bounds))
+                can_repeat = False
+                continue
+            elif c == '|' or c == '(' or (c == '%' and pattern[i:i+1] == '('):
+                if c == '%':
+                    i += 1
+                result.append('|' if c == '|' else '(')
+                at_start = True
+                can_repeat = False
+                continue
+            elif c == ')':
+                result.append(')')
+            elif c == 'c' or c == 'C':
+                # as in Vim, \c wins if both are in `pattern`
+                ignore_case = c == 'c' or bool(ignore_case)
+                continue
+            else:
+                return None
+        elif c == '^' and at_start:
+            result.append('^')
+            continue
+        elif c == '$' and pattern[skipCaseFlags(pattern, i):][:2] in ('', '\\|', '\\)'):
+            result.append('$')
+            can_repeat = False
+            continue
+        elif c == '*':
+            if at_start:
+                result.append('\\*')
+            elif not can_repeat:
+                return None
+            else:
+                result.append('*')
+                can_repeat = False
+                at_start = False
+                continue
+        elif c == '[':
+            j = i
+            if pattern[j:j+1] == '^':
+                j += 1
+            if pattern[j:j+1] == ']':
+                j += 1
+            while j < length and pattern[j] != ']':
+                if pattern[j] == '\\':
+                    return None
+                if pattern[j:j+2] in ('[:', '[=', '[.'):
+                    k = pattern.find(pattern[j+1] + ']', j + 2)
+                    if k == -1:
+                        return None
+                    j = k + 2
+                else:
+                    j += 1
+            if j == length:
+                return None
+            result.append(pattern[i-1:j+1])
+            i = j + 1
+        elif c == '~':
+            return None
+        elif c in '+?|(){}^$':
+            result.append('\\' + c)
+        else:
+            result.append(c)
+
+        at_start = False
+        can_repeat = True
+
+    return (''.join(result), ignore_case)
+
+class LazyResultList(object):
+    """
+    the results of fuzzyEngine appended to `accumulator`, see fuzzyEngine.appendAccumulator(),
+    they are only merged as far as they are used, e.g., only the best lines are merged when
+    they are put into the window, so that all the results are not merged again and again
+    while the content is being read.
+    """
+    def __init__(self, accumulator, size):
+        self._accumulator = accumulator
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._size)
+            if step == 1 and stop < self._size:
+                return fuzzyEngine.getTopResults(self._accumulator, stop)[start:stop]
+            else:
+                return fuzzyEngine.getAllResults(self._accumulator)[start:stop:step]
+        else:
+            if key < 0:
+                key += self._size
+            if key < 0 or key >= self._size:
+                raise IndexError("list index out of range")
+            return self[key:key + 1][0]
+
+    def __iter__(self):
+        return iter(self[:])
+
+# the fuzzyEngine shared by all the managers, see acquireFuzzyEngine()
+_fuzzy_engine = None
+_fuzzy_engine_threads = 0
+_fuzzy_engine_users = 0
+_fuzzy_engine_timer = None
+# whether a manager is waiting for the fuzzyEngine to finish in another thread, see _cancellableFilter(),
+# the fuzzyEngine can only run one call at a time, it raises RuntimeError otherwise
+_fuzzy_engine_busy = False
+# the worker threads of the fuzzyEngine are released after it is idle for this many milliseconds
+FUZZY_ENGINE_IDLE_TIME = 60000
+# the bonus of the most recent line, see _getRecencyBonus(), far less than the difference
+# that a worse match makes to the weight, so that the recency only breaks the ties
+RECENCY_BONUS = 0.001
+
+def acquireFuzzyEngine():
+    """
+    return the fuzzyEngine shared by all the managers, so that there is only
+    one pool of worker threads no matter how many managers have been used.
+    the number of the worker threads is capped by g:Lf_FuzzyEngineThreads.
+    """
+    global _fuzzy_engine, _fuzzy_engine_threads, _fuzzy_engine_users, _fuzzy_engine_timer
+
+    if _fuzzy_engine_timer is not None:
+        lfCmd("call timer_stop(%s)" % _fuzzy_engine_timer)
+        _fuzzy_engine_timer = None
+
+    threads = int(lfEval("get(g:, 'Lf_FuzzyEngineThreads', 0)"))
+    threads = cpu_count if threads <= 0 else min(threads, cpu_count)
+    if (_fuzzy_engine is not None and _fuzzy_engine_users == 0 and threads != _fuzzy_engine_threads
+            and not _fuzzy_engine_busy):
+        fuzzyEngine.closeFuzzyEngine(_fuzzy_engine)
+        _fuzzy_engine = None
+
+    if _fuzzy_engine is None:
+        _fuzzy_engine = fuzzyEngine.createFuzzyEngine(threads, False)
+        _fuzzy_engine_threads = threads
+
+    _fuzzy_engine_users += 1
+    return _fuzzy_engine
+
+def releaseFuzzyEngine():
+    """
+    the worker threads are released if no manager acquires the fuzzyEngine
+    again within FUZZY_ENGINE_IDLE_TIME.
+    """
+    global _fuzzy_engine_users, _fuzzy_engine_timer
+
+    _fuzzy_engine_users -= 1
+    if _fuzzy_engine_users > 0:
+        return
+
+    if lfEval("exists('*timer_start')") == '1':
+        _fuzzy_engine_timer = lfEval("timer_start(%d, 'leaderf#FuzzyEngineIdle')" % FUZZY_ENGINE_IDLE_TIME)
+    elif not _fuzzy_engine_busy:
+        fuzzyEngine.releaseWorkers(_fuzzy_engine)
+
+def releaseFuzzyEngineWorkers():
+    global _fuzzy_engine_timer
+
+    _fuzzy_engine_timer = None
+    if _fuzzy_engine is not None and _fuzzy_engine_users == 0 and not _fuzzy_engine_busy:
+        fuzzyEngine.releaseWorkers(_fuzzy_engine)
+
 
 def modifiableController(func):
     @wraps(func)
@@ -109,6 +345,8 @@ class Manager(object):
         self._instance = None
         self._content = []
         self._index = 0
+        self._cb_content = []
+        self._search_cancelled = False
         self._help_length = 0
         self._show_help = False
         self._selections = {}
@@ -118,6 +356,19 @@ class Manager(object):
         self._highlight_ids = []
         self._orig_line = None
         self._fuzzy_engine = None
+        self._corpus = None
+        self._corpus_content = None
+        self._corpus_size = 0
+        self._corpus_last = None
+        # (file name, key) if the index of the corpus is to be saved, see _indexCorpus()
+        self._corpus_index_file = None
+        self._recency_bonus = None
+        # (content, len(content), bonus), the bonus of the whole content matched by the corpus
+        self._corpus_bonus = None
+        self._accumulator = None
+        self._highlight_cache = {}
+        # 0 if the last fuzzy search did not match the lines with typos
+        self._typo_threshold = 0
         self._result_content = []
         self._reader_thread = None
         self._timer_id = None
@@ -233,6 +484,48 @@ class Manager(object):
         else:
             return getDirname(line)
 
+    def _getDigestSpec(self, mode):
+        """
+        this function can be overridden
+        return the keyword arguments of fuzzyEngine.createDigestParameter() that describe
+        the digest returned by _getDigest(), so that fuzzyEngine can extract the digests by itself,
+        or None if the digest can not be described that way.
+        Args:
+            mode: 0 or 1, the same as that of _getDigest()
+        """
+        return None
+
+    def _getIndexKey(self):
+        """
+        this function can be overridden
+        return a string that identifies the content, e.g., the names and the modification times
+        of the files it is read from, so that the index of the content can be saved and loaded again,
+        or None if the content is not indexed.
+        """
+        return None
+
+    def _getBonus(self, lines):
+        """
+        this function can be overridden
+        return an array('f') whose i-th float is added by fuzzyEngine to the weight of lines[i]
+        if it matches the pattern, so that, e.g., the recently used lines win the ties,
+        or None if there is no bonus.
+        """
+        return None
+
+    def _getRecencyBonus(self, lines):
+        """
+        return the bonuses of `lines` if self._content is ordered by recency,
+        the earlier a line is in self._content, the more bonus it gets.
+        """
+        if self._recency_bonus is None or self._recency_bonus[0] is not self._content:
+            count = float(len(self._content))
+            bonuses = dict((line, RECENCY_BONUS * (count - i) / count) for i, line in enumerate(self._content))
+            self._recency_bonus = (self._content, bonuses)
+
+        bonuses = self._recency_bonus[1]
+        return array('f', [bonuses.get(line, 0.0) for line in lines])
+
     def _getDigestStartPos(self, line, mode):
         """
         this function can be overridden
@@ -336,8 +629,8 @@ class Manager(object):
             id = int(lfEval("matchid"))
             self._match_ids.append(id)
 
-        if is_fuzzyEngine_C:
-            self._fuzzy_engine = fuzzyEngine.createFuzzyEngine(cpu_count, False)
+        if is_fuzzyEngine_C and self._fuzzy_engine is None:
+            self._fuzzy_engine = acquireFuzzyEngine()
 
     def _beforeExit(self):
         if self._getInstance().window.valid:
@@ -346,8 +639,15 @@ class Manager(object):
         self.clearSelections()
         self._getExplorer().cleanup()
         if self._fuzzy_engine:
-            fuzzyEngine.closeFuzzyEngine(self._fuzzy_engine)
+            releaseFuzzyEngine()
             self._fuzzy_engine = None
+        self._corpus = None
+        self._corpus_content = None
+        self._corpus_size = 0
+        self._corpus_last = None
+        self._corpus_index_file = None
+        self._recency_bonus = None
+        self._corpus_bonus = None
 
         if self._reader_thread and self._reader_thread.is_alive():
             self._stop_reader_thread.set()
@@ -1612,6 +1912,12 @@ class Manager(object):
                 return False
 
     def _search(self, content, is_continue=False, step=0):
+        if _fuzzy_engine_busy:
+            # re-entered from a callback while polling the input, search again later
+            self._search_cancelled = True
+            return
+
+        self._search_cancelled = False
         if not is_continue:
             self.clearSelections()
             self._clearHighlights()
@@ -1633,10 +1939,14 @@ class Manager(object):
         else:
             self._regexSearch(content, is_continue, step)
 
+        if self._search_cancelled:
+            return
+
         self._previewResult(False)
 
     def _filter(self, step, filter_method, content, is_continue,
-                use_fuzzy_engine=False, return_index=False):
+                use_fuzzy_engine=False, return_index=False, use_bonus=False, highlight_cache=None,
+                min_results=0):
         """ Construct a list from result of filter_method(content).
 
         Args:
@@ -1644,19 +1954,34 @@ class Manager(object):
             filter_method: A function to apply `content` as parameter and
                 return an iterable.
             content: The list to be filtered.
+            use_bonus: Whether filter_method accepts the `bonus` of fuzzyEngine,
+                see _getBonus().
+            highlight_cache: A dict into which the highlights of the best results
+                are put, see _highlight().
+            min_results: If fewer lines than this match, the others are matched
+                again with typos. It is decided once per search, so it only applies
+                if all the lines are filtered at once.
         """
         unit = self._getUnit()
         step = step // unit * unit
         length = len(content)
+        # self._cb_content may be extended in place
+        saved_state = (self._index, self._cb_content, len(self._cb_content), self._result_content)
+        # [begin, end) of `content` if cur_content is a slice of it
+        content_range = None
         if self._index == 0:
             self._cb_content = []
             self._result_content = []
             self._index = min(step, length)
             cur_content = content[:self._index]
+            content_range = (0, self._index)
         else:
             if not is_continue and self._result_content:
                 if self._cb_content:
                     self._cb_content += self._result_content
+                elif isinstance(self._result_content, LazyResultList):
+                    # self._cb_content may be extended in place
+                    self._cb_content = self._result_content[:]
                 else:
                     self._cb_content = self._result_content
 
@@ -1669,6 +1994,8 @@ class Manager(object):
                 self._cb_content = []
                 if self._index < length:
                     end = min(self._index + left, length)
+                    if not cur_content:
+                        content_range = (self._index, end)
                     cur_content += content[self._index:end]
                     self._index = end
 
@@ -1682,18 +2009,78 @@ class Manager(object):
                 self._previous_result = result
             return (result, highlight_methods)
         elif use_fuzzy_engine:
+            kwargs = {}
+            # the whole content is filtered at once, and it is not being read any more
+            if (min_results > 0 and saved_state[0] == 0 and self._index == length
+                    and not self._cb_content and self._read_finished > 0):
+                kwargs["min_results"] = min_results
+            if highlight_cache is not None:
+                # keyed by the indices of the items in the source of filter_method
+                highlights = {}
+                kwargs["highlight_count"] = int(lfEval("g:Lf_NumberOfHighlight"))
+                kwargs["highlights"] = highlights
             if return_index:
                 mode = 0 if self._cli.isFullPath else 1
-                tmp_content = [self._getDigest(line, mode) for line in cur_content]
-                result = filter_method(source=tmp_content)
-                result = (result[0], [cur_content[i] for i in result[1]])
-            else:
-                result = filter_method(source=cur_content)
-
-            if is_continue:
-                result = fuzzyEngine.merge(self._previous_result, result)
+                # only the first line of each unit is matched, e.g., BufTag's preview lines are not
+                tmp_content = [self._getDigest(line, mode) for line in cur_content[::unit]]
+                if use_bonus:
+                    kwargs["bonus"] = self._getBonus(cur_content[::unit])
+                result = self._cancellableFilter(filter_method, len(tmp_content), source=tmp_content, **kwargs)
+                if result is not None:
+                    if unit > 1:
+                        # the items of the result are units, see _getList() of BufTag
+                        result = (result[0], [cur_content[i*unit:i*unit + unit] for i in result[1]])
+                    else:
+                        result = (result[0], [cur_content[i] for i in result[1]])
+                    if highlight_cache is not None:
+                        # the items matched are the digests of the lines
+                        for i, pos in highlights.items():
+                            line = cur_content[i*unit]
+                            start_pos = self._getDigestStartPos(line, mode)
+                            highlight_cache[line] = [[p[0] + start_pos, p[1]] for p in pos]
+            else:
+                source = cur_content
+                corpus = self._getCorpus(content, content_range)
+                if corpus is not None:
+                    source = content
+                    # the indices of the corpus are those of `content`
+                    if use_bonus:
+                        # computed once for all the chunks of `content`
+                        if (self._corpus_bonus is None or self._corpus_bonus[0] is not content
+                                or self._corpus_bonus[1] != len(content)):
+                            self._corpus_bonus = (content, len(content), self._getBonus(content))
+                        kwargs["bonus"] = self._corpus_bonus[2]
+                    # only the indices of the lines are returned, see LazyResultList
+                    result = self._cancellableFilter(filter_method, len(cur_content), source=corpus,
+                                                     begin=content_range[0], end=content_range[1],
+                                                     return_array=True, **kwargs)
+                    if result is not None and self._corpus_index_file is not None:
+                        self._saveCorpusIndex()
+                else:
+                    if use_bonus:
+                        kwargs["bonus"] = self._getBonus(cur_content)
+                    result = self._cancellableFilter(filter_method, len(cur_content), source=cur_content,
+                                                     **kwargs)
+                if result is not None and highlight_cache is not None:
+                    for i, pos in highlights.items():
+                        highlight_cache[source[i]] = pos
+
+            if result is None:
+                # restore the state so that the same search can be done again
+                index, cb_content, cb_length, result_content = saved_state
+                del cb_content[cb_length:]
+                self._index = index
+                self._cb_content = cb_content
+                self._result_content = result_content
+                self._search_cancelled = not is_continue
+                return None
 
-            self._previous_result = result
+            # the results of the chunks are not merged until they are used, see LazyResultList
+            if not is_continue:
+                self._accumulator = fuzzyEngine.createAccumulator()
+            # the indices of the results matched in the corpus refer to `content`
+            size = fuzzyEngine.appendAccumulator(self._accumulator, result, content)
+            result = (None, LazyResultList(self._accumulator, size))
         else:
             result = list(filter_method(cur_content))
             if is_continue:
@@ -1704,6 +2091,117 @@ class Manager(object):
 
         return result
 
+    def _cancellableFilter(self, filter_method, size, **kwargs):
+        """
+        return filter_method(**kwargs), where filter_method is a function of fuzzyEngine.
+        if it takes a while, it is run in another thread and is cancelled as soon as
+        a key is typed, because its result is obsolete then.
+        return None if it is cancelled.
+        """
+        global _fuzzy_engine_busy
+
+        if _fuzzy_engine_busy:
+            return None
+
+        if size < 50000 or not self._cli.isReadingInput:
+            return filter_method(**kwargs)
+
+        if self._cli.isInputPending():
+            return None
+
+        result = []
+        def run():
+            try:
+                result.append(filter_method(**kwargs))
+            except Exception as e:
+                result.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        cancelled = False
+        _fuzzy_engine_busy = True
+        try:
+            thread.start()
+            # fuzzyEngine releases the GIL while matching, so polling the input does not slow it down
+            while thread.is_alive():
+                thread.join(0.01)
+                if not thread.is_alive():
+                    break
+                # a cancel issued before the task starts would be lost, so cancel until it stops
+                if cancelled or self._cli.isInputPending():
+                    cancelled = True
+                    fuzzyEngine.cancel(self._fuzzy_engine)
+        finally:
+            _fuzzy_engine_busy = False
+
+        if cancelled:
+            return None
+
+        if isinstance(result[0], Exception):
+            raise result[0]
+
+        return result[0]
+
+    def _getCorpus(self, content, content_range):
+        """
+        return a corpus of fuzzyEngine that holds at least content[:content_range[1]],
+        so that the lines are not converted again every time the pattern changes.
+        return None if content is not a prefix of self._content.
+        """
+        if content_range is None or content_range[0] >= content_range[1]:
+            return None
+
+        end = content_range[1]
+        if end > len(self._content) or content[end - 1] is not self._content[end - 1]:
+            return None
+
+        # lines may be removed from or replaced in self._content
+        if (self._corpus is None or self._corpus_content is not self._content
+                or self._corpus_size > len(self._content)
+                or self._corpus_last is not self._content[self._corpus_size - 1]):
+            self._corpus = fuzzyEngine.createCorpus(content[:end])
+            self._corpus_content = self._content
+            self._corpus_size = end
+            self._indexCorpus()
+        elif self._corpus_size < end:
+            fuzzyEngine.appendCorpus(self._corpus, content[self._corpus_size:end])
+            self._corpus_size = end
+
+        self._corpus_last = self._content[self._corpus_size - 1]
+        return self._corpus
+
+    def _indexCorpus(self):
+        """
+        keep an index of self._corpus if the content is large and static, see _getIndexKey(),
+        the index is loaded from the cache if it has been saved for the same content.
+        """
+        self._corpus_index_file = None
+        threshold = int(lfEval("get(g:, 'Lf_IndexThreshold', 1000000)"))
+        if threshold <= 0 or self._corpus_size < threshold:
+            return
+
+        key = self._getIndexKey()
+        if key is None:
+            return
+
+        index_dir = os.path.join(lfEval("g:Lf_CacheDirectory"), 'LeaderF', 'index')
+        if not os.path.exists(index_dir):
+            os.makedirs(index_dir)
+
+        # only the index of the latest content of each category is kept
+        index_file = os.path.join(index_dir, self._getExplorer().getStlCategory())
+        if not fuzzyEngine.loadCorpusIndex(self._corpus, index_file, key):
+            fuzzyEngine.indexCorpus(self._corpus)
+            self._corpus_index_file = (index_file, key)
+
+    def _saveCorpusIndex(self):
+        """
+        save the index of self._corpus to the cache once it has been built by a search.
+        """
+        index_file, key = self._corpus_index_file
+        if fuzzyEngine.saveCorpusIndex(self._corpus, index_file, key):
+            self._corpus_index_file = None
+
     def _fuzzyFilter(self, is_full_path, get_weight, iterable):
         """
         return a list, each item is a pair (weight, line)
@@ -1738,13 +2236,16 @@ class Manager(object):
         return ((i[0] + i[1], i[2]) for i in triples if i[0] > MIN_WEIGHT and i[1] > MIN_WEIGHT)
 
     def _andModeFilter(self, iterable):
+        if self._fuzzy_engine and all(isUtf8(p) for p in self._cli.pattern):
+            return self._fuzzyEngineAndModeFilter(iterable)
+
         encoding = lfEval("&encoding")
         cur_content = iterable
         weight_lists = []
         highlight_methods = []
         for p in self._cli.pattern:
             use_fuzzy_engine = False
-            if self._fuzzy_engine and isAscii(p) and self._getUnit() == 1: # currently, only BufTag's _getUnit() is 2
+            if self._fuzzy_engine and isUtf8(p) and self._getUnit() == 1: # currently, only BufTag's _getUnit() is 2
                 use_fuzzy_engine = True
                 pattern = fuzzyEngine.initPattern(p)
                 if self._getExplorer().getStlCategory() == "File" and self._cli.isFullPath:
@@ -1762,7 +2263,7 @@ class Manager(object):
                 getHighlights = partial(fuzzyEngine.getHighlights, engine=self._fuzzy_engine,
                                         pattern=pattern, is_name_only=not self._cli.isFullPath)
                 highlight_method = partial(self._highlight, self._cli.isFullPath, getHighlights, True, clear=False)
-            elif is_fuzzyMatch_C and isAscii(p):
+            elif is_fuzzyMatch_C and isUtf8(p):
                 pattern = fuzzyMatchC.initPattern(p)
                 if self._getExplorer().getStlCategory() == "File" and self._cli.isFullPath:
                     getWeight = partial(fuzzyMatchC.getWeight, pattern=pattern, is_name_only=False)
@@ -1820,16 +2321,52 @@ class Manager(object):
 
         return ((weights, result_content), highlight_methods)
 
+    def _fuzzyEngineAndModeFilter(self, iterable):
+        """
+        match all the patterns in one pass of fuzzyEngine
+        """
+        if self._getExplorer().getStlCategory() == "File" and self._cli.isFullPath:
+            is_name_only = False
+        elif self._getExplorer().getStlCategory() in ["Self", "Buffer", "Mru", "BufTag",
+                "Function", "History", "Cmd_History", "Search_History", "Tag", "Rg", "Filetype",
+                "Command", "Window", "QuickFix", "LocList"]:
+            is_name_only = True
+        else:
+            is_name_only = not self._cli.isFullPath
+
+        patterns = [fuzzyEngine.initPattern(p) for p in self._cli.pattern]
+        highlight_methods = []
+        for pattern in patterns:
+            getHighlights = partial(fuzzyEngine.getHighlights, engine=self._fuzzy_engine,
+                                    pattern=pattern, is_name_only=not self._cli.isFullPath)
+            highlight_methods.append(partial(self._highlight, self._cli.isFullPath, getHighlights, True, clear=False))
+
+        mode = 0 if self._cli.isFullPath else 1
+        unit = self._getUnit()
+        tmp_content = [self._getDigest(line, mode) for line in iterable[::unit]]
+        weights, indices = fuzzyEngine.fuzzyMatchAnd(engine=self._fuzzy_engine, source=tmp_content,
+                                                     patterns=patterns, is_name_only=is_name_only,
+                                                     sort_results=False)
+
+        if unit > 1: # currently, only BufTag's _getUnit() is 2
+            return ((weights, [iterable[i*unit:i*unit + unit] for i in indices]), highlight_methods)
+        else:
+            return ((weights, [iterable[i] for i in indices]), highlight_methods)
+
     def _fuzzySearch(self, content, is_continue, step):
         encoding = lfEval("&encoding")
         use_fuzzy_engine = False
+        use_bonus = False
+        highlight_cache = None
         use_fuzzy_match_c = False
         do_sort = "--no-sort" not in self._arguments
+        self._typo_threshold = 0
+        two_phase = False
         if self._cli.isAndMode:
             filter_method = self._andModeFilter
         elif self._cli.isRefinement:
             if self._cli.pattern[1] == '':      # e.g. abc;
-                if self._fuzzy_engine and isAscii(self._cli.pattern[0]):
+                if self._fuzzy_engine and isUtf8(self._cli.pattern[0]):
                     use_fuzzy_engine = True
                     return_index = True
                     pattern = fuzzyEngine.initPattern(self._cli.pattern[0])
@@ -1838,7 +2375,7 @@ class Manager(object):
                     getHighlights = partial(fuzzyEngine.getHighlights, engine=self._fuzzy_engine,
                                             pattern=pattern, is_name_only=True)
                     highlight_method = partial(self._highlight, False, getHighlights, True)
-                elif is_fuzzyMatch_C and isAscii(self._cli.pattern[0]):
+                elif is_fuzzyMatch_C and isUtf8(self._cli.pattern[0]):
                     use_fuzzy_match_c = True
                     pattern = fuzzyMatchC.initPattern(self._cli.pattern[0])
                     getWeight = partial(fuzzyMatchC.getWeight, pattern=pattern, is_name_only=True)
@@ -1855,7 +2392,7 @@ class Manager(object):
                     filter_method = partial(self._fuzzyFilter, False, getWeight)
                     highlight_method = partial(self._highlight, False, getHighlights)
             elif self._cli.pattern[0] == '':    # e.g. ;abc
-                if self._fuzzy_engine and isAscii(self._cli.pattern[1]):
+                if self._fuzzy_engine and isUtf8(self._cli.pattern[1]):
                     use_fuzzy_engine = True
                     return_index = True
                     pattern = fuzzyEngine.initPattern(self._cli.pattern[1])
@@ -1864,7 +2401,7 @@ class Manager(object):
                     getHighlights = partial(fuzzyEngine.getHighlights, engine=self._fuzzy_engine,
                                             pattern=pattern, is_name_only=False)
                     highlight_method = partial(self._highlight, True, getHighlights, True)
-                elif is_fuzzyMatch_C and isAscii(self._cli.pattern[1]):
+                elif is_fuzzyMatch_C and isUtf8(self._cli.pattern[1]):
                     use_fuzzy_match_c = True
                     pattern = fuzzyMatchC.initPattern(self._cli.pattern[1])
                     getWeight = partial(fuzzyMatchC.getWeight, pattern=pattern, is_name_only=False)
@@ -1881,7 +2418,7 @@ class Manager(object):
                     filter_method = partial(self._fuzzyFilter, True, getWeight)
                     highlight_method = partial(self._highlight, True, getHighlights)
             else:   # e.g. abc;def
-                if is_fuzzyMatch_C and isAscii(self._cli.pattern[0]):
+                if is_fuzzyMatch_C and isUtf8(self._cli.pattern[0]):
                     is_ascii_0 = True
                     pattern_0 = fuzzyMatchC.initPattern(self._cli.pattern[0])
                     getWeight_0 = partial(fuzzyMatchC.getWeight, pattern=pattern_0, is_name_only=True)
@@ -1895,7 +2432,7 @@ class Manager(object):
                         getWeight_0 = fuzzy_match_0.getWeight
                     getHighlights_0 = fuzzy_match_0.getHighlights
 
-                if is_fuzzyMatch_C and isAscii(self._cli.pattern[1]):
+                if is_fuzzyMatch_C and isUtf8(self._cli.pattern[1]):
                     is_ascii_1 = True
                     pattern_1 = fuzzyMatchC.initPattern(self._cli.pattern[1])
                     getWeight_1 = partial(fuzzyMatchC.getWeight, pattern=pattern_1, is_name_only=False)
@@ -1913,10 +2450,21 @@ class Manager(object):
 
                 filter_method = partial(self._refineFilter, getWeight_0, getWeight_1)
                 highlight_method = partial(self._highlightRefine, getHighlights_0, getHighlights_1)
+
+                # the name and the directory name of a file are what _getDigest() of File returns
+                if (self._fuzzy_engine and self._getExplorer().getStlCategory() == "File"
+                        and isUtf8(self._cli.pattern[0]) and isUtf8(self._cli.pattern[1])):
+                    use_fuzzy_engine = True
+                    return_index = False
+                    filter_method = partial(fuzzyEngine.fuzzyMatchRefine, engine=self._fuzzy_engine,
+                                            name_pattern=fuzzyEngine.initPattern(self._cli.pattern[0]),
+                                            path_pattern=fuzzyEngine.initPattern(self._cli.pattern[1]),
+                                            sort_results=do_sort)
         else:
-            if self._fuzzy_engine and isAscii(self._cli.pattern) and self._getUnit() == 1: # currently, only BufTag's _getUnit() is 2
+            if self._fuzzy_engine and isUtf8(self._cli.pattern):
                 use_fuzzy_engine = True
-                pattern = fuzzyEngine.initPattern(self._cli.pattern)
+                use_bonus = True
+                pattern = fuzzyEngine.initPattern(self._cli.pattern, self._cli.isExact)
                 if self._getExplorer().getStlCategory() == "File":
                     return_index = False
                     if self._cli.isFullPath:
@@ -1969,20 +2517,45 @@ class Manager(object):
                 elif self._getExplorer().getStlCategory() in ["Self", "Buffer", "Mru", "BufTag",
                         "Function", "History", "Cmd_History", "Search_History", "Filetype",
                         "Command", "Window", "QuickFix", "LocList"]:
-                    return_index = True
-                    filter_method = partial(fuzzyEngine.fuzzyMatchEx, engine=self._fuzzy_engine, pattern=pattern,
-                                            is_name_only=True, sort_results=do_sort)
+                    mode = 0 if self._cli.isFullPath else 1
+                    # a unit of lines can not be matched as a whole by fuzzyMatchPart()
+                    digest_spec = self._getDigestSpec(mode) if self._getUnit() == 1 else None
+                    if digest_spec is not None:
+                        return_index = False
+                        filter_method = partial(fuzzyEngine.fuzzyMatchPart, engine=self._fuzzy_engine,
+                                                pattern=pattern, category=fuzzyEngine.Category_Generic,
+                                                param=fuzzyEngine.createDigestParameter(**digest_spec),
+                                                is_name_only=True, sort_results=do_sort)
+                    else:
+                        return_index = True
+                        filter_method = partial(fuzzyEngine.fuzzyMatchEx, engine=self._fuzzy_engine, pattern=pattern,
+                                                is_name_only=True, sort_results=do_sort)
                 else:
                     return_index = True
                     filter_method = partial(fuzzyEngine.fuzzyMatchEx, engine=self._fuzzy_engine, pattern=pattern,
                                             is_name_only=not self._cli.isFullPath, sort_results=do_sort)
 
+                # if fewer lines match, the others are matched again with typos, see _filter()
+                self._typo_threshold = int(lfEval("get(g:, 'Lf_TypoThreshold', 0)"))
+
+                # score only the best lines exactly if there are too many lines
+                two_phase_threshold = int(lfEval("get(g:, 'Lf_TwoPhaseThreshold', 0)"))
+                two_phase = two_phase_threshold > 0 and len(content) >= two_phase_threshold
+
                 getHighlights = partial(fuzzyEngine.getHighlights, engine=self._fuzzy_engine,
                                         pattern=pattern, is_name_only=not self._cli.isFullPath)
-                highlight_method = partial(self._highlight, self._cli.isFullPath, getHighlights, True)
-            elif is_fuzzyMatch_C and isAscii(self._cli.pattern):
+                # the highlights of the best results can be got while filtering only if
+                # filter_method matches the lines the same way as getHighlights()
+                if (filter_method.keywords["is_name_only"] == (not self._cli.isFullPath)
+                        and lfEval("g:Lf_HighlightIndividual") != '0'):
+                    if not is_continue:
+                        self._highlight_cache = {}
+                    highlight_cache = self._highlight_cache
+                highlight_method = partial(self._highlight, self._cli.isFullPath, getHighlights, True,
+                                           highlight_cache=highlight_cache)
+            elif is_fuzzyMatch_C and isUtf8(self._cli.pattern):
                 use_fuzzy_match_c = True
-                pattern = fuzzyMatchC.initPattern(self._cli.pattern)
+                pattern = fuzzyMatchC.initPattern(self._cli.pattern, self._cli.isExact)
                 if self._getExplorer().getStlCategory() == "File" and self._cli.isFullPath:
                     getWeight = partial(fuzzyMatchC.getWeight, pattern=pattern, is_name_only=False)
                     getHighlights = partial(fuzzyMatchC.getHighlights, pattern=pattern, is_name_only=False)
@@ -2018,7 +2591,7 @@ class Manager(object):
                                            fuzzy_match.getHighlights)
 
         if self._cli.isAndMode:
-            if self._fuzzy_engine and isAscii(''.join(self._cli.pattern)):
+            if self._fuzzy_engine and isUtf8(''.join(self._cli.pattern)):
                 step = 20000 * cpu_count
             else:
                 step = 10000
@@ -2036,7 +2609,21 @@ class Manager(object):
                 else:
                     step = 50000 * cpu_count
 
-            _, self._result_content = self._filter(step, filter_method, content, is_continue, True, return_index)
+            # if a result is a unit of lines, self._result_content is not a LazyResultList,
+            # so all the results are sorted
+            if do_sort and self._getUnit() == 1:
+                # the rest is sorted by LazyResultList when it is needed
+                filter_method = partial(filter_method, top_k=self._initial_count)
+                if two_phase:
+                    filter_method = partial(filter_method, two_phase=True)
+            result = self._filter(step, filter_method, content, is_continue, True, return_index, use_bonus,
+                                  highlight_cache, self._typo_threshold)
+            if result is None: # cancelled
+                return
+            if self._getUnit() > 1:
+                self._result_content = list(itertools.chain.from_iterable(result[1]))
+            else:
+                _, self._result_content = result
         else:
             if step == 0:
                 if use_fuzzy_match_c:
@@ -2094,7 +2681,10 @@ class Manager(object):
                                     suffix=suffix, dirname=dirname, icon=icon, sort_results=True)
             step = len(content)
 
-            _, self._result_content = self._filter(step, filter_method, content, is_continue, True)
+            result = self._filter(step, filter_method, content, is_continue, True)
+            if result is None: # cancelled
+                return
+            _, self._result_content = result
         else:
             step = len(content)
             filter_method = partial(self._guessFilter, filename, suffix, dirname, icon)
@@ -2167,7 +2757,12 @@ class Manager(object):
                     id = int(lfEval("matchaddpos('Lf_hl_matchRefine', %s)" % str(pos[j:j+8])))
                 self._highlight_ids.append(id)
 
-    def _highlight(self, is_full_path, get_highlights, use_fuzzy_engine=False, clear=True, hl_group='Lf_hl_match'):
+    def _highlight(self, is_full_path, get_highlights, use_fuzzy_engine=False, clear=True, hl_group='Lf_hl_match',
+                   highlight_cache=None):
+        """
+        highlight_cache: a dict that maps a line to its highlights whose columns are those of the line,
+            the highlights of the best results are put into it by _filter(), see _fuzzySearch().
+        """
         # matchaddpos() is introduced by Patch 7.4.330
         if (lfEval("exists('*matchaddpos')") == '0' or
                 lfEval("g:Lf_HighlightIndividual") == '0'):
@@ -2192,8 +2787,16 @@ class Manager(object):
             content = cb[self._help_length:]
 
         if use_fuzzy_engine:
-            self._highlight_pos = get_highlights(source=[getDigest(line)
-                                                         for line in content[:highlight_number:unit]])
+            lines = content[:highlight_number:unit]
+            if highlight_cache is None:
+                highlight_cache = {}
+            missed_lines = [line for line in lines if line not in highlight_cache]
+            if missed_lines:
+                missed_pos = get_highlights(source=[getDigest(line) for line in missed_lines])
+                for line, pos in zip(missed_lines, missed_pos):
+                    start_pos = self._getDigestStartPos(line, 0 if is_full_path else 1)
+                    highlight_cache[line] = [[p[0] + start_pos, p[1]] for p in pos]
+            self._highlight_pos = [highlight_cache[line] for line in lines]
         else:
             # e.g., self._highlight_pos = [ [ [2,3], [6,2] ], [ [1,4], [7,6], ... ], ... ]
             # where [2, 3] indicates the highlight starts at the 2nd column with the
@@ -2205,10 +2808,12 @@ class Manager(object):
 
         bottom = len(content)
         for i, pos in enumerate(self._highlight_pos):
-            start_pos = self._getDigestStartPos(content[unit*i], 0 if is_full_path else 1)
-            if start_pos > 0:
-                for j in range(len(pos)):
-                    pos[j][0] += start_pos
+            # the columns in highlight_cache are already those of the lines
+            if not use_fuzzy_engine:
+                start_pos = self._getDigestStartPos(content[unit*i], 0 if is_full_path else 1)
+                if start_pos > 0:
+                    for j in range(len(pos)):
+                        pos[j][0] += start_pos
             if self._getInstance().isReverseOrder():
                 pos = [[bottom - unit*i] + p for p in pos]
             else:
@@ -2310,10 +2915,46 @@ class Manager(object):
         except vim.error:
             return iter([])
 
+    def _fuzzyEngineRegexFilter(self, regex, ignore_case, iterable):
+        """
+        match the lines that consist of ASCII characters by fuzzyEngine,
+        and the rest by _regexFilter()
+        """
+        source = [self._getDigest(line, 0) for line in iterable]
+        try:
+            result = fuzzyEngine.regexMatch(engine=self._fuzzy_engine, source=source,
+                                            pattern=regex, ignore_case=ignore_case)
+        except ValueError: # the regex is not supported by regcomp()
+            return self._regexFilter(iterable)
+
+        if result is None:  # cancelled
+            return self._regexFilter(iterable)
+
+        indices, undecided = result
+
+        if undecided:
+            matched = set(self._regexFilter([iterable[i] for i in undecided]))
+            indices = sorted(indices + [i for i in undecided if iterable[i] in matched])
+
+        return [iterable[i] for i in indices]
+
     def _regexSearch(self, content, is_continue, step):
         if not is_continue and not self._cli.isPrefix:
             self._index = 0
-        self._result_content = self._filter(8000, self._regexFilter, content, is_continue)
+
+        regex = None
+        # currently, only BufTag's _getUnit() is 2, which overrides _regexFilter()
+        if self._fuzzy_engine and hasattr(fuzzyEngine, "regexMatch") and self._getUnit() == 1:
+            regex = vimRegexToPosix(self._cli.pattern)
+
+        if regex is not None:
+            ignore_case = regex[1]
+            if ignore_case is None:
+                ignore_case = lfEval("&ignorecase") == '1'
+            filter_method = partial(self._fuzzyEngineRegexFilter, regex[0], ignore_case)
+            self._result_content = self._filter(40000 * cpu_count, filter_method, content, is_continue)
+        else:
+            self._result_content = self._filter(8000, self._regexFilter, content, is_continue)
         self._getInstance().setBuffer(self._result_content[:self._initial_count])
         self._getInstance().setStlResultsCount(len(self._result_content), True)
 
@@ -2934,6 +3575,8 @@ class Manager(object):
 
     def _setResultContent(self):
         if len(self._result_content) > len(self._getInstance().buffer):
+            if isinstance(self._result_content, LazyResultList):
+                self._result_content = self._result_content[:]
             self._getInstance().setBuffer(self._result_content)
         elif self._index == 0:
             self._getInstance().setBuffer(self._content, need_copy=True)
@@ -2951,6 +3594,11 @@ class Manager(object):
             else:
                 raise self._read_content_exception[1]
 
+        if self._search_cancelled:
+            # the pattern has not changed since the search was cancelled
+            self._search(self._content[:len(self._content)])
+            return None
+
         if self._is_content_list:
             if self._cli.pattern and (self._index < len(self._content) or len(self._cb_content) > 0):
                 if self._fuzzy_engine:
@@ -3131,6 +3779,9 @@ class Manager(object):
                 if self._getInstance().getWinPos() == 'popup':
                     if self._getInstance()._window_object.cursor[0] > 1:
                         lfCmd("call win_execute({}, 'norm! gg')".format(self._getInstance().getPopupWinId()))
+                # the lines that match with typos may not be among the previous results
+                if len(self._result_content) < self._typo_threshold:
+                    self._index = 0 # search from beginning
                 self._search(cur_content)
             elif equal(cmd, '<Shorten>'):
                 if self._getInstance().isReverseOrder():
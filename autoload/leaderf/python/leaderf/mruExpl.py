@@ -273,6 +273,19 @@ class MruExplManager(Manager):
                 start_pos = line.find(' "') # what if there is " in file name?
                 return line[start_pos+2 : -1]
 
+    def _getBonus(self, lines):
+        # the files are listed by recency or frecency
+        return self._getRecencyBonus(lines)
+
+    def _getDigestSpec(self, mode):
+        prefix_len = self._getExplorer().getPrefixLength()
+        if mode == 0:
+            return {"prefix_len": prefix_len}
+        elif "--no-split-path" in self._arguments:
+            return None
+        else:
+            return {"prefix_len": prefix_len, "separator": ' "', "rstrip": True}
+
     def _getDigestStartPos(self, line, mode):
         """
         return the start position of the digest returned by _getDigest()
@@ -360,6 +373,7 @@ class MruExplManager(Manager):
         self._explorer.delFromCache(dirname + basename)
         if len(self._content) > 0:
             self._content.remove(line)
+            self._corpus = None
             self._getInstance().setStlTotal(len(self._content)//self._getUnit())
             self._getInstance().setStlResultsCount(len(self._content)//self._getUnit())
         # `del vim.current.line` does not work in neovim
@@ -107,6 +107,12 @@ class QfLocListExplManager(Manager):
             # filepath
             return line.split(":", 3)[0]
 
+    def _getDigestSpec(self, mode):
+        if mode == 0:
+            return {}
+        else:
+            return {"separator": ":", "occurrence": 3, "keep_before": False}
+
     def _getDigestStartPos(self, line, mode):
         """
         return the start position of the digest returned by _getDigest()
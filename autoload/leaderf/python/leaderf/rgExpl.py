@@ -1201,6 +1201,7 @@ class RgExplManager(Manager):
             return
         if len(self._content) > 0:
             self._content.remove(line)
+            self._corpus = None
             self._getInstance().setStlTotal(len(self._content)//self._getUnit())
             self._getInstance().setStlResultsCount(len(self._content)//self._getUnit())
         # `del vim.current.line` does not work in neovim
@@ -99,6 +99,12 @@ class SelfExplManager(Manager):
             start_pos = line.find(' "') # what if there is " in file name?
             return line[start_pos+2 : -1]
 
+    def _getDigestSpec(self, mode):
+        if mode == 0:
+            return {}
+        else:
+            return {"separator": ' "', "rstrip": True}
+
     def _getDigestStartPos(self, line, mode):
         """
         return the start position of the digest returned by _getDigest()
@@ -51,6 +51,12 @@ class TagExplorer(Explorer):
     def getStlCategory(self):
         return 'Tag'
 
+    def getTagFiles(self):
+        """
+        return a list of (name, mtime) of the tags files, in the order in which their tags are in the content
+        """
+        return [(name, value[0]) for name, value in self._file_tags.items()]
+
     def getStlCurDir(self):
         return escQuote(lfEncode(lfGetCwd()))
 
@@ -147,6 +153,10 @@ class TagExplManager(Manager):
         """
         return 0
 
+    def _getIndexKey(self):
+        # the content is read again if any tags file is changed, see TagExplorer.getFreshContent()
+        return '\n'.join("%s %s" % (name, mtime) for name, mtime in self._getExplorer().getTagFiles())
+
     def _createHelp(self):
         help = []
         help.append('" <CR>/<double-click>/o : open file under cursor')
@@ -171,6 +171,13 @@ class WindowExplManager(Manager):
             start_pos = line.find(' "', prefix_len)
             return line[start_pos+2:-1]
 
+    def _getDigestSpec(self, mode):
+        prefix_len = self._getExplorer().getPrefixLength()
+        if mode == 0:
+            return {"prefix_len": prefix_len}
+        else:
+            return {"prefix_len": prefix_len, "separator": ' "'}
+
     def _getDigestStartPos(self, line, mode):
         """
         specify what part in the line to be processed and highlighted
@@ -287,6 +294,7 @@ class WindowExplManager(Manager):
             lfCmd("setlocal modifiable")
         if len(self._content) > 0:
             self._content.remove(line)
+            self._corpus = None
             self._getInstance().setStlTotal(len(self._content)//self._getUnit())
             self._getInstance().setStlResultsCount(len(self._content)//self._getUnit())
 